@@ -1,21 +1,95 @@
 """
 AI 聊天推荐 API
 """
+import asyncio
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import Optional, List
-from app.database import get_db
+from typing import Optional, List, Dict, Any
+from app.database import get_async_db, AsyncSessionLocal
 from app.services.rag_service import RAGService
+from app.services.stream_guard import StreamTracker, guard_disconnect
+from app.services.sse_coalescer import coalesce, format_sse_data
+from app.services.prompts import RECOMMENDATION_CONTEXT_HEADER, recommendation_messages
+from app.model_providers import PromptUsage, prompt_usage, provider_registry, GateRejectedError, GateSlot
 from app.schemas.game import GameResponse
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 rag_service = RAGService()
 
+# 后台任务引用（避免任务在完成前被回收）
+_background_tasks = set()
+
+
+def _run_in_background(coro):
+    """在后台运行协程，不阻塞当前请求"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条 SSE 事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _answer_frames(result: Dict[str, Any], **done: Any) -> List[str]:
+    """不经过 LLM 生成的完整回复（快速路径 / 降级）按事件流格式输出"""
+    return [
+        _sse("token", {"text": result['response']}),
+        _sse("selected_ids", {"ids": result['recommended_game_ids']}),
+        _sse("questions", {"questions": result['suggested_questions']}),
+        _sse("done", {"response": result['response'], "prompt_usage": None, **done})
+    ]
+
+
+async def _fast_path(db: AsyncSession, message: str) -> Optional[Dict[str, Any]]:
+    """只包含过滤 / 排序条件的查询直接查询数据库并用模板回复（不做 embedding 和 LLM 生成，也不占用并发名额）"""
+    if not settings.query_router_enabled:
+        return None
+    return await rag_service.query_router.answer(db, message)
+
+
+async def _admit() -> Optional[GateSlot]:
+    """
+    获取聊天模型并发名额
+    
+    被拒绝（队列已满 / 排队超时）时：开启 chat_overload_fallback 返回 None，调用方改为仅基于检索的推荐；
+    否则返回 503 + Retry-After
+    """
+    try:
+        return await provider_registry.chat_gate.acquire()
+    except GateRejectedError as e:
+        logger.warning(str(e))
+        if settings.chat_overload_fallback:
+            return None
+        raise HTTPException(
+            status_code=503,
+            detail="AI 推荐服务繁忙，请稍后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+class _GatedStreamingResponse(StreamingResponse):
+    """流式响应结束（完成、失败或客户端断开）后归还并发名额"""
+    
+    def __init__(self, content, slot: Optional[GateSlot], **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+
 
 class ChatRequest(BaseModel):
     """聊天请求"""
@@ -33,9 +107,18 @@ class ChatResponse(BaseModel):
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """AI 聊天推荐 (非流式)"""
+    fast = await _fast_path(db, request.message)
+    if fast is not None:
+        return ChatResponse(
+            response=fast['response'],
+            games=[GameResponse.model_validate(game) for game in fast['games'][:3]],
+            suggested_questions=fast['suggested_questions']
+        )
+    
+    slot = await _admit()
     try:
         logger.info(f"[RAG] 收到用户查询: {request.message[:100]}")
         
@@ -47,12 +130,16 @@ async def chat(
             logger.info(f"  [{i+1}] {game.title} (ID: {game.id})")
         
         # 生成推荐（LLM 会从 10 个中选择 3 个，并排除用户提到的游戏）
-        logger.info("[RAG] 生成推荐回复...")
-        result = await rag_service.generate_recommendation_with_selection(
-            db,
-            request.message,
-            context_games
-        )
+        if slot is None:
+            logger.warning("[RAG] 聊天模型过载，返回仅基于检索的推荐")
+            result = rag_service.retrieval_only_recommendation(request.message, context_games)
+        else:
+            logger.info("[RAG] 生成推荐回复...")
+            result = await rag_service.generate_recommendation_with_selection(
+                db,
+                request.message,
+                context_games
+            )
         logger.info(f"[RAG] 生成完成，回复长度: {len(result['response'])}")
         logger.info(f"[RAG] 推荐游戏 IDs: {result['recommended_game_ids']}")
         
@@ -78,6 +165,12 @@ async def chat(
                         if len(recommended_games) >= 3:
                             break
         
+        # 预先生成后续问题的 embedding，用户点击后续问题时直接命中缓存
+        if settings.query_embedding_prefetch and result.get('suggested_questions'):
+            _run_in_background(
+                rag_service.embedding_service.prefetch_queries(result['suggested_questions'])
+            )
+        
         return ChatResponse(
             response=result['response'],
             games=[GameResponse.model_validate(game) for game in recommended_games[:3]],
@@ -101,77 +194,167 @@ async def chat(
             )
         
         raise HTTPException(status_code=500, detail=error_message)
+    finally:
+        if slot is not None:
+            slot.release()
 
 
 @router.post("/chat/stream")
 async def chat_stream(
     request: ChatRequest,
-    db: Session = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """AI 聊天推荐 (流式)"""
+    """AI 聊天推荐 (流式，客户端断开时停止生成；聊天模型过载时返回 503)"""
+    fast = await _fast_path(db, request.message)
+    if fast is not None:
+        return StreamingResponse(
+            iter([format_sse_data(fast['response']), "data: [DONE]\n\n"]),
+            media_type="text/event-stream"
+        )
+    
+    slot = await _admit()
+    tracker = StreamTracker()
+    
     async def generate():
         try:
             logger.info(f"[RAG-Stream] 收到用户查询: {request.message[:100]}")
             
             # 搜索相关游戏
             logger.info("[RAG-Stream] 开始向量检索...")
-            context_games = await rag_service.search_similar_games(db, request.message, limit=5)
+            # 响应体在依赖项退出（会话已关闭）后才执行，检索使用自己的会话，检索完成即归还连接
+            async with AsyncSessionLocal() as session:
+                context_games = await rag_service.search_similar_games(session, request.message, limit=5)
             logger.info(f"[RAG-Stream] 检索到 {len(context_games)} 个相关游戏:")
             for i, game in enumerate(context_games):
                 logger.info(f"  [{i+1}] {game.title} (ID: {game.id})")
             
+            if slot is None:
+                logger.warning("[RAG-Stream] 聊天模型过载，返回仅基于检索的推荐")
+                result = rag_service.retrieval_only_recommendation(request.message, context_games)
+                yield format_sse_data(result['response'])
+                yield "data: [DONE]\n\n"
+                return
+            
             # 构建上下文 - 提供更详细的游戏信息
-            games_to_recommend = context_games[:3]
-            context = "【可推荐的游戏列表】\n"
-            for i, game in enumerate(games_to_recommend, 1):
-                context += f"\n{i}. **{game.title}**"
-                if game.title_english:
-                    context += f" ({game.title_english})"
-                context += "\n"
-                if game.description:
-                    context += f"   简介: {game.description[:300]}...\n"
-                if game.tags:
-                    context += f"   标签: {', '.join(game.tags[:8])}\n"
-                if game.platforms:
-                    context += f"   平台: {', '.join(game.platforms)}\n"
-                if game.user_score:
-                    context += f"   评分: {game.user_score}\n"
+            packed = rag_service.context_packer.pack(
+                context_games[:3], RECOMMENDATION_CONTEXT_HEADER, style="numbered"
+            )
             
-            logger.info(f"[RAG-Stream] 构建上下文完成，长度: {len(context)}")
+            logger.info(f"[RAG-Stream] 构建上下文完成，长度: {len(packed.text)}，约 {packed.tokens} tokens")
             
-            # 构建消息 - 强制 LLM 只从列表中推荐
-            system_prompt = """你是一个专业的游戏推荐助手。
-
-【重要规则】
-1. 你只能从「可推荐的游戏列表」中选择游戏进行推荐
-2. 不要推荐列表之外的任何游戏
-3. 即使你知道其他更合适的游戏，也只能从列表中选择
-4. 为每个推荐的游戏说明推荐理由，解释为什么它符合用户需求
-5. 用自然流畅的语言回复，不要使用编号列表格式"""
-
-            user_prompt = f"""{context}
-
-【用户需求】
-{request.message}
-
-请从上面的游戏列表中，为用户推荐最合适的游戏，并详细说明每个游戏的推荐理由。记住：只能推荐列表中的游戏！"""
-
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
+            # 构建消息 - 强制 LLM 只从列表中推荐（静态系统提示词在前，可复用前缀缓存）
+            messages = recommendation_messages(packed.text, request.message)
             
             logger.info("[RAG-Stream] 开始流式生成回复...")
             
             # 流式生成（需要先 await 获取 async generator）
+            usage = PromptUsage()
+            prompt_usage.set(usage)
             stream_gen = await rag_service.chat_provider.chat(messages, stream=True)
-            async for chunk in stream_gen:
-                yield f"data: {chunk}\n\n"
+            # 合并相邻 token 后每段发送一帧（多行文本拆成多个 data: 字段）
+            frames = coalesce(
+                stream_gen,
+                settings.sse_coalesce_max_bytes,
+                settings.sse_coalesce_max_wait_ms,
+                on_chunk=tracker.add_token
+            )
+            try:
+                async for text in frames:
+                    yield format_sse_data(text)
+            finally:
+                # 提前结束（客户端断开）时关闭到模型服务的流
+                await frames.aclose()
             
-            logger.info("[RAG-Stream] 流式生成完成")
+            logger.info(f"[RAG-Stream] 流式生成完成，Prompt 统计: {usage.to_dict()}")
             yield "data: [DONE]\n\n"
         except Exception as e:
             logger.exception(f"[RAG-Stream] 处理失败: {str(e)}")
             yield f"data: [ERROR] {str(e)}\n\n"
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return _GatedStreamingResponse(
+        guard_disconnect(
+            http_request, generate(), tracker, "RAG-Stream", settings.stream_disconnect_poll_interval
+        ),
+        slot,
+        media_type="text/event-stream"
+    )
+
+
+@router.post("/chat/events")
+async def chat_events(
+    request: ChatRequest,
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    AI 聊天推荐 (SSE 事件流)
+    
+    与 /chat 使用相同的带选择推荐流程，按类型推送事件：
+    - candidates: 检索到的候选游戏卡片（检索完成后立即发送，LLM 生成之前）
+    - token: 推荐文字片段
+    - selected_ids: LLM 选择的游戏 ID
+    - questions: 后续推荐问题
+    - done: 完整推荐文字和 prompt 统计（降级为仅基于检索的推荐时 degraded 为 true，快速路径回复时 route 为 structured）
+    - error: 处理失败
+    
+    客户端断开时停止生成；聊天模型过载时返回 503。
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    fast = await _fast_path(db, request.message)
+    if fast is not None:
+        candidates = _sse("candidates", {
+            "games": [GameResponse.model_validate(game).model_dump(mode="json") for game in fast['games']]
+        })
+        return StreamingResponse(
+            iter([candidates] + _answer_frames(fast, route="structured")),
+            media_type="text/event-stream",
+            headers=headers
+        )
+    
+    slot = await _admit()
+    tracker = StreamTracker()
+    
+    async def generate():
+        try:
+            logger.info(f"[RAG-Events] 收到用户查询: {request.message[:100]}")
+            
+            # 响应体在依赖项退出（会话已关闭）后才执行，检索使用自己的会话
+            async with AsyncSessionLocal() as session:
+                context_games = await rag_service.search_similar_games(session, request.message, limit=10)
+            logger.info(f"[RAG-Events] 检索到 {len(context_games)} 个相关游戏")
+            yield _sse("candidates", {
+                "games": [GameResponse.model_validate(game).model_dump(mode="json") for game in context_games]
+            })
+            
+            if slot is None:
+                logger.warning("[RAG-Events] 聊天模型过载，返回仅基于检索的推荐")
+                result = rag_service.retrieval_only_recommendation(request.message, context_games)
+                for frame in _answer_frames(result, degraded=True):
+                    yield frame
+                return
+            
+            events = rag_service.stream_recommendation_with_selection(
+                request.message, context_games, on_token=tracker.add_token
+            )
+            try:
+                async for event, data in events:
+                    # 预先生成后续问题的 embedding，用户点击后续问题时直接命中缓存
+                    if event == "questions" and settings.query_embedding_prefetch:
+                        _run_in_background(rag_service.embedding_service.prefetch_queries(data["questions"]))
+                    yield _sse(event, data)
+            finally:
+                # 提前结束（客户端断开）时关闭到模型服务的流
+                await events.aclose()
+        except Exception as e:
+            logger.exception(f"[RAG-Events] 处理失败: {str(e)}")
+            yield _sse("error", {"message": str(e)})
+    
+    return _GatedStreamingResponse(
+        guard_disconnect(
+            http_request, generate(), tracker, "RAG-Events", settings.stream_disconnect_poll_interval
+        ),
+        slot,
+        media_type="text/event-stream",
+        headers=headers
+    )
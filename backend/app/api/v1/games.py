@@ -2,9 +2,9 @@
 游戏相关 API
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
-from app.database import get_db
+from app.database import get_async_db
 from app.services.game_service import GameService
 from app.schemas.game import GameResponse, GameListResponse
 
@@ -19,11 +19,11 @@ async def get_games(
     search: Optional[str] = Query(None, description="搜索关键词"),
     platform: Optional[str] = Query(None, description="平台筛选"),
     tag: Optional[str] = Query(None, description="标签筛选"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取游戏列表"""
     skip = (page - 1) * page_size
-    games, total = game_service.get_games(
+    games, total = await game_service.get_games(
         db=db,
         skip=skip,
         limit=page_size,
@@ -44,9 +44,9 @@ async def get_games(
 
 
 @router.get("/games/{game_id}", response_model=GameResponse)
-async def get_game(game_id: int, db: Session = Depends(get_db)):
+async def get_game(game_id: int, db: AsyncSession = Depends(get_async_db)):
     """获取游戏详情"""
-    game = game_service.get_game(db, game_id)
+    game = await game_service.get_game(db, game_id)
     if not game:
         raise HTTPException(status_code=404, detail="游戏不存在")
     return GameResponse.model_validate(game)
@@ -0,0 +1,44 @@
+"""
+运行时统计 API
+"""
+from fastapi import APIRouter
+from typing import Dict, Any
+from app.api.v1.chat import rag_service
+from app.services.catalog_cache import catalog_cache
+from app.services.stream_guard import stream_stats
+from app.services.sse_coalescer import coalesce_stats
+from app.model_providers import provider_registry, prompt_cache_stats
+
+router = APIRouter()
+
+
+@router.get("/stats")
+async def get_stats() -> Dict[str, Any]:
+    """获取运行时统计（缓存命中率等）"""
+    query_cache = rag_service.embedding_service.query_cache
+    embedding_provider = rag_service.embedding_service.provider
+    batcher = rag_service.embedding_service.batcher
+    return {
+        "providers": provider_registry.stats(),
+        "prompt_cache": prompt_cache_stats.stats(),
+        "streams": stream_stats.stats(),
+        "sse_coalescing": coalesce_stats.stats(),
+        "query_embedding_cache": query_cache.stats() if query_cache else None,
+        "query_embedding_batcher": batcher.stats() if batcher else None,
+        "embedding_batches": embedding_provider.batch_stats() if hasattr(embedding_provider, "batch_stats") else None,
+        "corpus": {
+            **rag_service.corpus_state.to_dict(),
+            "retriever": rag_service.retriever.name,
+        },
+        "lexical_index": {
+            "ready": rag_service.lexical_index.ready,
+            "size": rag_service.lexical_index.size,
+        },
+        "catalog_cache": catalog_cache.stats(),
+        "context_packer": rag_service.context_packer.stats(),
+        "query_router": rag_service.query_router.stats(),
+        "query_constraints": {
+            "platforms": len(rag_service.constraint_extractor.platform_vocabulary),
+            "tags": len(rag_service.constraint_extractor.tag_vocabulary),
+        },
+    }
@@ -2,6 +2,7 @@
 数据库连接和会话管理
 """
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
@@ -19,6 +20,33 @@ engine = create_engine(
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_database_url(url: str) -> str:
+    """将同步连接串转换为 asyncpg 连接串"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+# 创建异步数据库引擎（请求路径使用，查询期间不阻塞事件循环）
+# 同步引擎保留给脚本和在线程中执行的后台维护任务
+async_engine = create_async_engine(
+    settings.async_database_url or _async_database_url(settings.database_url),
+    pool_pre_ping=True,
+    pool_size=10,
+    max_overflow=20,
+    echo=False
+)
+
+# 创建异步会话工厂（提交后不过期对象，返回给接口的数据无需再次加载）
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # 创建基础模型类
 Base = declarative_base()
 
@@ -31,3 +59,8 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
+        yield db
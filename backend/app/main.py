@@ -2,10 +2,13 @@
 FastAPI 应用入口
 """
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
-from app.api.v1 import games, recommendations, chat, images
+from app.database import async_engine
+from app.model_providers import provider_registry
+from app.api.v1 import games, recommendations, chat, images, stats
 
 # 配置日志
 logging.basicConfig(
@@ -13,12 +16,32 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动 / 停止后台任务，创建 / 释放模型服务连接"""
+    # 预热模型服务连接（建立连接池、加载模型），失败不影响启动
+    if settings.provider_warmup_enabled:
+        await provider_registry.warmup(timeout=settings.provider_warmup_timeout)
+    # 本地聊天模型空闲时定期保活，避免被 Ollama 卸载
+    provider_registry.start_keep_warm(settings.chat_keep_warm_interval)
+    # 启动向量索引后台同步（hnsw 后端在此构建索引）
+    await chat.rag_service.start()
+    yield
+    await chat.rag_service.stop()
+    if chat.rag_service.embedding_service.query_cache:
+        chat.rag_service.embedding_service.query_cache.close()
+    await provider_registry.aclose()
+    await async_engine.dispose()
+
+
 app = FastAPI(
     title="Game Odyssey API",
     description="游戏推荐系统 API",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS 配置
@@ -35,6 +58,7 @@ app.include_router(games.router, prefix="/api/v1", tags=["games"])
 app.include_router(recommendations.router, prefix="/api/v1", tags=["recommendations"])
 app.include_router(chat.router, prefix="/api/v1", tags=["chat"])
 app.include_router(images.router, prefix="/api/v1", tags=["images"])
+app.include_router(stats.router, prefix="/api/v1", tags=["stats"])
 
 
 @app.get("/")
@@ -2,11 +2,36 @@ from app.model_providers.base_provider import BaseModelProvider
 from app.model_providers.local_provider import LocalModelProvider
 from app.model_providers.openai_provider import OpenAIProvider
 from app.model_providers.anthropic_provider import AnthropicProvider
+from app.model_providers.endpoint_pool import EndpointPool, LoadBalancedTransport
+from app.model_providers.resilient_provider import ResilientProvider, CircuitBreaker, CircuitOpenError
+from app.model_providers.prompt_cache import PromptUsage, prompt_usage, prompt_cache_stats
+from app.model_providers.completion_cache import CompletionCache, CachingChatProvider
+from app.model_providers.concurrency_gate import ConcurrencyGate, GateRejectedError, GateSlot
+from app.model_providers.registry import (
+    ProviderRegistry, provider_registry, create_embedding_provider, create_chat_provider
+)
 
 __all__ = [
     "BaseModelProvider",
     "LocalModelProvider",
     "OpenAIProvider",
-    "AnthropicProvider"
+    "AnthropicProvider",
+    "EndpointPool",
+    "LoadBalancedTransport",
+    "ResilientProvider",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "CompletionCache",
+    "CachingChatProvider",
+    "ConcurrencyGate",
+    "GateRejectedError",
+    "GateSlot",
+    "PromptUsage",
+    "prompt_usage",
+    "prompt_cache_stats",
+    "ProviderRegistry",
+    "provider_registry",
+    "create_embedding_provider",
+    "create_chat_provider"
 ]
 
@@ -1,22 +1,39 @@
 """
 Anthropic API 提供者
 """
+import json
+import time
 import httpx
-from typing import List, Dict, Optional, AsyncIterator
+from typing import List, Dict, Any, Optional, AsyncIterator
 from app.model_providers.base_provider import BaseModelProvider
+from app.model_providers.prompt_cache import record_prompt_usage
 
 class AnthropicProvider(BaseModelProvider):
     """Anthropic API 提供者"""
     
-    def __init__(self, model_name: str, base_url: str = "https://api.anthropic.com/v1", api_key: Optional[str] = None):
+    # 系统提示词标记 cache_control，相同前缀的请求读取缓存（低于模型最小缓存长度时不缓存）
+    prefix_cache = "cache_control"
+    
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = "https://api.anthropic.com/v1",
+        api_key: Optional[str] = None,
+        limits: Optional[httpx.Limits] = None,
+        http2: bool = False,
+        http_transport: Optional[httpx.AsyncBaseTransport] = None,
+        generation_options: Optional[Dict[str, Any]] = None
+    ):
         super().__init__(model_name, base_url, api_key)
+        self.generation_options = dict(generation_options or {})
         self.client = httpx.AsyncClient(
             base_url=base_url,
             headers={
                 "x-api-key": api_key,
                 "anthropic-version": "2023-06-01"
             },
-            timeout=300.0
+            timeout=300.0,
+            **self._client_options(limits, http2, http_transport)
         )
     
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
@@ -26,9 +43,11 @@ class AnthropicProvider(BaseModelProvider):
     async def chat(
         self,
         messages: List[Dict[str, str]],
-        stream: bool = False
+        stream: bool = False,
+        options: Optional[Dict[str, Any]] = None
     ) -> AsyncIterator[str] | str:
         """聊天对话"""
+        generation = self.merge_generation_options(options)
         # 转换消息格式
         system_message = None
         conversation = []
@@ -41,13 +60,20 @@ class AnthropicProvider(BaseModelProvider):
         payload = {
             "model": self.model_name,
             "messages": conversation,
-            "max_tokens": 4096
+            "max_tokens": generation.get("max_tokens", 4096)
         }
+        if "temperature" in generation:
+            payload["temperature"] = generation["temperature"]
         if system_message:
-            payload["system"] = system_message
+            payload["system"] = [
+                {"type": "text", "text": system_message, "cache_control": {"type": "ephemeral"}}
+            ]
         
         if stream:
             async def stream_response():
+                start_time = time.perf_counter()
+                usage: Dict[str, Any] = {}
+                first_token_ms: Optional[float] = None
                 async with self.client.stream(
                     "POST",
                     "/messages",
@@ -55,14 +81,34 @@ class AnthropicProvider(BaseModelProvider):
                 ) as response:
                     async for event in response.aiter_lines():
                         if event.startswith("data: "):
-                            import json
                             data = json.loads(event[6:])
-                            if data["type"] == "content_block_delta":
+                            if data["type"] == "message_start":
+                                usage = data["message"].get("usage", {})
+                            elif data["type"] == "content_block_delta":
+                                if first_token_ms is None:
+                                    first_token_ms = (time.perf_counter() - start_time) * 1000
                                 yield data["delta"]["text"]
+                # 流式响应以首个 token 耗时近似 prefill 耗时
+                self._record_usage(usage, first_token_ms)
             return stream_response()
         else:
             response = await self.client.post("/messages", json=payload)
             response.raise_for_status()
             data = response.json()
+            self._record_usage(data.get("usage", {}))
             return data["content"][0]["text"]
-
+    
+    @staticmethod
+    def _record_usage(usage: Dict[str, Any], first_token_ms: Optional[float] = None):
+        """记录 usage 中的 prompt 统计（input_tokens 不含读取 / 写入缓存的 token）"""
+        if not usage:
+            return
+        cached_tokens = usage.get("cache_read_input_tokens", 0) or 0
+        prompt_tokens = (
+            usage.get("input_tokens", 0) + cached_tokens + (usage.get("cache_creation_input_tokens", 0) or 0)
+        )
+        record_prompt_usage(
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached_tokens,
+            prefill_ms=first_token_ms
+        )
@@ -1,16 +1,78 @@
 """
 基础模型提供者接口
 """
+import logging
 from abc import ABC, abstractmethod
 from typing import List, Optional, Dict, Any, AsyncIterator
 
+import httpx
+from app.model_providers.endpoint_pool import EndpointPool, LoadBalancedTransport
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2 (pip install "httpx[http2]")
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
 class BaseModelProvider(ABC):
     """基础模型提供者"""
     
+    # 聊天 prompt 前缀缓存方式（统计展示用）: kv_reuse / cached_tokens / cache_control，None 为不支持
+    prefix_cache: Optional[str] = None
+    
     def __init__(self, model_name: str, base_url: Optional[str] = None, api_key: Optional[str] = None):
         self.model_name = model_name
         self.base_url = base_url
         self.api_key = api_key
+        self.client: Optional[httpx.AsyncClient] = None
+        # 多端点负载均衡时的端点池
+        self.endpoint_pool: Optional[EndpointPool] = None
+        # 默认生成参数（max_tokens / temperature / num_ctx / keep_alive），调用时传入的 options 覆盖同名项
+        self.generation_options: Dict[str, Any] = {}
+    
+    def merge_generation_options(self, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """合并默认生成参数和单次调用参数（忽略值为 None 的项）"""
+        merged = {**self.generation_options, **(options or {})}
+        return {key: value for key, value in merged.items() if value is not None}
+    
+    def _client_options(
+        self,
+        limits: Optional[httpx.Limits] = None,
+        http2: bool = False,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ) -> Dict[str, Any]:
+        """httpx.AsyncClient 的连接池 / HTTP/2 / 传输层参数（指定 transport 时由传输层管理连接池）"""
+        options: Dict[str, Any] = {}
+        if transport is not None:
+            if isinstance(transport, LoadBalancedTransport):
+                self.endpoint_pool = transport.pool
+            options["transport"] = transport
+            return options
+        if limits is not None:
+            options["limits"] = limits
+        if http2:
+            if HTTP2_AVAILABLE:
+                options["http2"] = True
+            else:
+                logger.warning(f"[Provider] h2 未安装，{self.base_url} 使用 HTTP/1.1 (pip install \"httpx[http2]\")")
+        return options
+    
+    async def warmup_connection(self):
+        """建立到服务端的连接（忽略响应状态），避免首个请求承担连接 / TLS 握手延迟"""
+        if self.client is not None:
+            await self.client.get("/")
+    
+    async def warmup_chat(self):
+        """聊天模型预热，默认只建立连接（避免远程 API 产生额外计费）"""
+        await self.warmup_connection()
+    
+    async def aclose(self):
+        """关闭 HTTP 连接池"""
+        if self.client is not None:
+            await self.client.aclose()
     
     @abstractmethod
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
@@ -19,7 +81,7 @@ class BaseModelProvider(ABC):
         
         Args:
             texts: 文本列表
-            
+        
         Returns:
             embedding 向量列表
         """
@@ -29,7 +91,8 @@ class BaseModelProvider(ABC):
     async def chat(
         self,
         messages: List[Dict[str, str]],
-        stream: bool = False
+        stream: bool = False,
+        options: Optional[Dict[str, Any]] = None
     ) -> AsyncIterator[str] | str:
         """
         聊天对话
@@ -37,7 +100,9 @@ class BaseModelProvider(ABC):
         Args:
             messages: 消息列表
             stream: 是否流式返回
-            
+            options: 本次调用的生成参数（max_tokens / temperature / num_ctx / keep_alive），
+                覆盖 generation_options 中的同名项，提供者不支持的参数被忽略
+        
         Returns:
             响应文本或流式迭代器
         """
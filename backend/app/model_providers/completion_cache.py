@@ -0,0 +1,249 @@
+"""
+LLM 补全缓存
+
+以 (模型名, 消息列表, 生成参数) 的哈希为键缓存聊天补全结果：内存 LRU + TTL，可选持久化到 SQLite
+（按最近访问时间淘汰，超过条数上限时删除最久未访问的记录）。
+流式调用缓存输出片段序列，命中时按原片段重放为流。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+
+from app.model_providers.base_provider import BaseModelProvider
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionCache:
+    """LLM 补全缓存"""
+    
+    def __init__(
+        self,
+        max_size: int = 256,
+        max_disk_entries: int = 5000,
+        ttl: float = 24 * 3600,
+        path: Optional[str] = None
+    ):
+        """
+        Args:
+            max_size: 内存中最多缓存的补全数量
+            max_disk_entries: SQLite 中最多保留的补全数量（按最近访问时间淘汰）
+            ttl: 过期时间（秒）
+            path: SQLite 持久化文件路径，为空则只使用内存缓存
+        """
+        self.max_size = max_size
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.path = path
+        
+        # key -> (chunks, expires_at)
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stream_replays = 0
+    
+    @staticmethod
+    def key(model_name: str, messages: List[Dict[str, str]], options: Optional[Dict[str, Any]] = None) -> str:
+        """模型名 + 消息 + 生成参数的 SHA-256 指纹"""
+        payload = json.dumps(
+            {"model": model_name, "messages": messages, "options": options or {}},
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _get_conn(self) -> Optional[sqlite3.Connection]:
+        """延迟打开 SQLite 连接（调用方需持有锁）"""
+        if not self.path:
+            return None
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    chunks TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions (last_access)"
+            )
+            self._conn.commit()
+        return self._conn
+    
+    def get(self, key: str) -> Optional[List[str]]:
+        """查询缓存，返回输出片段列表；未命中或已过期返回 None"""
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                chunks, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return chunks
+                del self._entries[key]
+            
+            try:
+                conn = self._get_conn()
+                if conn is not None:
+                    row = conn.execute(
+                        "SELECT chunks, expires_at FROM completions WHERE key = ?",
+                        (key,)
+                    ).fetchone()
+                    if row and row[1] > now:
+                        chunks = json.loads(row[0])
+                        conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+                        conn.commit()
+                        self._put(key, chunks, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return chunks
+            except sqlite3.Error as e:
+                logger.warning(f"[CompletionCache] 读取持久化缓存失败: {str(e)}")
+            
+            self.misses += 1
+            return None
+    
+    def set(self, key: str, chunks: List[str]):
+        """写入缓存"""
+        now = time.time()
+        expires_at = now + self.ttl
+        
+        with self._lock:
+            self._put(key, chunks, expires_at)
+            try:
+                conn = self._get_conn()
+                if conn is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO completions (key, chunks, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(chunks, ensure_ascii=False), expires_at, now)
+                    )
+                    conn.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+                    # 超过条数上限时淘汰最久未访问的记录
+                    conn.execute(
+                        """
+                        DELETE FROM completions WHERE key IN (
+                            SELECT key FROM completions ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (self.max_disk_entries,)
+                    )
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[CompletionCache] 写入持久化缓存失败: {str(e)}")
+    
+    def _put(self, key: str, chunks: List[str], expires_at: float):
+        """写入内存 LRU（调用方需持有锁）"""
+        self._entries[key] = (chunks, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stream_replays": self.stream_replays,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+    
+    def close(self):
+        """关闭持久化连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class CachingChatProvider(BaseModelProvider):
+    """为 chat() 增加补全缓存的提供者包装（embedding 调用直接转发）"""
+    
+    def __init__(self, inner: BaseModelProvider, cache: CompletionCache):
+        super().__init__(inner.model_name, inner.base_url, inner.api_key)
+        self.inner = inner
+        self.cache = cache
+        self.client = inner.client
+        self.endpoint_pool = inner.endpoint_pool
+        self.generation_options = inner.generation_options
+    
+    def __getattr__(self, item: str):
+        # 其余方法 / 属性（resilience_stats 等）直接转发给被包装的提供者
+        if item == "inner":
+            raise AttributeError(item)
+        return getattr(self.inner, item)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.embed_texts(texts)
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        options: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str] | str:
+        """聊天对话（命中缓存时不调用模型服务；流式调用重放缓存的输出片段）"""
+        # keep_alive 只影响模型常驻时间，不影响生成结果
+        generation = self.merge_generation_options(options)
+        generation.pop("keep_alive", None)
+        key = CompletionCache.key(self.model_name, messages, generation)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        
+        if stream:
+            if cached is not None:
+                self.cache.stream_replays += 1
+                return self._replay(cached)
+            return self._record(await self.inner.chat(messages, stream=True, options=options), key)
+        
+        if cached is not None:
+            return "".join(cached)
+        response = await self.inner.chat(messages, stream=False, options=options)
+        if isinstance(response, str) and response:
+            await asyncio.to_thread(self.cache.set, key, [response])
+        return response
+    
+    @staticmethod
+    async def _replay(chunks: List[str]) -> AsyncIterator[str]:
+        for chunk in chunks:
+            yield chunk
+            # 让出事件循环，保持与真实流式响应相同的逐片段发送行为
+            await asyncio.sleep(0)
+    
+    async def _record(self, inner_stream: AsyncIterator[str], key: str) -> AsyncIterator[str]:
+        """透传流式输出并记录片段，完整结束后写入缓存（中途断开或出错不缓存）"""
+        chunks: List[str] = []
+        try:
+            async for chunk in inner_stream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            # 调用方提前关闭时同时关闭内层流（释放到模型服务的连接）
+            await inner_stream.aclose()
+        if chunks:
+            await asyncio.to_thread(self.cache.set, key, chunks)
+    
+    async def warmup_chat(self):
+        await self.inner.warmup_chat()
+    
+    async def aclose(self):
+        await self.inner.aclose()
+        self.cache.close()
@@ -0,0 +1,157 @@
+"""
+聊天模型准入控制
+
+单个本地 Ollama 同时处理的生成请求过多时，所有请求一起变慢并一起超时。
+ConcurrencyGate 限制同时进行的 LLM 生成数，超出的请求按到达顺序排队：
+- 队列已满时立即拒绝；
+- 排队超过 queue_timeout 秒仍未轮到时拒绝；
+拒绝时抛出 GateRejectedError，附带按平均占用时长估算的 retry_after（秒），接口据此返回 503 + Retry-After。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Any
+
+
+class GateRejectedError(Exception):
+    """准入被拒绝（队列已满或排队超时）"""
+    
+    def __init__(self, message: str, reason: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason  # queue_full / queue_timeout
+        self.retry_after = retry_after
+
+
+class GateSlot:
+    """已获得的并发名额（release 可重复调用）"""
+    
+    def __init__(self, gate: "ConcurrencyGate", wait_seconds: float):
+        self.gate = gate
+        self.wait_seconds = wait_seconds
+        self.admitted_at = time.monotonic()
+        self._released = False
+    
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.gate._release(time.monotonic() - self.admitted_at)
+
+
+class ConcurrencyGate:
+    """并发上限 + 有界 FIFO 等待队列"""
+    
+    def __init__(self, name: str, max_concurrency: int = 4, max_queue: int = 8, queue_timeout: float = 20.0):
+        """
+        Args:
+            name: 日志 / 统计名称
+            max_concurrency: 同时进行的请求上限，0 为不限制
+            max_queue: 等待队列长度，0 为不排队（达到上限立即拒绝）
+            queue_timeout: 排队最长等待秒数
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        
+        self.admitted = 0
+        self.queued = 0  # 进入等待队列的请求（含排队超时的）
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.peak_waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.released = 0
+        self.total_hold = 0.0
+    
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+    
+    def retry_after(self) -> int:
+        """估算名额空出所需的秒数：平均占用时长 × (排队数 + 1) / 并发上限"""
+        if self.released:
+            avg_hold = self.total_hold / self.released
+        else:
+            avg_hold = self.queue_timeout
+        slots = max(1, self.max_concurrency)
+        return max(1, math.ceil(avg_hold * (self.waiting + 1) / slots))
+    
+    def _reject(self, reason: str) -> GateRejectedError:
+        retry_after = self.retry_after()
+        if reason == "queue_full":
+            self.rejected_queue_full += 1
+            message = f"[{self.name}] 并发已满且等待队列已满（{self.max_queue}），请 {retry_after}s 后重试"
+        else:
+            self.rejected_timeout += 1
+            message = f"[{self.name}] 排队超过 {self.queue_timeout}s，请 {retry_after}s 后重试"
+        return GateRejectedError(message, reason, retry_after)
+    
+    async def acquire(self) -> GateSlot:
+        """获取并发名额，拒绝时抛出 GateRejectedError"""
+        if self.max_concurrency <= 0 or (self.active < self.max_concurrency and not self.waiting):
+            self.active += 1
+            self.admitted += 1
+            return GateSlot(self, 0.0)
+        if self.waiting >= self.max_queue:
+            raise self._reject("queue_full")
+        
+        start_time = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.total_wait += self.queue_timeout
+            self.max_wait = max(self.max_wait, self.queue_timeout)
+            raise self._reject("queue_timeout")
+        except asyncio.CancelledError:
+            # 名额已转交给本请求但调用方被取消（客户端断开），归还名额
+            if waiter.done() and not waiter.cancelled():
+                self._release(0.0)
+            raise
+        finally:
+            if waiter in self._waiters and waiter.done():
+                self._waiters.remove(waiter)
+        
+        wait_seconds = time.monotonic() - start_time
+        self.admitted += 1
+        self.total_wait += wait_seconds
+        self.max_wait = max(self.max_wait, wait_seconds)
+        return GateSlot(self, wait_seconds)
+    
+    def _release(self, hold_seconds: float):
+        """归还名额：直接转交给队首仍在等待的请求"""
+        self.released += 1
+        self.total_hold += hold_seconds
+        self.active -= 1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+                break
+    
+    def stats(self) -> Dict[str, Any]:
+        """队列深度、排队时长和拒绝数"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_ms": round(self.total_wait / self.queued * 1000, 1) if self.queued else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "avg_hold_ms": round(self.total_hold / self.released * 1000, 1) if self.released else 0.0,
+            "retry_after": self.retry_after()
+        }
@@ -0,0 +1,292 @@
+"""
+模型服务多端点负载均衡
+
+同一模型服务部署多个实例时（如多台 Ollama / embedding 服务），配置中以逗号分隔多个 URL。
+LoadBalancedTransport 作为 httpx 传输层，为每个请求选择端点并改写 URL，提供者代码无需改动：
+- least_outstanding: 选择进行中请求最少的端点
+- ewma: 选择 EWMA 延迟 × (进行中请求数 + 1) 最小的端点
+- 单端点并发上限：所有端点都达到上限时等待空闲端点
+- 被动健康检查：连续失败（连接错误 / 超时 / 502 / 503 / 504）达到阈值后摘除一段时间，
+  到期后重新接收请求，再次失败则摘除时间翻倍
+"""
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Callable
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 视为端点故障的 HTTP 状态码
+FAILURE_STATUS_CODES = (502, 503, 504)
+
+# EWMA 延迟平滑系数
+EWMA_ALPHA = 0.3
+
+# 最长摘除时间（秒）
+MAX_EJECTION_SECONDS = 300.0
+
+
+class RoutingHint:
+    """
+    单次调用的路由提示（通过 contextvar 传给传输层）
+    
+    exclude: 不选择的端点（对冲请求避开主请求所在端点）
+    endpoints: 传输层记录的本次调用实际使用的端点
+    """
+    
+    def __init__(self, exclude: Optional[List[str]] = None):
+        self.exclude = exclude or []
+        self.endpoints: List[str] = []
+
+
+routing_hint: ContextVar[Optional[RoutingHint]] = ContextVar("routing_hint", default=None)
+
+
+def parse_endpoints(base_url: str) -> List[str]:
+    """解析逗号分隔的端点列表"""
+    return [url.strip().rstrip("/") for url in base_url.split(",") if url.strip()]
+
+
+class Endpoint:
+    """单个模型服务端点的状态"""
+    
+    def __init__(self, url: str, max_concurrency: int = 0):
+        self.url = httpx.URL(url)
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self._ejection_seconds = 0.0
+    
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+    
+    def has_capacity(self) -> bool:
+        return self.max_concurrency <= 0 or self.outstanding < self.max_concurrency
+    
+    def record_latency(self, seconds: float):
+        if self.ewma_latency is None:
+            self.ewma_latency = seconds
+        else:
+            self.ewma_latency = EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma_latency
+    
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": str(self.url),
+            "healthy": self.available(now),
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "ewma_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ejected_for": round(max(0.0, self.ejected_until - now), 1)
+        }
+
+
+class EndpointPool:
+    """端点选择与被动健康检查"""
+    
+    def __init__(
+        self,
+        urls: List[str],
+        strategy: str = "least_outstanding",
+        max_concurrency: int = 0,
+        failure_threshold: int = 3,
+        ejection_seconds: float = 30.0,
+        acquire_timeout: float = 30.0
+    ):
+        """
+        Args:
+            urls: 端点 URL 列表
+            strategy: 负载均衡策略 least_outstanding / ewma
+            max_concurrency: 单端点最大并发请求数，0 为不限制
+            failure_threshold: 连续失败多少次后摘除端点
+            ejection_seconds: 首次摘除时间（秒），再次摘除时翻倍
+            acquire_timeout: 所有端点都达到并发上限时最多等待的秒数
+        """
+        if not urls:
+            raise ValueError("端点列表为空")
+        if strategy not in ("least_outstanding", "ewma"):
+            raise ValueError(f"不支持的负载均衡策略: {strategy}")
+        self.endpoints = [Endpoint(url, max_concurrency) for url in urls]
+        self.strategy = strategy
+        self.failure_threshold = max(1, failure_threshold)
+        self.ejection_seconds = ejection_seconds
+        self.acquire_timeout = acquire_timeout
+        self._condition: Optional[asyncio.Condition] = None
+    
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+    
+    def _score(self, endpoint: Endpoint):
+        if self.strategy == "ewma":
+            return ((endpoint.ewma_latency or 0.0) * (endpoint.outstanding + 1), endpoint.outstanding)
+        # 进行中请求数相同时轮流选择总请求数较少的端点
+        return (endpoint.outstanding, endpoint.requests)
+    
+    def _pick(self, exclude: Optional[List[str]] = None) -> Optional[Endpoint]:
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if str(endpoint.url) not in (exclude or ())]
+        if not candidates:
+            candidates = self.endpoints
+        healthy = [endpoint for endpoint in candidates if endpoint.available(now)]
+        if not healthy:
+            # 全部被摘除时选择最早恢复的端点，避免直接拒绝请求
+            healthy = [min(candidates, key=lambda endpoint: endpoint.ejected_until)]
+        ready = [endpoint for endpoint in healthy if endpoint.has_capacity()]
+        if not ready:
+            return None
+        return min(ready, key=self._score)
+    
+    async def acquire(self, exclude: Optional[List[str]] = None) -> Endpoint:
+        """选择端点并占用一个并发名额"""
+        endpoint = self._pick(exclude)
+        if endpoint is None:
+            condition = self._get_condition()
+            async with condition:
+                try:
+                    await asyncio.wait_for(
+                        condition.wait_for(lambda: self._pick(exclude) is not None),
+                        timeout=self.acquire_timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise httpx.PoolTimeout(f"所有端点均达到并发上限，等待 {self.acquire_timeout}s 超时")
+                endpoint = self._pick(exclude)
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+    
+    async def release(self, endpoint: Endpoint):
+        """释放并发名额，唤醒等待中的请求"""
+        endpoint.outstanding -= 1
+        if self._condition is not None and endpoint.max_concurrency > 0:
+            async with self._condition:
+                self._condition.notify()
+    
+    def record_success(self, endpoint: Endpoint, latency: float):
+        endpoint.record_latency(latency)
+        endpoint.consecutive_failures = 0
+        endpoint._ejection_seconds = 0.0
+    
+    def record_failure(self, endpoint: Endpoint, reason: str):
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        if len(self.endpoints) == 1:
+            return
+        # 摘除后恢复、尚未成功过的端点再次失败时立即摘除，摘除时间翻倍
+        on_probation = endpoint._ejection_seconds > 0
+        if endpoint.consecutive_failures < self.failure_threshold and not on_probation:
+            return
+        endpoint._ejection_seconds = min(
+            MAX_EJECTION_SECONDS, endpoint._ejection_seconds * 2 or self.ejection_seconds
+        )
+        endpoint.ejected_until = time.monotonic() + endpoint._ejection_seconds
+        endpoint.ejections += 1
+        endpoint.consecutive_failures = 0
+        logger.warning(
+            f"[Endpoint] {endpoint.url} 连续失败 ({reason})，摘除 {endpoint._ejection_seconds:.1f}s"
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "strategy": self.strategy,
+            "endpoints": [endpoint.to_dict(now) for endpoint in self.endpoints]
+        }
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """响应体读取完毕或关闭时释放端点并发名额（流式响应在此之前一直占用名额）"""
+    
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+    
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+    
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                await self._on_close()
+
+
+class LoadBalancedTransport(httpx.AsyncBaseTransport):
+    """按端点池分发请求的 httpx 传输层"""
+    
+    def __init__(
+        self,
+        pool: EndpointPool,
+        limits: Optional[httpx.Limits] = None,
+        http2: bool = False
+    ):
+        self.pool = pool
+        # 第一个端点为客户端的 base_url，请求路径相对它改写到目标端点
+        self._base_path = pool.endpoints[0].url.raw_path.rstrip(b"/")
+        options: Dict[str, Any] = {"http2": http2}
+        if limits is not None:
+            options["limits"] = limits
+        self._transports = {
+            str(endpoint.url): httpx.AsyncHTTPTransport(**options) for endpoint in pool.endpoints
+        }
+    
+    def _rewrite(self, url: httpx.URL, endpoint: Endpoint) -> httpx.URL:
+        raw_path = url.raw_path
+        if self._base_path and raw_path.startswith(self._base_path):
+            raw_path = raw_path[len(self._base_path):]
+        target = endpoint.url
+        return url.copy_with(
+            scheme=target.scheme,
+            host=target.host,
+            port=target.port,
+            raw_path=target.raw_path.rstrip(b"/") + raw_path
+        )
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        hint = routing_hint.get()
+        endpoint = await self.pool.acquire(hint.exclude if hint else None)
+        if hint is not None:
+            hint.endpoints.append(str(endpoint.url))
+        request.url = self._rewrite(request.url, endpoint)
+        request.headers["Host"] = request.url.netloc.decode("ascii")
+        start_time = time.perf_counter()
+        try:
+            response = await self._transports[str(endpoint.url)].handle_async_request(request)
+        except httpx.TransportError as e:
+            self.pool.record_failure(endpoint, type(e).__name__)
+            await self.pool.release(endpoint)
+            raise
+        except BaseException:
+            await self.pool.release(endpoint)
+            raise
+        
+        if response.status_code in FAILURE_STATUS_CODES:
+            self.pool.record_failure(endpoint, f"HTTP {response.status_code}")
+        else:
+            self.pool.record_success(endpoint, time.perf_counter() - start_time)
+        
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, lambda: self.pool.release(endpoint)),
+            extensions=response.extensions
+        )
+    
+    async def aclose(self):
+        for transport in self._transports.values():
+            await transport.aclose()
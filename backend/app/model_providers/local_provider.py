@@ -1,161 +1,412 @@
 """
 本地模型提供者 (Ollama, vLLM 等)
 """
+import base64
+import io
 import httpx
 import logging
 import json
-from typing import List, Dict, Optional, AsyncIterator
+import re
+import time
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import numpy as np
 from app.model_providers.base_provider import BaseModelProvider
+from app.model_providers.prompt_cache import record_prompt_usage
 
 logger = logging.getLogger(__name__)
 
+# 批次连续成功多少次后扩大批次
+BATCH_GROWTH_STREAK = 3
+
+# 二进制 embedding 响应格式（.npy 字节）
+NPY_MEDIA_TYPE = "application/x-npy"
+
+# embedding 传输格式: json (浮点数列表) / base64 (JSON 中的原始字节) / npy (二进制响应)
+EMBEDDING_TRANSPORTS = ("json", "base64", "npy")
+
+# 服务端显存 / 内存不足时的错误特征
+_OOM_PATTERN = re.compile(r"out of memory|\boom\b|unable to allocate|metal::malloc", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：CJK 字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    cjk = sum(1 for ch in text if "\u3040" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af")
+    return cjk + (len(text) - cjk + 3) // 4 + 1
+
+
+class EmbeddingBatchError(Exception):
+    """可通过缩小批次重试的 embedding 请求失败（服务端 OOM / 超时）"""
+    pass
+
+
 class LocalModelProvider(BaseModelProvider):
     """本地模型提供者"""
     
-    def __init__(self, model_name: str, base_url: str = "http://localhost:11434", api_key: Optional[str] = None):
+    # Ollama 自动复用同一槽位中相同前缀的 KV 缓存（/api/chat 没有 context 参数）
+    prefix_cache = "kv_reuse"
+    
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = "http://localhost:11434",
+        api_key: Optional[str] = None,
+        max_batch_size: int = 16,
+        max_batch_tokens: int = 8192,
+        transport: str = "npy",
+        transport_dtype: str = "float32",
+        limits: Optional[httpx.Limits] = None,
+        http2: bool = False,
+        http_transport: Optional[httpx.AsyncBaseTransport] = None,
+        generation_options: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            max_batch_size: 单次 /embed 请求的最大文本数
+            max_batch_tokens: 单次 /embed 请求的估算 token 上限（单个超长文本单独成批）
+            transport: embedding 响应格式 json / base64 / npy
+            transport_dtype: base64 / npy 传输的数据类型 float32 / float16
+            limits: 连接池限制（最大连接数 / keep-alive 连接数 / 空闲过期时间）
+            http2: 是否启用 HTTP/2（需安装 h2）
+            http_transport: 自定义 httpx 传输层（如多端点负载均衡 LoadBalancedTransport）
+            generation_options: 默认生成参数 max_tokens / temperature / num_ctx / keep_alive
+        """
         super().__init__(model_name, base_url, api_key)
-        self.client = httpx.AsyncClient(base_url=base_url, timeout=300.0)
+        self.generation_options = dict(generation_options or {})
+        # 最近一次聊天请求时间（保活任务据此判断模型是否空闲）
+        self.last_used = 0.0
+        if transport not in EMBEDDING_TRANSPORTS:
+            raise ValueError(f"不支持的 embedding 传输格式: {transport}")
+        if transport_dtype not in ("float32", "float16"):
+            raise ValueError(f"不支持的 embedding 传输数据类型: {transport_dtype}")
+        self.transport = transport
+        self.transport_dtype = transport_dtype
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=300.0, **self._client_options(limits, http2, http_transport))
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max_batch_tokens
+        # 自适应批次大小：OOM / 超时时减半，连续成功后翻倍直到 max_batch_size
+        self.batch_size = self.max_batch_size
+        self._success_streak = 0
+        self._stats = {
+            "batches": 0,
+            "texts": 0,
+            "tokens": 0,
+            "bytes": 0,
+            "seconds": 0.0,
+            "shrinks": 0,
+            "grows": 0,
+            "ooms": 0,
+            "timeouts": 0
+        }
+    
+    def batch_stats(self) -> Dict[str, Any]:
+        """批量 embedding 吞吐统计"""
+        stats = dict(self._stats)
+        seconds = stats["seconds"]
+        stats["seconds"] = round(seconds, 3)
+        stats["current_batch_size"] = self.batch_size
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_batch_tokens"] = self.max_batch_tokens
+        stats["transport"] = self.transport if self.transport == "json" else f"{self.transport}/{self.transport_dtype}"
+        stats["bytes_per_text"] = round(stats["bytes"] / stats["texts"], 1) if stats["texts"] else 0.0
+        stats["avg_batch_size"] = round(stats["texts"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["texts_per_second"] = round(stats["texts"] / seconds, 2) if seconds else 0.0
+        stats["tokens_per_second"] = round(stats["tokens"] / seconds, 2) if seconds else 0.0
+        return stats
+    
+    def _next_batch(self, texts: List[str], start: int) -> int:
+        """从 start 开始按批次大小和 token 预算切出一批，返回批次结束位置"""
+        end = start
+        tokens = 0
+        while end < len(texts) and end - start < self.batch_size:
+            text_tokens = estimate_tokens(texts[end])
+            if end > start and tokens + text_tokens > self.max_batch_tokens:
+                break
+            tokens += text_tokens
+            end += 1
+        return end
+    
+    def _shrink_batch(self, reason: str):
+        self._success_streak = 0
+        new_size = max(1, self.batch_size // 2)
+        if new_size != self.batch_size:
+            self._stats["shrinks"] += 1
+            logger.warning(f"[Embedding] {reason}，批次大小 {self.batch_size} -> {new_size}")
+        self.batch_size = new_size
+    
+    def _grow_batch(self):
+        self._success_streak += 1
+        if self._success_streak >= BATCH_GROWTH_STREAK and self.batch_size < self.max_batch_size:
+            new_size = min(self.max_batch_size, self.batch_size * 2)
+            self._stats["grows"] += 1
+            logger.info(f"[Embedding] 连续 {self._success_streak} 批成功，批次大小 {self.batch_size} -> {new_size}")
+            self.batch_size = new_size
+            self._success_streak = 0
     
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        """生成 embedding (MLX本地API)"""
-        embeddings = []
-        # 逐个处理，避免OOM
-        for text in texts:
+        """
+        生成 embedding (MLX本地API)
+        
+        按批次大小和 token 预算分批请求 /embed；服务端 OOM 或超时时批次减半重试，
+        连续成功后再逐步扩大批次。
+        """
+        if not texts:
+            return []
+        return (await self.embed_array(texts)).tolist()
+    
+    async def embed_array(self, texts: List[str]) -> np.ndarray:
+        """生成 embedding，返回 (len(texts), dimension) 的 float32 数组"""
+        arrays: List[np.ndarray] = []
+        start = 0
+        while start < len(texts):
+            end = self._next_batch(texts, start)
+            batch = texts[start:end]
             try:
-                logger.debug(f"请求 embedding，文本长度: {len(text)}")
-                
-                # 使用 /embed 端点，格式: {"texts": [text]}
-                response = await self.client.post(
-                    "/embed",
-                    json={
-                        "texts": [text]  # 单个文本，但API期望列表格式
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                # 调试：记录响应结构
-                debug_info = json.dumps(data, ensure_ascii=False)[:500]
-                logger.debug(f"API 响应: {debug_info}")
-                
-                # 响应格式: {"embeddings": [[...]], "dimension": 2560}
-                result_embeddings = data.get("embeddings", [])
-                expected_dim = data.get("dimension", 2560)
-                
-                if not result_embeddings:
-                    raise Exception(f"API 返回的 embeddings 为空。响应: {debug_info}")
-                
-                # 确保 result_embeddings 是列表
-                if not isinstance(result_embeddings, list):
-                    raise Exception(
-                        f"API 返回的 embeddings 格式错误，期望列表，得到: {type(result_embeddings)}。"
-                        f"响应: {debug_info}"
-                    )
-                
-                if len(result_embeddings) == 0:
-                    raise Exception(f"API 返回的 embeddings 列表为空。响应: {debug_info}")
-                
-                # 获取第一个 embedding（因为只传了一个文本）
-                embedding = result_embeddings[0]
-                
-                # 详细日志
-                logger.debug(f"embedding type: {type(embedding)}, len: {len(embedding) if hasattr(embedding, '__len__') else 'N/A'}")
-                
-                # 验证 embedding 是列表
-                if not isinstance(embedding, list):
-                    raise Exception(
-                        f"Embedding 不是列表格式，得到: {type(embedding).__name__}。"
-                        f"响应预览: {debug_info}"
-                    )
-                
-                # 检查是否是嵌套列表
-                if len(embedding) > 0 and isinstance(embedding[0], list):
-                    raise Exception(
-                        f"Embedding 是嵌套列表结构，API 返回格式错误。"
-                        f"第一层长度: {len(embedding)}, 第二层长度: {len(embedding[0])}。"
-                        f"期望: 单层数字列表，维度 {expected_dim}。"
-                    )
-                
-                # 验证维度
-                embedding_len = len(embedding)
-                
-                if embedding_len != expected_dim:
-                    # 详细错误信息，帮助诊断问题
-                    error_msg = (
-                        f"Embedding 维度不匹配: 期望 {expected_dim}，实际 {embedding_len}。\n"
-                        f"可能原因：\n"
-                        f"1. API 返回了所有 token 的 embedding（如果是 {expected_dim} 的倍数: {embedding_len // expected_dim if embedding_len % expected_dim == 0 else '否'}）\n"
-                        f"2. 模型输出格式错误\n"
-                        f"3. 文本长度: {len(text)} 字符\n"
-                        f"响应预览: {debug_info}"
-                    )
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-                
-                # 验证所有元素都是数字
-                if not all(isinstance(x, (int, float)) for x in embedding[:100]):  # 只检查前100个，提高性能
-                    non_numeric = [type(x).__name__ for x in embedding[:10] if not isinstance(x, (int, float))]
-                    raise Exception(f"Embedding 包含非数字元素。前10个非数字类型: {non_numeric[:5]}")
-                
-                logger.debug(f"成功获取 embedding，维度: {embedding_len}")
-                embeddings.append(embedding)
-                
-            except httpx.ConnectError as e:
-                error_msg = (
-                    f"无法连接到 Embedding 服务 ({self.base_url})。"
-                    f"请确保 Embedding 服务正在运行。"
-                    f"错误详情: {str(e)}"
-                )
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            except httpx.HTTPStatusError as e:
-                raise Exception(f"HTTP 错误 {e.response.status_code}: {e.response.text[:200]}")
-            except Exception as e:
-                raise Exception(f"Embedding 生成失败: {str(e)}")
+                arrays.append(await self._embed_batch(batch))
+            except EmbeddingBatchError as e:
+                if len(batch) == 1:
+                    raise Exception(f"Embedding 生成失败: {str(e)}")
+                self._shrink_batch(str(e))
+                continue
+            self._grow_batch()
+            start = end
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.concatenate(arrays, axis=0)
+    
+    def _request_options(self) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """按传输格式构造 /embed 请求的附加字段和请求头"""
+        if self.transport == "npy":
+            return {"dtype": self.transport_dtype}, {"Accept": f"{NPY_MEDIA_TYPE}, application/json;q=0.5"}
+        if self.transport == "base64":
+            return {"encoding_format": "base64", "dtype": self.transport_dtype}, {}
+        return {}, {}
+    
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """单次 /embed 请求"""
+        batch_tokens = sum(estimate_tokens(text) for text in texts)
+        logger.debug(f"请求 embedding，批次 {len(texts)} 条，估算 {batch_tokens} tokens")
+        start_time = time.perf_counter()
+        options, headers = self._request_options()
+        try:
+            # 使用 /embed 端点，格式: {"texts": [...]}
+            response = await self.client.post(
+                "/embed",
+                json={
+                    "texts": texts,
+                    **options
+                },
+                headers=headers
+            )
+            response.raise_for_status()
+        except httpx.ConnectError as e:
+            error_msg = (
+                f"无法连接到 Embedding 服务 ({self.base_url})。"
+                f"请确保 Embedding 服务正在运行。"
+                f"错误详情: {str(e)}"
+            )
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        except httpx.TimeoutException:
+            self._stats["timeouts"] += 1
+            raise EmbeddingBatchError(f"请求超时 (批次 {len(texts)} 条)")
+        except httpx.HTTPStatusError as e:
+            body = e.response.text[:200]
+            if e.response.status_code == 413 or (
+                e.response.status_code in (500, 503, 507)
+                and _OOM_PATTERN.search(body)
+            ):
+                self._stats["ooms"] += 1
+                raise EmbeddingBatchError(f"服务端内存不足 (批次 {len(texts)} 条): {body}")
+            raise Exception(f"HTTP 错误 {e.response.status_code}: {body}")
+        
+        # 旧版服务端忽略 Accept / encoding_format，按响应的 Content-Type 解码
+        if response.headers.get("content-type", "").startswith(NPY_MEDIA_TYPE):
+            expected_dim = int(response.headers.get("x-embedding-dimension", 0)) or None
+            array = self._decode_npy(response.content)
+        else:
+            data = response.json()
+            expected_dim = data.get("dimension")
+            if data.get("encoding_format") == "base64":
+                array = self._decode_base64(data)
+            else:
+                array = self._decode_json(data)
+        embeddings = self._validate_embeddings(array, texts, expected_dim)
+        
+        self._stats["batches"] += 1
+        self._stats["texts"] += len(texts)
+        self._stats["tokens"] += batch_tokens
+        self._stats["bytes"] += len(response.content)
+        self._stats["seconds"] += time.perf_counter() - start_time
         return embeddings
     
+    @staticmethod
+    def _decode_npy(content: bytes) -> np.ndarray:
+        """解析 .npy 头后直接在响应字节上构造数组（不复制数据）"""
+        buffer = io.BytesIO(content)
+        version = np.lib.format.read_magic(buffer)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buffer)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buffer)
+        if fortran_order or dtype.hasobject:
+            raise Exception(f"API 返回的 npy 格式不支持: dtype={dtype}, fortran_order={fortran_order}")
+        count = int(np.prod(shape))
+        return np.frombuffer(content, dtype=dtype, count=count, offset=buffer.tell()).reshape(shape)
+    
+    @staticmethod
+    def _decode_base64(data: Dict[str, Any]) -> np.ndarray:
+        """解码 base64 小端序原始字节"""
+        dtype = np.dtype(data.get("dtype", "float32")).newbyteorder("<")
+        raw = base64.b64decode(data.get("embeddings", ""))
+        return np.frombuffer(raw, dtype=dtype).reshape(data.get("shape", (-1, data.get("dimension", 2560))))
+    
+    @staticmethod
+    def _decode_json(data: Dict[str, Any]) -> np.ndarray:
+        """解码 JSON 浮点数列表，响应格式: {"embeddings": [[...], ...], "dimension": 2560}"""
+        result_embeddings = data.get("embeddings", [])
+        
+        # 确保 result_embeddings 是列表
+        if not isinstance(result_embeddings, list):
+            raise Exception(
+                f"API 返回的 embeddings 格式错误，期望列表，得到: {type(result_embeddings)}。"
+                f"响应: {str(data)[:500]}"
+            )
+        try:
+            return np.asarray(result_embeddings, dtype=np.float32)
+        except (TypeError, ValueError) as e:
+            # 长度不一致的嵌套列表或非数字元素
+            raise Exception(f"Embedding 格式错误，无法转换为数字矩阵: {str(e)}。响应: {str(data)[:500]}")
+    
+    def _validate_embeddings(
+        self,
+        array: np.ndarray,
+        texts: List[str],
+        expected_dim: Optional[int]
+    ) -> np.ndarray:
+        """校验 embedding 矩阵形状，返回与 texts 一一对应的 float32 数组"""
+        expected_dim = expected_dim or 2560
+        
+        if array.size == 0:
+            raise Exception("API 返回的 embeddings 为空")
+        
+        if array.ndim != 2:
+            raise Exception(
+                f"Embedding 矩阵维度错误: shape {array.shape}，"
+                f"期望 ({len(texts)}, {expected_dim})。"
+            )
+        
+        if array.shape[0] != len(texts):
+            raise Exception(
+                f"API 返回的 embeddings 数量不匹配: 请求 {len(texts)} 条，返回 {array.shape[0]} 条。"
+            )
+        
+        embedding_len = array.shape[1]
+        if embedding_len != expected_dim:
+            # 详细错误信息，帮助诊断问题
+            error_msg = (
+                f"Embedding 维度不匹配: 期望 {expected_dim}，实际 {embedding_len}。\n"
+                f"可能原因：\n"
+                f"1. API 返回了所有 token 的 embedding（如果是 {expected_dim} 的倍数: {embedding_len // expected_dim if embedding_len % expected_dim == 0 else '否'}）\n"
+                f"2. 模型输出格式错误\n"
+                f"3. 文本长度: {[len(text) for text in texts]} 字符"
+            )
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        
+        if not np.isfinite(array).all():
+            raise Exception("Embedding 包含 NaN / Inf")
+        
+        logger.debug(f"成功获取 {array.shape[0]} 个 embedding，维度: {embedding_len}, {array.dtype}")
+        return array.astype(np.float32, copy=False)
+    
+    def _chat_payload(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool,
+        options: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """构建 Ollama /api/chat 请求体（通用生成参数映射为 Ollama options）"""
+        generation = self.merge_generation_options(options)
+        payload: Dict[str, Any] = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": stream
+        }
+        ollama_options: Dict[str, Any] = {}
+        if "max_tokens" in generation:
+            ollama_options["num_predict"] = generation["max_tokens"]
+        for key in ("num_ctx", "temperature"):
+            if key in generation:
+                ollama_options[key] = generation[key]
+        if ollama_options:
+            payload["options"] = ollama_options
+        if "keep_alive" in generation:
+            payload["keep_alive"] = generation["keep_alive"]
+        return payload
+    
+    @staticmethod
+    def _record_usage(data: Dict[str, Any]):
+        """记录 Ollama 响应中的 prompt 统计（时长单位为纳秒；命中前缀缓存时 prompt_eval_count 只含新计算的 token）"""
+        if "prompt_eval_duration" not in data and "prompt_eval_count" not in data:
+            return
+        prefill_ns = data.get("prompt_eval_duration")
+        load_ns = data.get("load_duration")
+        record_prompt_usage(
+            prompt_tokens=data.get("prompt_eval_count"),
+            prefill_ms=prefill_ns / 1e6 if prefill_ns is not None else None,
+            load_ms=load_ns / 1e6 if load_ns is not None else None
+        )
+    
+    async def warmup_chat(self):
+        """
+        Ollama 预热：messages 为空的 /api/chat 请求只加载模型，不生成内容
+        
+        带上 num_ctx 和 keep_alive，使模型以实际请求的上下文长度加载（num_ctx 不同会触发重新加载），
+        并刷新常驻时间。
+        """
+        self.last_used = time.monotonic()
+        payload = self._chat_payload([], stream=False)
+        payload.get("options", {}).pop("num_predict", None)
+        response = await self.client.post("/api/chat", json=payload)
+        response.raise_for_status()
+    
     async def chat(
         self,
         messages: List[Dict[str, str]],
-        stream: bool = False
+        stream: bool = False,
+        options: Optional[Dict[str, Any]] = None
     ) -> AsyncIterator[str] | str:
         """聊天对话 (Ollama)"""
+        self.last_used = time.monotonic()
+        payload = self._chat_payload(messages, stream, options)
         if stream:
             async def stream_response():
                 # Ollama 流式 API
                 async with self.client.stream(
                     "POST",
                     "/api/chat",
-                    json={
-                        "model": self.model_name,
-                        "messages": messages,
-                        "stream": True
-                    }
+                    json=payload
                 ) as response:
                     async for line in response.aiter_lines():
                         if line:
                             try:
                                 data = json.loads(line)
-                                if "message" in data and "content" in data["message"]:
-                                    yield data["message"]["content"]
-                                elif "content" in data:
-                                    yield data["content"]
                             except json.JSONDecodeError:
                                 continue
+                            if data.get("done"):
+                                self._record_usage(data)
+                            if "message" in data and "content" in data["message"]:
+                                yield data["message"]["content"]
+                            elif "content" in data:
+                                yield data["content"]
             return stream_response()
         else:
             # Ollama 非流式 API
             try:
-                response = await self.client.post(
-                    "/api/chat",
-                    json={
-                        "model": self.model_name,
-                        "messages": messages,
-                        "stream": False
-                    }
-                )
+                response = await self.client.post("/api/chat", json=payload)
                 response.raise_for_status()
                 data = response.json()
+                self._record_usage(data)
                 return data.get("message", {}).get("content", "")
             except httpx.ConnectError as e:
                 error_msg = (
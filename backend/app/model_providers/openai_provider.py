@@ -1,19 +1,36 @@
 """
 OpenAI API 提供者
 """
+import json
+import time
 import httpx
-from typing import List, Dict, Optional, AsyncIterator
+from typing import List, Dict, Any, Optional, AsyncIterator
 from app.model_providers.base_provider import BaseModelProvider
+from app.model_providers.prompt_cache import record_prompt_usage
 
 class OpenAIProvider(BaseModelProvider):
     """OpenAI API 提供者"""
     
-    def __init__(self, model_name: str, base_url: str = "https://api.openai.com/v1", api_key: Optional[str] = None):
+    # OpenAI / vLLM / llama.cpp 自动缓存相同前缀，usage 中返回命中的 token 数
+    prefix_cache = "cached_tokens"
+    
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = "https://api.openai.com/v1",
+        api_key: Optional[str] = None,
+        limits: Optional[httpx.Limits] = None,
+        http2: bool = False,
+        http_transport: Optional[httpx.AsyncBaseTransport] = None,
+        generation_options: Optional[Dict[str, Any]] = None
+    ):
         super().__init__(model_name, base_url, api_key)
+        self.generation_options = dict(generation_options or {})
         self.client = httpx.AsyncClient(
             base_url=base_url,
             headers={"Authorization": f"Bearer {api_key}"},
-            timeout=300.0
+            timeout=300.0,
+            **self._client_options(limits, http2, http_transport)
         )
     
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
@@ -29,41 +46,66 @@ class OpenAIProvider(BaseModelProvider):
         data = response.json()
         return [item["embedding"] for item in data["data"]]
     
+    @staticmethod
+    def _record_usage(data: Dict[str, Any], first_token_ms: Optional[float] = None):
+        """记录 usage 中的 prompt 统计（llama.cpp 服务另返回 timings.cache_n / prompt_ms）"""
+        usage = data.get("usage") or {}
+        timings = data.get("timings") or {}
+        if not usage and not timings:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        record_prompt_usage(
+            prompt_tokens=usage.get("prompt_tokens"),
+            cached_tokens=details.get("cached_tokens", timings.get("cache_n")),
+            prefill_ms=timings.get("prompt_ms", first_token_ms)
+        )
+    
     async def chat(
         self,
         messages: List[Dict[str, str]],
-        stream: bool = False
+        stream: bool = False,
+        options: Optional[Dict[str, Any]] = None
     ) -> AsyncIterator[str] | str:
         """聊天对话"""
+        generation = self.merge_generation_options(options)
+        payload: Dict[str, Any] = {
+            "model": self.model_name,
+            "messages": messages
+        }
+        for key in ("max_tokens", "temperature"):
+            if key in generation:
+                payload[key] = generation[key]
+        
         if stream:
             async def stream_response():
+                start_time = time.perf_counter()
+                first_token_ms: Optional[float] = None
                 async with self.client.stream(
                     "POST",
                     "/chat/completions",
-                    json={
-                        "model": self.model_name,
-                        "messages": messages,
-                        "stream": True
-                    }
+                    json={**payload, "stream": True, "stream_options": {"include_usage": True}}
                 ) as response:
                     async for line in response.aiter_lines():
-                        if line.startswith("data: "):
-                            import json
-                            data = json.loads(line[6:])
-                            if "choices" in data and len(data["choices"]) > 0:
-                                delta = data["choices"][0].get("delta", {})
-                                if "content" in delta:
-                                    yield delta["content"]
+                        if not line.startswith("data: ") or line == "data: [DONE]":
+                            continue
+                        data = json.loads(line[6:])
+                        if "choices" in data and len(data["choices"]) > 0:
+                            delta = data["choices"][0].get("delta", {})
+                            if "content" in delta:
+                                if first_token_ms is None:
+                                    first_token_ms = (time.perf_counter() - start_time) * 1000
+                                yield delta["content"]
+                        if data.get("usage") or data.get("timings"):
+                            # 流式响应以首个 token 耗时近似 prefill 耗时
+                            self._record_usage(data, first_token_ms)
             return stream_response()
         else:
             response = await self.client.post(
                 "/chat/completions",
-                json={
-                    "model": self.model_name,
-                    "messages": messages
-                }
+                json=payload
             )
             response.raise_for_status()
             data = response.json()
+            self._record_usage(data)
             return data["choices"][0]["message"]["content"]
 
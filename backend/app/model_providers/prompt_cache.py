@@ -0,0 +1,98 @@
+"""
+Prompt 前缀缓存统计
+
+提供者从模型服务的响应中读取本次调用的 prompt token 数、命中前缀缓存的 token 数和 prefill 耗时，
+写入当前上下文的 PromptUsage（调用方按请求设置 prompt_usage），并汇总到 prompt_cache_stats。
+
+各提供者可获得的信息不同：
+- Ollama: prompt_eval_count（实际计算的 token 数，命中前缀时变少）/ prompt_eval_duration，不返回命中数
+- OpenAI 兼容服务: usage.prompt_tokens_details.cached_tokens；llama.cpp 另返回 timings.cache_n / prompt_ms
+- Anthropic: usage.cache_read_input_tokens（需在系统提示词上设置 cache_control）
+"""
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
+
+
+class PromptUsage:
+    """单次聊天调用的 prompt 处理统计（未知的项为 None）"""
+    
+    def __init__(self):
+        self.prompt_tokens: Optional[int] = None
+        self.cached_tokens: Optional[int] = None
+        self.prefill_ms: Optional[float] = None
+        self.load_ms: Optional[float] = None
+    
+    @property
+    def cache_hit(self) -> Optional[bool]:
+        if self.cached_tokens is None:
+            return None
+        return self.cached_tokens > 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hit": self.cache_hit,
+            "prefill_ms": round(self.prefill_ms, 1) if self.prefill_ms is not None else None,
+            "load_ms": round(self.load_ms, 1) if self.load_ms is not None else None
+        }
+
+
+prompt_usage: ContextVar[Optional[PromptUsage]] = ContextVar("prompt_usage", default=None)
+
+
+class PromptCacheStats:
+    """前缀缓存命中率和 prefill 耗时汇总"""
+    
+    def __init__(self):
+        self.requests = 0
+        self.reported = 0  # 返回了命中 token 数的请求
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prefill_requests = 0
+        self.total_prefill_ms = 0.0
+    
+    def record(self, usage: PromptUsage):
+        self.requests += 1
+        if usage.prompt_tokens is not None:
+            self.prompt_tokens += usage.prompt_tokens
+        if usage.cached_tokens is not None:
+            self.reported += 1
+            self.cached_tokens += usage.cached_tokens
+            if usage.cached_tokens > 0:
+                self.hits += 1
+        if usage.prefill_ms is not None:
+            self.prefill_requests += 1
+            self.total_prefill_ms += usage.prefill_ms
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.reported, 4) if self.reported else None,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "avg_prefill_ms": round(self.total_prefill_ms / self.prefill_requests, 1) if self.prefill_requests else None
+        }
+
+
+# 进程内汇总
+prompt_cache_stats = PromptCacheStats()
+
+
+def record_prompt_usage(
+    prompt_tokens: Optional[int] = None,
+    cached_tokens: Optional[int] = None,
+    prefill_ms: Optional[float] = None,
+    load_ms: Optional[float] = None
+):
+    """提供者调用：写入当前请求的 PromptUsage 并计入汇总"""
+    usage = prompt_usage.get()
+    if usage is None:
+        usage = PromptUsage()
+    usage.prompt_tokens = prompt_tokens
+    usage.cached_tokens = cached_tokens
+    usage.prefill_ms = prefill_ms
+    usage.load_ms = load_ms
+    prompt_cache_stats.record(usage)
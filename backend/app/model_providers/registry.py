@@ -0,0 +1,325 @@
+"""
+模型提供者注册表
+
+进程内共享 embedding / 聊天模型提供者及其 HTTP 连接池：首次使用时按配置创建，
+FastAPI lifespan 启动时预热（建立连接、加载模型），关闭时统一释放连接。
+脚本中使用时在结束前调用 aclose()。
+"""
+import asyncio
+import logging
+import time
+from typing import Optional, Dict, Any, Tuple
+
+import httpx
+
+from app.model_providers.base_provider import BaseModelProvider, HTTP2_AVAILABLE
+from app.model_providers.local_provider import LocalModelProvider
+from app.model_providers.openai_provider import OpenAIProvider
+from app.model_providers.anthropic_provider import AnthropicProvider
+from app.model_providers.endpoint_pool import EndpointPool, LoadBalancedTransport, parse_endpoints
+from app.model_providers.resilient_provider import ResilientProvider
+from app.model_providers.completion_cache import CompletionCache, CachingChatProvider
+from app.model_providers.concurrency_gate import ConcurrencyGate
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _endpoint_transport(
+    base_url: str,
+    limits: httpx.Limits,
+    http2: bool,
+    max_concurrency: int
+) -> Tuple[str, Optional[LoadBalancedTransport]]:
+    """
+    解析逗号分隔的端点列表
+    
+    Returns:
+        (客户端 base_url, 传输层)；单端点且不限制并发时传输层为 None，使用 httpx 默认传输层
+    """
+    urls = parse_endpoints(base_url)
+    if len(urls) <= 1 and max_concurrency <= 0:
+        return base_url, None
+    pool = EndpointPool(
+        urls,
+        strategy=settings.endpoint_balancing,
+        max_concurrency=max_concurrency,
+        failure_threshold=settings.endpoint_failure_threshold,
+        ejection_seconds=settings.endpoint_ejection_seconds,
+        acquire_timeout=settings.endpoint_acquire_timeout
+    )
+    if http2 and not HTTP2_AVAILABLE:
+        logger.warning(f"[Provider] h2 未安装，{base_url} 使用 HTTP/1.1 (pip install \"httpx[http2]\")")
+        http2 = False
+    return urls[0], LoadBalancedTransport(pool, limits=limits, http2=http2)
+
+
+def _with_resilience(provider: BaseModelProvider, name: str) -> BaseModelProvider:
+    """按配置包装容错层（截止时间、重试、对冲、熔断）"""
+    if not settings.provider_resilience_enabled:
+        return provider
+    return ResilientProvider(
+        provider,
+        name=name,
+        embed_deadline=settings.embed_deadline,
+        embed_max_retries=settings.embed_max_retries,
+        retry_backoff=settings.retry_backoff,
+        chat_deadline=settings.chat_deadline,
+        chat_first_token_timeout=settings.chat_first_token_timeout,
+        chat_stream_idle_timeout=settings.chat_stream_idle_timeout,
+        hedge_enabled=settings.hedge_enabled,
+        hedge_chat=settings.hedge_chat,
+        hedge_min_delay=settings.hedge_min_delay,
+        circuit_failure_threshold=settings.circuit_failure_threshold,
+        circuit_reset_timeout=settings.circuit_reset_timeout
+    )
+
+
+def _with_completion_cache(provider: BaseModelProvider) -> BaseModelProvider:
+    """按配置包装 LLM 补全缓存（位于容错层之外，命中时不经过熔断 / 截止时间）"""
+    if not settings.completion_cache_enabled:
+        return provider
+    cache = CompletionCache(
+        max_size=settings.completion_cache_size,
+        max_disk_entries=settings.completion_cache_max_entries,
+        ttl=settings.completion_cache_ttl,
+        path=settings.completion_cache_path
+    )
+    return CachingChatProvider(provider, cache)
+
+
+def create_embedding_provider() -> BaseModelProvider:
+    """根据配置创建 embedding 模型提供者"""
+    provider_type = settings.embedding_model_provider
+    limits = httpx.Limits(
+        max_connections=settings.embedding_http_max_connections,
+        max_keepalive_connections=settings.embedding_http_max_keepalive,
+        keepalive_expiry=settings.embedding_http_keepalive_expiry
+    )
+    base_url, http_transport = _endpoint_transport(
+        settings.embedding_base_url, limits, settings.embedding_http2, settings.embedding_endpoint_max_concurrency
+    )
+    if provider_type == "local":
+        return LocalModelProvider(
+            model_name=settings.embedding_model_name,
+            base_url=base_url,
+            api_key=settings.embedding_api_key,
+            max_batch_size=settings.embedding_max_batch_size,
+            max_batch_tokens=settings.embedding_max_batch_tokens,
+            transport=settings.embedding_transport,
+            transport_dtype=settings.embedding_transport_dtype,
+            limits=limits,
+            http2=settings.embedding_http2,
+            http_transport=http_transport
+        )
+    elif provider_type == "openai":
+        return OpenAIProvider(
+            model_name=settings.embedding_model_name,
+            base_url=base_url,
+            api_key=settings.embedding_api_key,
+            limits=limits,
+            http2=settings.embedding_http2,
+            http_transport=http_transport
+        )
+    else:
+        raise ValueError(f"不支持的 embedding 提供者: {provider_type}")
+
+
+def chat_generation_options() -> Dict[str, Any]:
+    """配置中的默认聊天生成参数"""
+    return {
+        "max_tokens": settings.chat_max_tokens,
+        "temperature": settings.chat_temperature,
+        "num_ctx": settings.chat_num_ctx,
+        "keep_alive": settings.chat_keep_alive
+    }
+
+
+def create_chat_provider() -> BaseModelProvider:
+    """根据配置创建聊天模型提供者"""
+    provider_type = settings.chat_model_provider
+    generation_options = chat_generation_options()
+    limits = httpx.Limits(
+        max_connections=settings.chat_http_max_connections,
+        max_keepalive_connections=settings.chat_http_max_keepalive,
+        keepalive_expiry=settings.chat_http_keepalive_expiry
+    )
+    base_url, http_transport = _endpoint_transport(
+        settings.chat_base_url, limits, settings.chat_http2, settings.chat_endpoint_max_concurrency
+    )
+    if provider_type == "local":
+        return LocalModelProvider(
+            model_name=settings.chat_model_name,
+            base_url=base_url,
+            api_key=settings.chat_api_key,
+            limits=limits,
+            http2=settings.chat_http2,
+            http_transport=http_transport,
+            generation_options=generation_options
+        )
+    elif provider_type == "openai":
+        return OpenAIProvider(
+            model_name=settings.chat_model_name,
+            base_url=base_url,
+            api_key=settings.chat_api_key,
+            limits=limits,
+            http2=settings.chat_http2,
+            http_transport=http_transport,
+            generation_options=generation_options
+        )
+    elif provider_type == "anthropic":
+        return AnthropicProvider(
+            model_name=settings.chat_model_name,
+            base_url=base_url,
+            api_key=settings.chat_api_key,
+            limits=limits,
+            http2=settings.chat_http2,
+            http_transport=http_transport,
+            generation_options=generation_options
+        )
+    else:
+        raise ValueError(f"不支持的聊天模型提供者: {provider_type}")
+
+
+class ProviderRegistry:
+    """模型提供者注册表"""
+    
+    def __init__(self):
+        self._embedding: Optional[BaseModelProvider] = None
+        self._chat: Optional[BaseModelProvider] = None
+        self._chat_gate: Optional[ConcurrencyGate] = None
+        # 预热结果: {"embedding": {"ok": bool, "ms": float, "error": str}, ...}
+        self._warmup: Dict[str, Dict[str, Any]] = {}
+        self._keep_warm_task: Optional[asyncio.Task] = None
+        self._keep_warm_stats = {"pings": 0, "failures": 0}
+    
+    @property
+    def embedding(self) -> BaseModelProvider:
+        if self._embedding is None:
+            self._embedding = _with_resilience(create_embedding_provider(), "embedding")
+        return self._embedding
+    
+    @property
+    def chat(self) -> BaseModelProvider:
+        if self._chat is None:
+            self._chat = _with_completion_cache(_with_resilience(create_chat_provider(), "chat"))
+        return self._chat
+    
+    @property
+    def chat_gate(self) -> ConcurrencyGate:
+        """聊天接口的准入控制（限制同时进行的 LLM 生成数，预热 / 保活请求不经过）"""
+        if self._chat_gate is None:
+            self._chat_gate = ConcurrencyGate(
+                f"{settings.chat_model_provider}-chat",
+                max_concurrency=settings.chat_max_concurrency,
+                max_queue=settings.chat_queue_size,
+                queue_timeout=settings.chat_queue_timeout
+            )
+        return self._chat_gate
+    
+    async def warmup(self, timeout: float = 30.0):
+        """
+        预热连接和模型（失败只记录日志，不影响启动）
+        
+        embedding: 生成一条很短的文本的 embedding（建立连接、加载模型）
+        chat: 由提供者决定（本地 Ollama 加载模型，远程 API 只建立连接）
+        """
+        await asyncio.gather(
+            self._warmup_one("embedding", self.embedding.embed_texts(["warmup"]), timeout),
+            self._warmup_one("chat", self.chat.warmup_chat(), timeout)
+        )
+    
+    async def _warmup_one(self, name: str, coro, timeout: float):
+        start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(coro, timeout=timeout)
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+            self._warmup[name] = {"ok": True, "ms": round(elapsed_ms, 1)}
+            logger.info(f"[Provider] {name} 预热完成，耗时 {elapsed_ms:.0f}ms")
+        except Exception as e:
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+            error = str(e) or type(e).__name__
+            self._warmup[name] = {"ok": False, "ms": round(elapsed_ms, 1), "error": error[:200]}
+            logger.warning(f"[Provider] {name} 预热失败: {error}")
+    
+    def start_keep_warm(self, interval: float):
+        """
+        启动聊天模型保活任务（仅本地 Ollama）
+        
+        模型空闲超过 interval 秒时发送预热请求刷新 keep_alive，避免空闲后首个用户承担模型加载时间。
+        """
+        if interval <= 0 or settings.chat_model_provider != "local" or self._keep_warm_task is not None:
+            return
+        self._keep_warm_task = asyncio.create_task(self._keep_warm_loop(interval))
+        logger.info(f"[Provider] 聊天模型保活已启动，空闲 {interval:.0f}s 后发送保活请求")
+    
+    async def _keep_warm_loop(self, interval: float):
+        while True:
+            chat = self.chat
+            idle = time.monotonic() - getattr(chat, "last_used", 0.0)
+            if idle < interval:
+                await asyncio.sleep(interval - idle)
+                continue
+            try:
+                await chat.warmup_chat()
+                self._keep_warm_stats["pings"] += 1
+            except Exception as e:
+                self._keep_warm_stats["failures"] += 1
+                logger.warning(f"[Provider] 聊天模型保活请求失败: {str(e)}")
+                await asyncio.sleep(interval)
+    
+    async def aclose(self):
+        """关闭所有提供者的连接池（之后再次访问时重新创建）"""
+        if self._keep_warm_task is not None:
+            self._keep_warm_task.cancel()
+            try:
+                await self._keep_warm_task
+            except asyncio.CancelledError:
+                pass
+            self._keep_warm_task = None
+        providers = [provider for provider in (self._embedding, self._chat) if provider is not None]
+        self._embedding = None
+        self._chat = None
+        for provider in providers:
+            try:
+                await provider.aclose()
+            except Exception as e:
+                logger.warning(f"[Provider] 关闭 {provider.base_url} 连接失败: {str(e)}")
+    
+    @staticmethod
+    def _unwrap(provider: BaseModelProvider) -> BaseModelProvider:
+        """去掉容错 / 缓存包装，返回实际的提供者"""
+        while isinstance(provider, (ResilientProvider, CachingChatProvider)):
+            provider = provider.inner
+        return provider
+    
+    def stats(self) -> Dict[str, Any]:
+        """提供者配置与预热结果"""
+        def describe(name: str, provider: Optional[BaseModelProvider], http2: bool) -> Optional[Dict[str, Any]]:
+            if provider is None:
+                return None
+            return {
+                "provider": type(self._unwrap(provider)).__name__,
+                "model": provider.model_name,
+                "base_url": provider.base_url,
+                "http2": http2,
+                "warmup": self._warmup.get(name),
+                "endpoints": provider.endpoint_pool.stats() if provider.endpoint_pool else None,
+                "resilience": provider.resilience_stats() if hasattr(provider, "resilience_stats") else None,
+                "completion_cache": provider.cache.stats() if isinstance(provider, CachingChatProvider) else None
+            }
+        
+        chat = describe("chat", self._chat, settings.chat_http2)
+        if chat is not None:
+            chat["generation_options"] = self._chat.generation_options
+            chat["prefix_cache"] = self._unwrap(self._chat).prefix_cache
+            chat["keep_warm"] = {"running": self._keep_warm_task is not None, **self._keep_warm_stats}
+            chat["admission"] = self.chat_gate.stats()
+        return {
+            "embedding": describe("embedding", self._embedding, settings.embedding_http2),
+            "chat": chat
+        }
+
+
+# 进程内共享的模型提供者
+provider_registry = ProviderRegistry()
@@ -0,0 +1,334 @@
+"""
+模型提供者容错层
+
+包装任意 BaseModelProvider，为 embed_texts / chat 调用增加：
+- 截止时间：embedding / 非流式聊天整体超时；流式聊天限制首个 token 和相邻 token 的间隔
+- 重试：embedding 调用幂等，失败后按指数退避 + 随机抖动重试（不超过截止时间）
+- 对冲请求：多端点部署时，主请求耗时超过历史 p95 仍未返回，向另一个端点发送相同请求，先返回者胜出
+- 熔断器：连续失败达到阈值后快速失败（embedding 失败时检索降级到词法 / 文本搜索），
+  冷却期结束后放行一次试探请求，成功则恢复
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Awaitable
+
+from app.model_providers.base_provider import BaseModelProvider
+from app.model_providers.endpoint_pool import RoutingHint, routing_hint
+
+logger = logging.getLogger(__name__)
+
+# 计算 p95 的最近成功调用延迟样本数
+LATENCY_WINDOW = 200
+
+# 样本数不足时不使用 p95，对冲延迟取 hedge_min_delay
+MIN_LATENCY_SAMPLES = 20
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被快速拒绝"""
+    pass
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器（closed -> open -> half_open -> closed）"""
+    
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._trial_started: Optional[float] = None
+    
+    def before_call(self):
+        """调用前检查；打开状态下抛出 CircuitOpenError"""
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        elapsed = now - self.opened_at
+        if self.state == "open" and elapsed >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and (
+            self._trial_started is None or now - self._trial_started >= self.reset_timeout
+        ):
+            # 冷却结束，放行一次试探请求（试探请求没有结果时，下个冷却期后再放行）
+            self._trial_started = now
+            return
+        self.rejected += 1
+        raise CircuitOpenError(
+            f"{self.name} 模型服务熔断中（连续失败），{max(0.0, self.reset_timeout - elapsed):.0f}s 后重试"
+        )
+    
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"[Resilience] {self.name} 熔断恢复")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._trial_started = None
+    
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_started = None
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                logger.warning(
+                    f"[Resilience] {self.name} 连续失败 {self.consecutive_failures} 次，熔断 {self.reset_timeout:.0f}s"
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opens": self.opens,
+            "rejected": self.rejected
+        }
+
+
+class LatencyTracker:
+    """最近成功调用的延迟分布"""
+    
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+    
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+    
+    def p95(self) -> Optional[float]:
+        if len(self._samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class ResilientProvider(BaseModelProvider):
+    """模型提供者容错包装"""
+    
+    def __init__(
+        self,
+        inner: BaseModelProvider,
+        name: str,
+        embed_deadline: float = 30.0,
+        embed_max_retries: int = 2,
+        retry_backoff: float = 0.2,
+        chat_deadline: float = 120.0,
+        chat_first_token_timeout: float = 60.0,
+        chat_stream_idle_timeout: float = 30.0,
+        hedge_enabled: bool = True,
+        hedge_chat: bool = False,
+        hedge_min_delay: float = 0.05,
+        circuit_failure_threshold: int = 5,
+        circuit_reset_timeout: float = 30.0
+    ):
+        """
+        Args:
+            inner: 被包装的提供者
+            name: 名称（日志 / 统计用，如 embedding、chat）
+            embed_deadline: embed_texts 整体截止时间（秒，包含重试）
+            embed_max_retries: embed_texts 最多重试次数
+            retry_backoff: 重试退避基数（秒），第 n 次重试等待 uniform(0, backoff * 2^(n-1))
+            chat_deadline: 非流式聊天截止时间（秒）
+            chat_first_token_timeout: 流式聊天等待首个 token 的超时（秒）
+            chat_stream_idle_timeout: 流式聊天相邻 token 的最大间隔（秒）
+            hedge_enabled: 是否对 embedding 调用发送对冲请求（需多端点）
+            hedge_chat: 是否对非流式聊天发送对冲请求（会增加 LLM 负载）
+            hedge_min_delay: 对冲请求的最小等待时间（秒），延迟样本不足时使用
+            circuit_failure_threshold: 连续失败多少次后熔断
+            circuit_reset_timeout: 熔断冷却时间（秒）
+        """
+        super().__init__(inner.model_name, inner.base_url, inner.api_key)
+        self.inner = inner
+        self.name = name
+        self.client = inner.client
+        self.endpoint_pool = inner.endpoint_pool
+        self.generation_options = inner.generation_options
+        self.embed_deadline = embed_deadline
+        self.embed_max_retries = max(0, embed_max_retries)
+        self.retry_backoff = retry_backoff
+        self.chat_deadline = chat_deadline
+        self.chat_first_token_timeout = chat_first_token_timeout
+        self.chat_stream_idle_timeout = chat_stream_idle_timeout
+        self.hedge_enabled = hedge_enabled
+        self.hedge_chat = hedge_chat
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(name, circuit_failure_threshold, circuit_reset_timeout)
+        self._embed_latency = LatencyTracker()
+        self._chat_latency = LatencyTracker()
+        self._stats = {
+            "calls": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "deadline_exceeded": 0,
+            "failures": 0
+        }
+    
+    def __getattr__(self, item: str):
+        # 其余方法 / 属性（batch_stats、embed_array 等）直接转发给被包装的提供者
+        if item == "inner":
+            raise AttributeError(item)
+        return getattr(self.inner, item)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """生成 embedding（截止时间 + 抖动退避重试 + 对冲 + 熔断）"""
+        self.breaker.before_call()
+        self._stats["calls"] += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.embed_deadline
+        attempt = 0
+        while True:
+            try:
+                result = await asyncio.wait_for(
+                    self._hedged(lambda: self.inner.embed_texts(texts), self._embed_latency, self.hedge_enabled),
+                    timeout=max(0.0, deadline - loop.time())
+                )
+                self.breaker.record_success()
+                return result
+            except asyncio.TimeoutError:
+                self._stats["deadline_exceeded"] += 1
+                self._record_failure()
+                raise TimeoutError(f"{self.name} 请求超过截止时间 {self.embed_deadline}s")
+            except NotImplementedError:
+                raise
+            except Exception as e:
+                attempt += 1
+                delay = random.uniform(0, self.retry_backoff * 2 ** (attempt - 1))
+                if attempt > self.embed_max_retries or loop.time() + delay >= deadline:
+                    self._record_failure()
+                    raise
+                self._stats["retries"] += 1
+                logger.warning(f"[Resilience] {self.name} 调用失败，{delay * 1000:.0f}ms 后第 {attempt} 次重试: {str(e)}")
+                await asyncio.sleep(delay)
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        options: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str] | str:
+        """聊天对话（截止时间 + 熔断；非流式可选对冲）"""
+        self.breaker.before_call()
+        self._stats["calls"] += 1
+        if stream:
+            try:
+                inner_stream = await self.inner.chat(messages, stream=True, options=options)
+            except Exception:
+                self._record_failure()
+                raise
+            return self._guard_stream(inner_stream)
+        
+        try:
+            result = await asyncio.wait_for(
+                self._hedged(lambda: self.inner.chat(messages, stream=False, options=options), self._chat_latency, self.hedge_chat),
+                timeout=self.chat_deadline
+            )
+        except asyncio.TimeoutError:
+            self._stats["deadline_exceeded"] += 1
+            self._record_failure()
+            raise TimeoutError(f"{self.name} 请求超过截止时间 {self.chat_deadline}s")
+        except Exception:
+            self._record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+    
+    async def _guard_stream(self, inner_stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """流式响应：限制首个 token 等待时间和 token 间隔"""
+        iterator = inner_stream.__aiter__()
+        timeout = self.chat_first_token_timeout
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+                except StopAsyncIteration:
+                    break
+                timeout = self.chat_stream_idle_timeout
+                yield chunk
+        except asyncio.TimeoutError:
+            self._stats["deadline_exceeded"] += 1
+            self._record_failure()
+            raise TimeoutError(f"{self.name} 流式响应等待超时 ({timeout}s 无新内容)")
+        except Exception:
+            self._record_failure()
+            raise
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        self.breaker.record_success()
+    
+    def _can_hedge(self, enabled: bool) -> bool:
+        return enabled and self.endpoint_pool is not None and len(self.endpoint_pool.endpoints) > 1
+    
+    async def _hedged(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        latency: LatencyTracker,
+        enabled: bool
+    ) -> Any:
+        """执行调用；主请求超过 p95 仍未返回时向其他端点发送对冲请求，取先成功的结果"""
+        async def attempt(hint: RoutingHint):
+            routing_hint.set(hint)
+            start_time = time.perf_counter()
+            result = await factory()
+            latency.record(time.perf_counter() - start_time)
+            return result
+        
+        if not self._can_hedge(enabled):
+            return await attempt(RoutingHint())
+        
+        primary_hint = RoutingHint()
+        primary = asyncio.create_task(attempt(primary_hint))
+        tasks = {primary}
+        try:
+            hedge_delay = max(self.hedge_min_delay, latency.p95() or 0.0)
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                self._stats["hedges"] += 1
+                hedge = asyncio.create_task(attempt(RoutingHint(exclude=list(primary_hint.endpoints))))
+                tasks.add(hedge)
+            # 先成功者胜出；先完成的失败时等待另一个
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    def _record_failure(self):
+        self._stats["failures"] += 1
+        self.breaker.record_failure()
+    
+    async def warmup_chat(self):
+        await self.inner.warmup_chat()
+    
+    async def aclose(self):
+        await self.inner.aclose()
+    
+    def resilience_stats(self) -> Dict[str, Any]:
+        """容错统计"""
+        embed_p95 = self._embed_latency.p95()
+        chat_p95 = self._chat_latency.p95()
+        return {
+            **self._stats,
+            "circuit": self.breaker.stats(),
+            "embed_p95_ms": round(embed_p95 * 1000, 1) if embed_p95 is not None else None,
+            "chat_p95_ms": round(chat_p95 * 1000, 1) if chat_p95 is not None else None
+        }
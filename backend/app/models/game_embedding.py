@@ -27,4 +27,5 @@ class GameEmbedding(Base):
     metadata_json = Column(JSON)  # 重命名：metadata 是 SQLAlchemy 保留字
     model_name = Column(String(255), default="qwen3-embedding-4b")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -0,0 +1,17 @@
+from app.retrievers.base_retriever import BaseRetriever
+from app.retrievers.search_filters import SearchFilters
+from app.retrievers.pgvector_retriever import PgvectorRetriever
+from app.retrievers.pgvector_halfvec_retriever import PgvectorHalfvecRetriever
+from app.retrievers.hnsw_retriever import HNSWRetriever
+from app.retrievers.mmap_retriever import MmapRetriever
+from app.retrievers.lexical_index import LexicalIndex
+
+__all__ = [
+    "BaseRetriever",
+    "SearchFilters",
+    "PgvectorRetriever",
+    "PgvectorHalfvecRetriever",
+    "HNSWRetriever",
+    "MmapRetriever",
+    "LexicalIndex"
+]
@@ -0,0 +1,78 @@
+"""
+向量检索后端接口
+"""
+from abc import ABC, abstractmethod
+from typing import List, Tuple, Dict, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.retrievers.search_filters import SearchFilters
+from app.services.game_card import GameCard
+from app.services.catalog_cache import catalog_cache
+
+
+class BaseRetriever(ABC):
+    """向量检索后端基类"""
+    
+    name: str = "base"
+    
+    @property
+    def ready(self) -> bool:
+        """索引是否可用于查询"""
+        return True
+    
+    def is_stale(self) -> bool:
+        """索引数据源是否在语料状态之外发生了变化（如离线导出的快照被重新生成）"""
+        return False
+    
+    def sync(self, db: Session) -> Dict[str, int]:
+        """
+        从 game_embeddings 同步索引（无需索引的后端直接返回）
+        
+        Args:
+            db: 数据库会话
+        
+        Returns:
+            同步统计信息
+        """
+        return {}
+    
+    @abstractmethod
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        检索最相似的游戏
+        
+        Args:
+            db: 数据库会话
+            query_embedding: 查询向量
+            limit: 返回数量
+            filters: 结构化过滤条件（在检索内部前置过滤，而非检索后再过滤）
+        
+        Returns:
+            (game_id, 相似度) 列表，按相似度降序
+        """
+        pass
+    
+    async def search_cards(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[GameCard, float]]:
+        """
+        检索最相似的游戏并返回游戏卡片
+        
+        默认实现为检索后按 id 读取卡片（优先目录缓存）；SQL 后端覆盖为同一条语句 JOIN games 完成。
+        
+        Returns:
+            (GameCard, 相似度) 列表，按相似度降序
+        """
+        rows = await self.search(db, query_embedding, limit, filters)
+        cards = await catalog_cache.get_cards(db, [game_id for game_id, _ in rows])
+        return [(cards[game_id], similarity) for game_id, similarity in rows if game_id in cards]
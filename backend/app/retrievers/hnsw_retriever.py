@@ -0,0 +1,226 @@
+"""
+进程内 HNSW 检索后端
+
+启动时从 game_embeddings 构建 HNSW 图索引，之后按 updated_at 增量同步
+（新增 / 重新生成的 embedding 写入索引，已删除的 embedding 从索引中标记删除）。
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import List, Tuple, Dict, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.retrievers.base_retriever import BaseRetriever
+from app.retrievers.search_filters import SearchFilters
+
+try:
+    import hnswlib
+    import numpy as np
+    HNSW_AVAILABLE = True
+except ImportError:
+    HNSW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 每次从数据库拉取向量的批次大小
+FETCH_BATCH_SIZE = 500
+
+# 过滤后候选数不超过该值时直接精确计算，不走图搜索
+BRUTE_FORCE_THRESHOLD = 2000
+
+
+class HNSWRetriever(BaseRetriever):
+    """进程内 HNSW 检索后端"""
+    
+    name = "hnsw"
+    
+    def __init__(
+        self,
+        dim: int = 2560,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        initial_capacity: int = 1024
+    ):
+        if not HNSW_AVAILABLE:
+            raise ImportError("hnswlib 未安装，无法使用 HNSW 检索后端 (pip install hnswlib)")
+        
+        self.dim = dim
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        
+        # 索引标签直接使用 game_id
+        self._index = self._new_index(initial_capacity)
+        # game_id -> updated_at，用于增量同步
+        self._versions: Dict[int, Optional[object]] = {}
+        self._lock = threading.Lock()
+        self._ready = False
+    
+    @property
+    def ready(self) -> bool:
+        return self._ready
+    
+    @property
+    def size(self) -> int:
+        """索引中有效的向量数量"""
+        return len(self._versions)
+    
+    def _new_index(self, capacity: int):
+        index = hnswlib.Index(space="cosine", dim=self.dim)
+        index.init_index(
+            max_elements=capacity,
+            ef_construction=self.ef_construction,
+            M=self.m
+        )
+        index.set_ef(self.ef_search)
+        return index
+    
+    def _to_array(self, vector) -> Optional["np.ndarray"]:
+        """将数据库返回的向量转换为 float32 数组（pgvector 未安装时为字符串）"""
+        if vector is None:
+            return None
+        if isinstance(vector, str):
+            vector = json.loads(vector)
+        array = np.asarray(vector, dtype=np.float32)
+        if array.shape != (self.dim,):
+            return None
+        return array
+    
+    def sync(self, db: Session) -> Dict[str, int]:
+        """
+        增量同步 game_embeddings 到 HNSW 索引
+        
+        只扫描 (game_id, updated_at) 两列来判断变化，向量只拉取新增或更新的行。
+        """
+        from app.models.game_embedding import GameEmbedding
+        
+        rows = db.query(GameEmbedding.game_id, GameEmbedding.updated_at).filter(
+            GameEmbedding.game_id.isnot(None)
+        ).all()
+        current = {game_id: updated_at for game_id, updated_at in rows}
+        
+        with self._lock:
+            known = dict(self._versions)
+        
+        to_delete = [game_id for game_id in known if game_id not in current]
+        to_fetch = [
+            game_id for game_id, updated_at in current.items()
+            if game_id not in known or (updated_at is not None and updated_at != known[game_id])
+        ]
+        
+        upserted = 0
+        skipped = 0
+        for start in range(0, len(to_fetch), FETCH_BATCH_SIZE):
+            batch_ids = to_fetch[start:start + FETCH_BATCH_SIZE]
+            batch_rows = db.query(
+                GameEmbedding.game_id,
+                GameEmbedding.embedding_vector,
+                GameEmbedding.updated_at
+            ).filter(GameEmbedding.game_id.in_(batch_ids)).all()
+            
+            labels = []
+            vectors = []
+            versions = {}
+            for game_id, vector, updated_at in batch_rows:
+                array = self._to_array(vector)
+                if array is None:
+                    skipped += 1
+                    continue
+                labels.append(game_id)
+                vectors.append(array)
+                versions[game_id] = updated_at
+            
+            if not labels:
+                continue
+            
+            with self._lock:
+                # mark_deleted 的元素仍占用 max_elements，按索引中的元素总数（含已删除）计算容量
+                required = self._index.get_current_count() + len(labels)
+                if required > self._index.get_max_elements():
+                    self._index.resize_index(max(required, self._index.get_max_elements() * 2))
+                self._index.add_items(np.vstack(vectors), labels)
+                self._versions.update(versions)
+            upserted += len(labels)
+        
+        with self._lock:
+            for game_id in to_delete:
+                self._index.mark_deleted(game_id)
+                self._versions.pop(game_id, None)
+            self._ready = True
+        
+        stats = {
+            "upserted": upserted,
+            "deleted": len(to_delete),
+            "skipped": skipped,
+            "total": self.size
+        }
+        if upserted or to_delete or skipped:
+            logger.info(f"[HNSW] 索引同步完成: {stats}")
+        return stats
+    
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[int, float]]:
+        """HNSW 近似最近邻检索（cosine 距离 = 1 - 余弦相似度）"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        
+        # 查询需要持有索引锁（增量同步写入期间会阻塞），放到线程中执行，不阻塞事件循环
+        if filters and not filters.is_empty:
+            allowed_ids = await filters.matching_game_ids(db)
+            return await asyncio.to_thread(self._filtered_search, query, limit, allowed_ids)
+        return await asyncio.to_thread(self._search, query, limit)
+    
+    def _search(self, query: "np.ndarray", limit: int) -> List[Tuple[int, float]]:
+        """无过滤条件的检索"""
+        with self._lock:
+            k = min(limit, len(self._versions))
+            if k == 0:
+                return []
+            # ef 不能小于 k
+            self._index.set_ef(max(self.ef_search, k))
+            labels, distances = self._index.knn_query(query, k=k)
+        
+        return [
+            (int(label), float(1 - distance))
+            for label, distance in zip(labels[0], distances[0])
+        ]
+    
+    def _filtered_search(self, query: "np.ndarray", limit: int, allowed_ids: set) -> List[Tuple[int, float]]:
+        """
+        带过滤条件的检索
+        
+        - 候选较少时直接取出向量精确计算
+        - 候选较多时使用 HNSW 过滤搜索（遍历图时跳过不满足条件的节点）
+        """
+        with self._lock:
+            candidates = [game_id for game_id in allowed_ids if game_id in self._versions]
+            k = min(limit, len(candidates))
+            if k == 0:
+                return []
+            
+            if len(candidates) > BRUTE_FORCE_THRESHOLD:
+                self._index.set_ef(max(self.ef_search, k))
+                try:
+                    labels, distances = self._index.knn_query(
+                        query, k=k, filter=lambda label: label in allowed_ids
+                    )
+                    return [
+                        (int(label), float(1 - distance))
+                        for label, distance in zip(labels[0], distances[0])
+                    ]
+                except RuntimeError:
+                    # 过滤条件过严时图搜索可能凑不够 k 个结果，退回精确计算
+                    pass
+            
+            vectors = np.asarray(self._index.get_items(candidates), dtype=np.float32)
+        
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+        similarities = vectors @ query / np.maximum(norms, 1e-12)
+        top = np.argsort(-similarities)[:k]
+        return [(int(candidates[i]), float(similarities[i])) for i in top]
@@ -0,0 +1,184 @@
+"""
+进程内词法倒排索引
+
+对 title / title_english / tags / description 建立倒排索引：
+中文等 CJK 文本按字二元组 (bigram) 切分，英文和数字按单词切分，使用 BM25 打分，
+查询中完整出现的游戏名额外加分。不依赖 embedding 服务。
+"""
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Tuple, Dict, Optional, Set
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# 字段权重
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "title_english": 3.0,
+    "tags": 2.0,
+    "description": 1.0,
+}
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 查询中完整出现游戏名时的加分
+EXACT_TITLE_BOOST = 100.0
+
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_text(value: str) -> str:
+    """全半角统一并转为小写"""
+    return unicodedata.normalize("NFKC", value).lower()
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    """
+    切分文本
+    
+    - CJK 连续片段切分为字二元组（单字片段保留单字）
+    - 英文 / 数字按单词切分
+    """
+    if not value:
+        return []
+    value = normalize_text(value)
+    tokens = []
+    for run in _CJK_PATTERN.findall(value):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD_PATTERN.findall(value))
+    return tokens
+
+
+class LexicalIndex:
+    """进程内词法倒排索引 (BM25)"""
+    
+    def __init__(self):
+        # term -> {game_id: 加权词频}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_lengths: Dict[int, float] = {}
+        self._avg_doc_length = 0.0
+        # (规范化后的游戏名, game_id)
+        self._titles: List[Tuple[str, int]] = []
+        self._fingerprint: Optional[Tuple] = None
+        self._lock = threading.Lock()
+        self._ready = False
+    
+    @property
+    def ready(self) -> bool:
+        return self._ready
+    
+    @property
+    def size(self) -> int:
+        return len(self._doc_lengths)
+    
+    def sync(self, db: Session) -> bool:
+        """
+        games 表变化时重建索引
+        
+        Args:
+            db: 数据库会话
+        
+        Returns:
+            是否重建了索引
+        """
+        row = db.execute(text("SELECT COUNT(*), MAX(id), MAX(updated_at) FROM games")).fetchone()
+        fingerprint = tuple(row)
+        if fingerprint == self._fingerprint and self._ready:
+            return False
+        
+        rows = db.execute(text(
+            "SELECT id, title, title_english, tags, description FROM games"
+        )).fetchall()
+        
+        postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        doc_lengths: Dict[int, float] = {}
+        titles: List[Tuple[str, int]] = []
+        
+        for game_id, title, title_english, tags, description in rows:
+            fields = {
+                "title": title,
+                "title_english": title_english,
+                "tags": " ".join(tags) if tags else None,
+                "description": description,
+            }
+            term_weights: Counter = Counter()
+            for field, value in fields.items():
+                for token in tokenize(value):
+                    term_weights[token] += FIELD_WEIGHTS[field]
+            for term, weight in term_weights.items():
+                postings[term][game_id] = weight
+            doc_lengths[game_id] = float(sum(term_weights.values()))
+            
+            for name in (title, title_english):
+                if name:
+                    normalized = normalize_text(name).strip()
+                    if len(normalized) >= 2:
+                        titles.append((normalized, game_id))
+        
+        with self._lock:
+            self._postings = dict(postings)
+            self._doc_lengths = doc_lengths
+            self._avg_doc_length = (sum(doc_lengths.values()) / len(doc_lengths)) if doc_lengths else 0.0
+            self._titles = titles
+            self._fingerprint = fingerprint
+            self._ready = True
+        
+        logger.info(f"[Lexical] 词法索引构建完成: {len(doc_lengths)} 个游戏, {len(postings)} 个词项")
+        return True
+    
+    def search(self, query: str, limit: int, allowed_ids: Optional[Set[int]] = None) -> List[Tuple[int, float]]:
+        """
+        BM25 检索
+        
+        Args:
+            query: 查询文本
+            limit: 返回数量
+            allowed_ids: 只在这些 game_id 中检索（结构化过滤），为空表示不过滤
+        
+        Returns:
+            (game_id, 分数) 列表，按分数降序
+        """
+        with self._lock:
+            postings = self._postings
+            doc_lengths = self._doc_lengths
+            avg_doc_length = self._avg_doc_length
+            titles = self._titles
+        
+        if not doc_lengths:
+            return []
+        
+        total_docs = len(doc_lengths)
+        scores: Dict[int, float] = defaultdict(float)
+        
+        for term in set(tokenize(query)):
+            term_postings = postings.get(term)
+            if not term_postings:
+                continue
+            df = len(term_postings)
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for game_id, tf in term_postings.items():
+                if allowed_ids is not None and game_id not in allowed_ids:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[game_id] / avg_doc_length)
+                scores[game_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        
+        # 完整游戏名命中
+        normalized_query = normalize_text(query)
+        for title, game_id in titles:
+            if title in normalized_query and (allowed_ids is None or game_id in allowed_ids):
+                scores[game_id] += EXACT_TITLE_BOOST
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
@@ -0,0 +1,186 @@
+"""
+内存映射 NumPy 精确检索后端
+
+加载 scripts/export_embeddings.py 导出的快照（已 L2 归一化的向量矩阵 + game_id 数组 + manifest），
+以 np.load(mmap_mode="r") 映射到内存，查询时做一次矩阵-向量点积 + argpartition 取 top-k。
+多个 worker 进程映射同一份文件时共享操作系统的页缓存。
+"""
+import asyncio
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import List, Tuple, Dict, Optional, Any
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.retrievers.base_retriever import BaseRetriever
+from app.retrievers.search_filters import SearchFilters
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 快照文件名
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+MANIFEST_FILE = "manifest.json"
+
+# float16 快照分块转换为 float32 计算的行数（float16 矩阵乘法没有 BLAS 加速）
+SCORE_CHUNK_ROWS = 8192
+
+
+class MmapRetriever(BaseRetriever):
+    """内存映射 NumPy 精确检索后端"""
+    
+    name = "mmap"
+    
+    def __init__(self, snapshot_dir: str = "data/embedding_snapshot", dim: Optional[int] = None):
+        """
+        Args:
+            snapshot_dir: 快照目录
+            dim: 期望的向量维度，与快照不一致时拒绝加载
+        """
+        if not NUMPY_AVAILABLE:
+            raise ImportError("numpy 未安装，无法使用 mmap 检索后端 (pip install numpy)")
+        
+        self.snapshot_dir = Path(snapshot_dir)
+        self.dim = dim
+        self._vectors: Optional["np.ndarray"] = None
+        self._ids: Optional["np.ndarray"] = None
+        self._id_positions: Dict[int, int] = {}
+        self._manifest: Dict[str, Any] = {}
+        self._manifest_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def ready(self) -> bool:
+        return self._vectors is not None
+    
+    @property
+    def size(self) -> int:
+        return 0 if self._ids is None else len(self._ids)
+    
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        return self._manifest
+    
+    def _manifest_path(self) -> Path:
+        return self.snapshot_dir / MANIFEST_FILE
+    
+    def is_stale(self) -> bool:
+        """快照文件是否已被重新导出"""
+        try:
+            return self._manifest_path().stat().st_mtime != self._manifest_mtime
+        except FileNotFoundError:
+            return False
+    
+    def sync(self, db: Session) -> Dict[str, int]:
+        """
+        (重新) 映射快照文件
+        
+        快照由导出脚本离线生成，这里不访问数据库；manifest 未变化时直接返回。
+        """
+        manifest_path = self._manifest_path()
+        if not manifest_path.exists():
+            logger.warning(f"[Mmap] 快照不存在: {manifest_path}，请先执行 scripts/export_embeddings.py")
+            return {"total": self.size}
+        if not self.is_stale():
+            return {"total": self.size}
+        
+        mtime = manifest_path.stat().st_mtime
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        
+        if self.dim and manifest.get("dimension") != self.dim:
+            logger.warning(
+                f"[Mmap] 快照维度 {manifest.get('dimension')} 与配置维度 {self.dim} 不一致，跳过加载"
+            )
+            self._manifest_mtime = mtime
+            return {"total": self.size}
+        
+        vectors = np.load(self.snapshot_dir / VECTORS_FILE, mmap_mode="r")
+        ids = np.load(self.snapshot_dir / IDS_FILE)
+        if vectors.shape[0] != ids.shape[0]:
+            raise ValueError(f"快照损坏: 向量 {vectors.shape[0]} 行, id {ids.shape[0]} 个")
+        
+        with self._lock:
+            self._vectors = vectors
+            self._ids = ids
+            self._id_positions = {int(game_id): i for i, game_id in enumerate(ids)}
+            self._manifest = manifest
+            self._manifest_mtime = mtime
+        
+        logger.info(
+            f"[Mmap] 快照加载完成: {len(ids)} 条, 维度 {vectors.shape[1]}, {vectors.dtype}, "
+            f"模型 {manifest.get('model_names')}, 导出时间 {manifest.get('exported_at')}"
+        )
+        return {"total": len(ids)}
+    
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[int, float]]:
+        """归一化点积（= 余弦相似度）精确检索"""
+        with self._lock:
+            vectors, ids, id_positions = self._vectors, self._ids, self._id_positions
+        if vectors is None or len(ids) == 0:
+            return []
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        
+        positions = None
+        if filters and not filters.is_empty:
+            allowed_ids = await filters.matching_game_ids(db)
+            positions = np.fromiter(
+                (id_positions[game_id] for game_id in allowed_ids if game_id in id_positions),
+                dtype=np.int64
+            )
+            if len(positions) == 0:
+                return []
+            positions.sort()
+        
+        # 全量点积和 top-k 选择是与语料规模成正比的 CPU 计算，放到线程中执行，不阻塞事件循环
+        return await asyncio.to_thread(self._top_k, vectors, ids, positions, query, limit)
+    
+    def _top_k(
+        self,
+        vectors: "np.ndarray",
+        ids: "np.ndarray",
+        positions: Optional["np.ndarray"],
+        query: "np.ndarray",
+        limit: int
+    ) -> List[Tuple[int, float]]:
+        """计算候选行的相似度并取前 limit 个（positions 为 None 时为全部行）"""
+        if positions is not None:
+            scores = self._score(vectors[positions], query)
+            candidate_ids = ids[positions]
+        else:
+            scores = self._score(vectors, query)
+            candidate_ids = ids
+        
+        k = min(limit, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidate_ids[i]), float(scores[i])) for i in top]
+    
+    def _score(self, vectors: "np.ndarray", query: "np.ndarray") -> "np.ndarray":
+        """计算所有行与查询向量的点积"""
+        if vectors.dtype == np.float32:
+            return vectors @ query
+        scores = np.empty(vectors.shape[0], dtype=np.float32)
+        for start in range(0, vectors.shape[0], SCORE_CHUNK_ROWS):
+            chunk = vectors[start:start + SCORE_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = chunk.astype(np.float32) @ query
+        return scores
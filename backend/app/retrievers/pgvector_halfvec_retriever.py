@@ -0,0 +1,134 @@
+"""
+pgvector halfvec 检索后端
+
+在 embedding_halfvec 列的 HNSW 索引上取候选集，再用全精度 embedding_vector 精排。
+依赖 database/init/011_add_game_embeddings_halfvec.sql。
+"""
+from typing import List, Tuple, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from app.retrievers.base_retriever import BaseRetriever
+from app.retrievers.search_filters import SearchFilters
+from app.services.game_card import GameCard, card_columns_sql
+
+
+class PgvectorHalfvecRetriever(BaseRetriever):
+    """pgvector halfvec 索引检索 + 全精度精排"""
+    
+    name = "pgvector_halfvec"
+    
+    def __init__(
+        self,
+        ef_search: int = 100,
+        candidate_multiplier: int = 4,
+        iterative_scan: Optional[str] = None
+    ):
+        """
+        Args:
+            ef_search: hnsw.ef_search
+            candidate_multiplier: 候选数 = limit * 倍数
+            iterative_scan: 带过滤条件时的 hnsw.iterative_scan（relaxed_order / strict_order，需要 pgvector >= 0.8.0）
+        """
+        self.ef_search = ef_search
+        self.candidate_multiplier = candidate_multiplier
+        self.iterative_scan = iterative_scan
+    
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[int, float]]:
+        """HNSW 索引取 limit * candidate_multiplier 个候选，再按全精度余弦相似度重排"""
+        result = await self._execute(db, query_embedding, limit, filters, with_cards=False)
+        return [(row[0], float(row[1])) for row in result.fetchall()]
+    
+    async def search_cards(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[GameCard, float]]:
+        """候选检索、精排和游戏卡片列投影在同一条 SQL 中完成"""
+        result = await self._execute(db, query_embedding, limit, filters, with_cards=True)
+        return [
+            (GameCard.from_row(row._mapping), float(row.similarity))
+            for row in result.fetchall()
+        ]
+    
+    async def _execute(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters],
+        with_cards: bool
+    ):
+        query_vec_str = "[" + ",".join(map(str, query_embedding)) + "]"
+        candidates = limit * self.candidate_multiplier
+        # halfvec 索引扫描和全精度精排分别绑定参数：同名参数在 asyncpg 下编译为同一个 $n，
+        # 两处 CAST 会共用一个推断类型，精排可能拿到 halfvec 精度的查询向量
+        params = {
+            "query_vec_half": query_vec_str,
+            "query_vec_full": query_vec_str,
+            "candidates": candidates,
+            "limit": limit
+        }
+        
+        # 设置当前事务的 hnsw.ef_search（ef_search 需不小于候选数）
+        await db.execute(
+            text("SELECT set_config('hnsw.ef_search', :ef_search, true)"),
+            {"ef_search": str(max(self.ef_search, candidates))}
+        )
+        
+        if filters and not filters.is_empty:
+            # 过滤条件在索引扫描内执行；开启 iterative_scan 时索引会持续扫描直到凑够满足条件的候选
+            if self.iterative_scan:
+                await db.execute(
+                    text("SELECT set_config('hnsw.iterative_scan', :mode, true)"),
+                    {"mode": self.iterative_scan}
+                )
+            where_sql, filter_params = filters.to_sql("g")
+            params.update(filter_params)
+            candidates_sql = f"""
+                    SELECT e.game_id, e.embedding_vector
+                    FROM game_embeddings e
+                    JOIN games g ON g.id = e.game_id
+                    WHERE {where_sql}
+                    ORDER BY e.embedding_halfvec <=> CAST(:query_vec_half AS halfvec)
+                    LIMIT :candidates
+            """
+        else:
+            candidates_sql = """
+                    SELECT game_id, embedding_vector
+                    FROM game_embeddings
+                    ORDER BY embedding_halfvec <=> CAST(:query_vec_half AS halfvec)
+                    LIMIT :candidates
+            """
+        
+        if with_cards:
+            ranked_sql = f"""
+                SELECT c.game_id,
+                    1 - (c.embedding_vector <=> CAST(:query_vec_full AS vector)) as similarity,
+                    {card_columns_sql('g')}
+                FROM candidates c
+                JOIN games g ON g.id = c.game_id
+            """
+        else:
+            ranked_sql = """
+                SELECT game_id,
+                    1 - (embedding_vector <=> CAST(:query_vec_full AS vector)) as similarity
+                FROM candidates
+            """
+        
+        return await db.execute(
+            text(f"""
+                WITH candidates AS ({candidates_sql})
+                {ranked_sql}
+                ORDER BY similarity DESC
+                LIMIT :limit
+            """),
+            params
+        )
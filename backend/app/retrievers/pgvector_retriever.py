@@ -0,0 +1,80 @@
+"""
+pgvector 检索后端 (数据库内余弦距离排序)
+"""
+from typing import List, Tuple, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from app.retrievers.base_retriever import BaseRetriever
+from app.retrievers.search_filters import SearchFilters
+from app.services.game_card import GameCard, card_columns_sql
+
+
+class PgvectorRetriever(BaseRetriever):
+    """pgvector 检索后端"""
+    
+    name = "pgvector"
+    
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[int, float]]:
+        """使用原生 SQL 进行向量相似度搜索"""
+        result = await self._execute(db, query_embedding, limit, filters, with_cards=False)
+        return [(row[0], float(row[1])) for row in result.fetchall()]
+    
+    async def search_cards(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[GameCard, float]]:
+        """向量排序与游戏卡片列投影在同一条 SQL 中完成"""
+        result = await self._execute(db, query_embedding, limit, filters, with_cards=True)
+        return [
+            (GameCard.from_row(row._mapping), float(row.similarity))
+            for row in result.fetchall()
+        ]
+    
+    async def _execute(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        filters: Optional[SearchFilters],
+        with_cards: bool
+    ):
+        # <=> 是 pgvector 的余弦距离操作符
+        query_vec_str = "[" + ",".join(map(str, query_embedding)) + "]"
+        params = {
+            "query_vec": query_vec_str,
+            "limit": limit
+        }
+        
+        if with_cards or (filters and not filters.is_empty):
+            # 过滤条件、向量排序和卡片列在同一条 SQL 中执行
+            where_sql, filter_params = filters.to_sql("g") if filters else ("TRUE", {})
+            params.update(filter_params)
+            columns = f", {card_columns_sql('g')}" if with_cards else ""
+            sql = f"""
+                SELECT e.game_id,
+                    1 - (e.embedding_vector <=> CAST(:query_vec AS vector)) as similarity{columns}
+                FROM game_embeddings e
+                JOIN games g ON g.id = e.game_id
+                WHERE {where_sql}
+                ORDER BY e.embedding_vector <=> CAST(:query_vec AS vector)
+                LIMIT :limit
+            """
+        else:
+            sql = """
+                SELECT game_id, 
+                    1 - (embedding_vector <=> CAST(:query_vec AS vector)) as similarity
+                FROM game_embeddings
+                ORDER BY embedding_vector <=> CAST(:query_vec AS vector)
+                LIMIT :limit
+            """
+        
+        return await db.execute(text(sql), params)
@@ -0,0 +1,105 @@
+"""
+结构化检索过滤条件
+
+平台 / 标签 / 免费 / 价格 / 评分过滤，在检索内部作为前置过滤使用：
+SQL 后端直接拼接到 WHERE 条件中，进程内索引后端使用匹配的 game_id 集合。
+"""
+from decimal import Decimal
+from typing import List, Optional, Dict, Any, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+
+class SearchFilters:
+    """检索过滤条件"""
+    
+    def __init__(
+        self,
+        platforms: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        is_free: Optional[bool] = None,
+        max_price: Optional[float] = None,
+        min_score: Optional[float] = None
+    ):
+        """
+        Args:
+            platforms: 平台（满足任意一个即可）
+            tags: 标签（需全部满足）
+            is_free: 是否只要免费游戏
+            max_price: 最高价格（任一平台价格不超过即可）
+            min_score: 最低用户评分
+        """
+        self.platforms = platforms or []
+        self.tags = tags or []
+        self.is_free = is_free
+        self.max_price = max_price
+        self.min_score = min_score
+        # 匹配的 game_id 集合（同一请求内只查询一次）
+        self._matching_ids: Optional[Set[int]] = None
+    
+    @property
+    def is_empty(self) -> bool:
+        return not (
+            self.platforms or self.tags or self.is_free
+            or self.max_price is not None or self.min_score is not None
+        )
+    
+    def to_sql(self, alias: str = "g") -> Tuple[str, Dict[str, Any]]:
+        """
+        生成 games 表的过滤条件
+        
+        Args:
+            alias: games 表别名
+        
+        Returns:
+            (WHERE 条件 SQL, 参数)，无过滤条件时为 ("TRUE", {})
+        """
+        conditions = []
+        params: Dict[str, Any] = {}
+        
+        if self.platforms:
+            conditions.append(f"{alias}.platforms && CAST(:filter_platforms AS text[])")
+            params["filter_platforms"] = self.platforms
+        if self.tags:
+            conditions.append(f"{alias}.tags @> CAST(:filter_tags AS text[])")
+            params["filter_tags"] = self.tags
+        if self.is_free:
+            conditions.append(
+                f"({alias}.is_free OR EXISTS (SELECT 1 FROM game_prices gp "
+                f"WHERE gp.game_id = {alias}.id AND gp.is_free))"
+            )
+        if self.max_price is not None:
+            conditions.append(
+                f"({alias}.is_free OR {alias}.price <= :filter_max_price OR EXISTS (SELECT 1 FROM game_prices gp "
+                f"WHERE gp.game_id = {alias}.id AND (gp.is_free OR gp.price <= :filter_max_price)))"
+            )
+            params["filter_max_price"] = Decimal(str(self.max_price))
+        if self.min_score is not None:
+            conditions.append(f"{alias}.user_score >= :filter_min_score")
+            params["filter_min_score"] = Decimal(str(self.min_score))
+        
+        if not conditions:
+            return "TRUE", {}
+        return " AND ".join(conditions), params
+    
+    async def matching_game_ids(self, db: AsyncSession) -> Set[int]:
+        """查询满足条件的 game_id 集合（走 games 表的 GIN / B-tree 索引）"""
+        if self._matching_ids is None:
+            where_sql, params = self.to_sql("g")
+            result = await db.execute(text(f"SELECT g.id FROM games g WHERE {where_sql}"), params)
+            rows = result.fetchall()
+            self._matching_ids = {row[0] for row in rows}
+        return self._matching_ids
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "platforms": self.platforms,
+            "tags": self.tags,
+            "is_free": self.is_free,
+            "max_price": self.max_price,
+            "min_score": self.min_score
+        }
+    
+    def __repr__(self) -> str:
+        items = {key: value for key, value in self.to_dict().items() if value not in (None, [], False)}
+        return f"SearchFilters({items})"
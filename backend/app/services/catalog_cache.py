@@ -0,0 +1,128 @@
+"""
+游戏目录缓存
+
+进程内缓存全部游戏卡片（GameCard，不含 raw_data / HTML 大字段），供检索结果批量加载卡片和随机推荐抽样 id；
+游戏详情需要完整字段，直接查询数据库。
+目录只在运行爬虫时变化：CrawlerService.save_games_to_db 写入后递增 catalog_version，
+后台维护任务检测到版本变化时整体重新加载。热路径读取命中缓存时不占用数据库连接。
+"""
+import logging
+import random
+import threading
+import time
+from typing import List, Optional, Dict, Any, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from app.services.game_card import GameCard, card_select, to_cards, fetch_game_cards
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """游戏目录缓存"""
+    
+    def __init__(self):
+        self._by_id: Dict[int, GameCard] = {}
+        # 用于随机抽样的 id 数组
+        self._ids: List[int] = []
+        self._version: Optional[Tuple] = None
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[float] = None
+        
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+    
+    @property
+    def size(self) -> int:
+        return len(self._by_id)
+    
+    def _current_version(self, db: Session) -> Tuple:
+        """
+        当前目录版本
+        
+        优先读取 catalog_version 表（012_create_catalog_version.sql）；
+        未执行迁移时退回 games 表的 (数量, 最大 id, 最后更新时间)。
+        """
+        has_version_table = db.execute(
+            text("SELECT to_regclass('public.catalog_version') IS NOT NULL")
+        ).scalar()
+        if has_version_table:
+            version = db.execute(text("SELECT version FROM catalog_version WHERE id = 1")).scalar()
+            if version is not None:
+                return ("version", version)
+        row = db.execute(text("SELECT COUNT(*), MAX(id), MAX(updated_at) FROM games")).fetchone()
+        return ("games",) + tuple(row)
+    
+    def refresh(self, db: Session) -> bool:
+        """
+        目录版本变化时重新加载缓存（首次调用即为全量加载）
+        
+        Returns:
+            是否重新加载
+        """
+        version = self._current_version(db)
+        if version == self._version:
+            return False
+        
+        start_time = time.perf_counter()
+        cards = to_cards(db.execute(card_select()).all())
+        by_id = {card.id: card for card in cards}
+        
+        with self._lock:
+            self._by_id = by_id
+            self._ids = list(by_id)
+            self._version = version
+            self.loaded_at = time.time()
+        
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        logger.info(f"[Catalog] 目录缓存加载完成: {len(cards)} 个游戏, 版本 {version}, 耗时 {elapsed_ms:.0f}ms")
+        return True
+    
+    async def get_cards(self, db: AsyncSession, game_ids: List[int]) -> Dict[int, GameCard]:
+        """
+        按 id 批量读取（读穿透：缓存未命中的 id 从数据库补查）
+        
+        Args:
+            db: 数据库会话（全部命中时不会使用）
+            game_ids: 游戏 ID 列表
+        
+        Returns:
+            game_id -> GameCard
+        """
+        by_id = self._by_id
+        cards = {game_id: by_id[game_id] for game_id in game_ids if game_id in by_id}
+        missing = [game_id for game_id in game_ids if game_id not in cards]
+        with self._lock:
+            self.hits += len(cards)
+            self.misses += len(missing)
+        if missing:
+            cards.update(await fetch_game_cards(db, missing))
+        return cards
+    
+    def random(self, limit: int) -> List[GameCard]:
+        """随机抽取游戏"""
+        with self._lock:
+            ids, by_id = self._ids, self._by_id
+        return [by_id[game_id] for game_id in random.sample(ids, min(limit, len(ids)))]
+    
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "ready": self.ready,
+            "size": self.size,
+            "version": list(self._version) if self._version else None,
+            "loaded_at": self.loaded_at,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# 进程内共享的目录缓存
+catalog_cache = CatalogCache()
@@ -0,0 +1,191 @@
+"""
+RAG 上下文打包
+
+把候选游戏渲染为紧凑的单行字段格式，按检索排名依次放入 token 预算：
+完整条目（含简介）放不下时退化为不含简介的条目，仍放不下则停止。
+每个游戏渲染后的片段和 token 数按 (风格, id, updated_at) 缓存，游戏数据更新后自动失效。
+
+token 计数默认使用快速估算；配置 context_tokenizer 且安装了 tokenizers 时使用模型分词器。
+"""
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from app.model_providers.local_provider import estimate_tokens
+from app.services.game_card import GameCard
+
+try:
+    from tokenizers import Tokenizer
+    TOKENIZERS_AVAILABLE = True
+except ImportError:
+    TOKENIZERS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 渲染风格: numbered (编号列表，推荐回复) / id ([ID:数字] 标记，带选择的推荐回复)
+CONTEXT_STYLES = ("numbered", "id")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def load_token_counter(tokenizer: Optional[str]) -> Callable[[str], int]:
+    """
+    加载 token 计数函数
+    
+    Args:
+        tokenizer: tokenizer.json 路径或 HuggingFace 模型名（如 Qwen/Qwen2.5-3B-Instruct），为空使用快速估算
+    """
+    if not tokenizer:
+        return estimate_tokens
+    if not TOKENIZERS_AVAILABLE:
+        logger.warning("[ContextPacker] tokenizers 未安装，使用快速估算 token 数 (pip install tokenizers)")
+        return estimate_tokens
+    try:
+        if os.path.exists(tokenizer):
+            model = Tokenizer.from_file(tokenizer)
+        else:
+            model = Tokenizer.from_pretrained(tokenizer)
+    except Exception as e:
+        logger.warning(f"[ContextPacker] 加载分词器 {tokenizer} 失败，使用快速估算: {str(e)}")
+        return estimate_tokens
+    return lambda text: len(model.encode(text, add_special_tokens=False).ids)
+
+
+class PackedContext:
+    """打包结果"""
+    
+    def __init__(self, text: str, games: List[GameCard], tokens: int, compacted: int):
+        self.text = text
+        self.games = games  # 实际放入上下文的游戏（按排名）
+        self.tokens = tokens
+        self.compacted = compacted  # 去掉简介后才放入的游戏数
+
+
+class ContextPacker:
+    """候选游戏上下文打包器"""
+    
+    def __init__(
+        self,
+        token_budget: int = 1600,
+        description_chars: int = 160,
+        max_tags: int = 6,
+        cache_size: int = 2048,
+        token_counter: Optional[Callable[[str], int]] = None
+    ):
+        """
+        Args:
+            token_budget: 候选游戏上下文的 token 上限（不含系统提示词和用户需求）
+            description_chars: 简介截取的最大字符数
+            max_tags: 最多列出的标签数
+            cache_size: 片段缓存的最大条目数
+            token_counter: token 计数函数，默认快速估算
+        """
+        self.token_budget = token_budget
+        self.description_chars = description_chars
+        self.max_tags = max_tags
+        self.cache_size = cache_size
+        self.count_tokens = token_counter or estimate_tokens
+        
+        # (style, id, updated_at) -> (完整片段, 完整 token 数, 紧凑片段, 紧凑 token 数)
+        self._snippets: "OrderedDict[Tuple, Tuple[str, int, str, int]]" = OrderedDict()
+        
+        self.hits = 0
+        self.misses = 0
+        self.packs = 0
+        self.total_tokens = 0
+        self.compacted = 0
+        self.dropped = 0
+    
+    def _render(self, game: GameCard, style: str) -> Tuple[str, str]:
+        """渲染 (完整片段, 紧凑片段)；编号风格的序号在打包时添加"""
+        title = game.title
+        if game.title_english and game.title_english != game.title:
+            title += f" ({game.title_english})"
+        head = f"[ID:{game.id}] {title}" if style == "id" else title
+        
+        fields = []
+        if game.tags:
+            fields.append(f"标签:{'/'.join(game.tags[:self.max_tags])}")
+        if game.platforms:
+            fields.append(f"平台:{'/'.join(game.platforms)}")
+        if game.user_score:
+            fields.append(f"评分:{game.user_score}")
+        compact = " | ".join([head] + fields)
+        
+        full = compact
+        if game.description and self.description_chars > 0:
+            description = _WHITESPACE.sub(" ", game.description).strip()
+            if len(description) > self.description_chars:
+                description = description[:self.description_chars].rstrip() + "…"
+            full += f"\n   简介:{description}"
+        return full, compact
+    
+    def _snippet(self, game: GameCard, style: str) -> Tuple[str, int, str, int]:
+        key = (style, game.id, game.updated_at)
+        cached = self._snippets.get(key)
+        if cached is not None:
+            self._snippets.move_to_end(key)
+            self.hits += 1
+            return cached
+        
+        self.misses += 1
+        full, compact = self._render(game, style)
+        entry = (full, self.count_tokens(full), compact, self.count_tokens(compact))
+        self._snippets[key] = entry
+        while len(self._snippets) > self.cache_size:
+            self._snippets.popitem(last=False)
+        return entry
+    
+    def pack(self, games: List[GameCard], header: str, style: str = "id") -> PackedContext:
+        """
+        按排名把游戏放入 token 预算
+        
+        Args:
+            games: 候选游戏（按检索排名）
+            header: 列表标题（如【候选游戏列表】）
+            style: 渲染风格 numbered / id
+        """
+        if style not in CONTEXT_STYLES:
+            raise ValueError(f"不支持的上下文风格: {style}")
+        
+        lines = [header]
+        used = self.count_tokens(header)
+        included: List[GameCard] = []
+        compacted = 0
+        for game in games:
+            full, full_tokens, compact, compact_tokens = self._snippet(game, style)
+            prefix = f"{len(included) + 1}. " if style == "numbered" else ""
+            # 序号约 1-2 个 token，换行 1 个
+            overhead = 3 if prefix else 1
+            if used + full_tokens + overhead <= self.token_budget:
+                lines.append(prefix + full)
+                used += full_tokens + overhead
+            elif used + compact_tokens + overhead <= self.token_budget or not included:
+                # 第一个游戏总是放入，保证上下文不为空
+                lines.append(prefix + compact)
+                used += compact_tokens + overhead
+                compacted += 1
+            else:
+                break
+            included.append(game)
+        
+        self.packs += 1
+        self.total_tokens += used
+        self.compacted += compacted
+        self.dropped += len(games) - len(included)
+        return PackedContext("\n".join(lines), included, used, compacted)
+    
+    def stats(self) -> Dict[str, Any]:
+        """打包统计"""
+        lookups = self.hits + self.misses
+        return {
+            "token_budget": self.token_budget,
+            "packs": self.packs,
+            "avg_tokens": round(self.total_tokens / self.packs, 1) if self.packs else 0.0,
+            "compacted": self.compacted,
+            "dropped": self.dropped,
+            "snippet_cache_size": len(self._snippets),
+            "snippet_cache_hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,92 @@
+"""
+Embedding 语料状态
+
+缓存 game_embeddings 的数量、模型、维度、最后更新时间和索引就绪状态，
+由后台定期刷新，请求热路径只读取内存中的状态，不再每次执行 COUNT(*)。
+语料由独立进程的爬虫 / embedding 脚本写入，状态最多滞后 corpus_refresh_interval 秒。
+"""
+import logging
+import time
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+class CorpusState:
+    """Embedding 语料状态"""
+    
+    def __init__(self):
+        self.embedding_count = 0
+        self.model_names: List[str] = []
+        self.dimension: Optional[int] = None
+        self.last_updated_at: Optional[datetime] = None
+        self.index_ready = False
+        # 最后一次成功刷新的时间戳，None 表示尚未刷新
+        self.refreshed_at: Optional[float] = None
+        self._fingerprint: Optional[Tuple] = None
+    
+    @property
+    def has_embeddings(self) -> bool:
+        """是否有可检索的 embedding（尚未刷新时乐观地认为有，交由检索失败降级）"""
+        if self.refreshed_at is None:
+            return True
+        return self.embedding_count > 0
+    
+    def is_compatible(self, dimension: int) -> bool:
+        """查询向量维度是否与语料一致"""
+        return self.dimension is None or self.dimension == dimension
+    
+    def refresh(self, db: Session) -> bool:
+        """
+        刷新语料状态
+        
+        Args:
+            db: 数据库会话
+        
+        Returns:
+            语料是否发生变化（数量 / 最大 id / 最后更新时间）
+        """
+        row = db.execute(text("""
+            SELECT COUNT(*), MAX(id), MAX(updated_at)
+            FROM game_embeddings
+            WHERE embedding_vector IS NOT NULL
+        """)).fetchone()
+        count, max_id, last_updated_at = row[0] or 0, row[1], row[2]
+        fingerprint = (count, max_id, last_updated_at)
+        
+        changed = fingerprint != self._fingerprint
+        if changed:
+            # 模型和维度只在语料变化时查询
+            self.model_names = [
+                r[0] for r in db.execute(text(
+                    "SELECT DISTINCT model_name FROM game_embeddings WHERE model_name IS NOT NULL"
+                )).fetchall()
+            ]
+            self.dimension = db.execute(text(
+                "SELECT vector_dims(embedding_vector) FROM game_embeddings "
+                "WHERE embedding_vector IS NOT NULL LIMIT 1"
+            )).scalar() if count else None
+            self.embedding_count = count
+            self.last_updated_at = last_updated_at
+            self._fingerprint = fingerprint
+            logger.info(
+                f"[Corpus] 语料状态更新: {count} 条 embedding, "
+                f"模型 {self.model_names}, 维度 {self.dimension}"
+            )
+        
+        self.refreshed_at = time.time()
+        return changed
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """状态快照"""
+        return {
+            "embedding_count": self.embedding_count,
+            "model_names": self.model_names,
+            "dimension": self.dimension,
+            "last_updated_at": self.last_updated_at.isoformat() if self.last_updated_at else None,
+            "index_ready": self.index_ready,
+            "refreshed_at": self.refreshed_at
+        }
@@ -7,6 +7,7 @@ import asyncio
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Callable, Awaitable
 from sqlalchemy.orm import Session
+from sqlalchemy import text
 from decimal import Decimal
 from app.crawlers.game_data_crawler import GameDataCrawler
 from app.models.game import Game
@@ -93,6 +94,9 @@ class CrawlerService:
                     db.rollback()
                     continue
             
+            if games_data:
+                self._bump_catalog_version(db)
+            
             return saved_count
             
         except Exception as e:
@@ -451,6 +455,10 @@ class CrawlerService:
                     print(f"[{idx}/{total}] ✗ 失败: {str(e)[:50]}")
                 continue
         
+        # 目录有变化时递增版本号，通知服务端重新加载目录缓存
+        if saved_count or updated_count:
+            self._bump_catalog_version(db)
+        
         stats = {
             "saved_count": saved_count,
             "updated_count": updated_count,
@@ -536,6 +544,21 @@ class CrawlerService:
         
         return game_dict
     
+    def _bump_catalog_version(self, db: Session):
+        """递增 catalog_version（未执行 012_create_catalog_version.sql 时跳过）"""
+        if "catalog_version" not in self._get_tables(db):
+            return
+        try:
+            db.execute(text("""
+                INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 1, NOW())
+                ON CONFLICT (id) DO UPDATE
+                SET version = catalog_version.version + 1, updated_at = NOW()
+            """))
+            db.commit()
+        except Exception as e:
+            logger.error(f"更新目录版本失败: {str(e)}")
+            db.rollback()
+    
     def _get_tables(self, db: Session) -> set:
         """获取数据库表列表（带缓存）"""
         if self._tables_cache is None:
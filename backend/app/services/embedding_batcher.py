@@ -0,0 +1,117 @@
+"""
+查询 Embedding 动态批处理
+
+并发请求各自调用 embed(text)，文本进入待处理队列；队列达到 max_batch_size 条
+或第一条文本等待超过 max_wait_ms 时，合并为一次 embed_texts 调用，
+结果按顺序回填到每个调用方的 future。同一批次内的重复文本只计算一次。
+"""
+import asyncio
+import logging
+import time
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable, Set
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """查询 Embedding 动态批处理器"""
+    
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0
+    ):
+        """
+        Args:
+            embed_fn: 批量生成 embedding 的函数（如 provider.embed_texts）
+            max_batch_size: 单批最多合并的文本数，达到后立即发送
+            max_wait_ms: 第一条文本进入队列后最多等待的毫秒数
+        """
+        self.embed_fn = embed_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        
+        # (text, future, enqueued_at)
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 持有进行中的批次任务引用，避免被垃圾回收
+        self._tasks: Set[asyncio.Task] = set()
+        
+        self.batches = 0
+        self.items = 0
+        self.unique_texts = 0
+        self.size_flushes = 0
+        self.largest_batch = 0
+        self.total_wait = 0.0
+    
+    async def embed(self, text: str) -> List[float]:
+        """提交单条文本，等待所在批次完成后返回 embedding"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        
+        if len(self._pending) >= self.max_batch_size:
+            self.size_flushes += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        
+        return await future
+    
+    def _flush(self):
+        """取出当前队列并在后台任务中发送"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # 调用方已取消（如客户端断开）的文本不再计算
+        batch = [item for item in self._pending if not item[1].done()]
+        self._pending = []
+        if not batch:
+            return
+        
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        flushed_at = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        
+        self.batches += 1
+        self.items += len(batch)
+        self.unique_texts += len(texts)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self.total_wait += sum(flushed_at - enqueued_at for _, _, enqueued_at in batch)
+        
+        try:
+            embeddings = await self.embed_fn(texts)
+            if len(embeddings) != len(texts):
+                raise Exception(f"批量 embedding 数量不匹配: 请求 {len(texts)} 条，返回 {len(embeddings)} 条")
+        except Exception as e:
+            logger.warning(f"[Batcher] 批次 ({len(texts)} 条) 生成 embedding 失败: {str(e)}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        by_text = dict(zip(texts, embeddings))
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+    
+    def stats(self) -> Dict[str, Any]:
+        """批处理统计"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "batches": self.batches,
+            "items": self.items,
+            "unique_texts": self.unique_texts,
+            "size_flushes": self.size_flushes,
+            "largest_batch": self.largest_batch,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "avg_wait_ms": round(self.total_wait / self.items * 1000, 2) if self.items else 0.0,
+            "pending": len(self._pending),
+            "in_flight": len(self._tasks)
+        }
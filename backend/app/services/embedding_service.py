@@ -4,9 +4,11 @@ Embedding 服务
 import logging
 from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session
-from app.model_providers import LocalModelProvider, OpenAIProvider
+from app.model_providers import BaseModelProvider, provider_registry
 from app.models.game import Game
 from app.cleaners.game_cleaner import GameCleaner
+from app.services.query_embedding_cache import QueryEmbeddingCache
+from app.services.embedding_batcher import EmbeddingBatcher
 from app.config import settings
 
 logger = logging.getLogger(__name__)
@@ -15,34 +17,85 @@ logger = logging.getLogger(__name__)
 class EmbeddingService:
     """Embedding 服务"""
     
-    def __init__(self):
-        # 根据配置创建模型提供者
-        provider_type = settings.embedding_model_provider
-        if provider_type == "local":
-            self.provider = LocalModelProvider(
-                model_name=settings.embedding_model_name,
-                base_url=settings.embedding_base_url,
-                api_key=settings.embedding_api_key
+    def __init__(self, provider: Optional[BaseModelProvider] = None):
+        """
+        Args:
+            provider: embedding 模型提供者，默认使用进程内共享的 provider_registry.embedding
+        """
+        self._provider = provider
+        
+        # 查询 embedding 缓存
+        self.query_cache: Optional[QueryEmbeddingCache] = None
+        if settings.query_embedding_cache_enabled:
+            self.query_cache = QueryEmbeddingCache(
+                max_size=settings.query_embedding_cache_size,
+                ttl=settings.query_embedding_cache_ttl,
+                path=settings.query_embedding_cache_path
             )
-        elif provider_type == "openai":
-            self.provider = OpenAIProvider(
-                model_name=settings.embedding_model_name,
-                base_url=settings.embedding_base_url,
-                api_key=settings.embedding_api_key
+        
+        # 查询 embedding 动态批处理
+        self.batcher: Optional[EmbeddingBatcher] = None
+        if settings.embedding_batcher_enabled:
+            self.batcher = EmbeddingBatcher(
+                lambda texts: self.provider.embed_texts(texts),
+                max_batch_size=settings.embedding_batcher_max_size,
+                max_wait_ms=settings.embedding_batcher_max_wait_ms
             )
+    
+    @property
+    def provider(self) -> BaseModelProvider:
+        """embedding 模型提供者（首次访问时创建共享连接池）"""
+        return self._provider or provider_registry.embedding
+    
+    async def embed_query(self, query: str) -> List[float]:
+        """
+        生成查询 embedding（缓存命中时跳过 embedding 服务调用，未命中时与并发查询合并批量生成）
+        
+        Args:
+            query: 用户查询文本
+            
+        Returns:
+            embedding 向量，失败时为空列表
+        """
+        model_name = self.provider.model_name
+        if self.query_cache:
+            cached = await self.query_cache.aget(model_name, query)
+            if cached is not None:
+                logger.info("[Embedding] 查询 embedding 缓存命中")
+                return cached
+        
+        if self.batcher:
+            embedding = await self.batcher.embed(query)
         else:
-            raise ValueError(f"不支持的 embedding 提供者: {provider_type}")
+            embeddings = await self.provider.embed_texts([query])
+            embedding = embeddings[0] if embeddings else []
+        if embedding and self.query_cache:
+            await self.query_cache.aset(model_name, query, embedding)
+        return embedding
     
-    async def embed_game(self, game: Game, db: Session) -> Tuple[List[float], str]:
+    async def prefetch_queries(self, queries: List[str]):
+        """预先生成查询 embedding 写入缓存（如推荐给用户的后续问题）"""
+        if not self.query_cache:
+            return
+        for query in queries:
+            if await self.query_cache.aget(self.provider.model_name, query) is not None:
+                continue
+            try:
+                await self.embed_query(query)
+            except Exception as e:
+                logger.warning(f"[Embedding] 预取查询 embedding 失败: {str(e)}")
+                return
+    
+    def build_game_chunk(self, game: Game, db: Session) -> str:
         """
-        为游戏生成 embedding（包含价格、评论、媒体评分）
+        构建游戏的 embedding 文本（包含价格、评论、媒体评分）
         
         Args:
             game: 游戏对象
             db: 数据库会话
             
         Returns:
-            (embedding_vector, chunk_text) 元组
+            chunk_text
         """
         from app.models.game_price import GamePrice
         from app.models.review import Review
@@ -101,7 +154,20 @@ class EmbeddingService:
         
         # 使用 GameCleaner 提取 embedding 字段
         cleaner = GameCleaner()
-        chunk_text = cleaner.extract_embedding_fields(game_data, max_reviews=5)
+        return cleaner.extract_embedding_fields(game_data, max_reviews=5)
+    
+    async def embed_game(self, game: Game, db: Session) -> Tuple[List[float], str]:
+        """
+        为游戏生成 embedding（包含价格、评论、媒体评分）
+        
+        Args:
+            game: 游戏对象
+            db: 数据库会话
+            
+        Returns:
+            (embedding_vector, chunk_text) 元组
+        """
+        chunk_text = self.build_game_chunk(game, db)
         
         # 生成 embedding
         embeddings = await self.provider.embed_texts([chunk_text])
@@ -110,7 +176,7 @@ class EmbeddingService:
         return embedding_vector, chunk_text
     
     async def embed_games_batch(self, games: List[Game]) -> List[List[float]]:
-        """批量生成 embedding（已废弃，使用 embed_game 逐个处理）"""
+        """批量生成 embedding（已废弃，使用 build_game_chunk + provider.embed_texts 批量处理）"""
         texts = []
         for game in games:
             text_parts = []
@@ -0,0 +1,93 @@
+"""
+游戏卡片
+
+检索 / 推荐链路使用的轻量游戏记录，只包含展示和构建提示词需要的列，
+不加载 raw_data、description_html、device_requirement_html 等大字段。
+"""
+from typing import List, Dict, Any, Iterable, Mapping
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.game import Game
+
+# 卡片包含的 games 列（GameResponse 中其余字段取默认值 None）
+CARD_FIELDS = (
+    "id",
+    "external_id",
+    "title",
+    "title_english",
+    "developer_name",
+    "publisher_name",
+    "description",
+    "cover_image_url",
+    "thumbnail_url",
+    "horizontal_image_url",
+    "platforms",
+    "platform_ids",
+    "publish_date",
+    "publish_timestamp",
+    "user_score",
+    "score_users_count",
+    "playeds_count",
+    "want_plays_count",
+    "tags",
+    "steam_game_id",
+    "steam_praise_rate",
+    "steam_header_image",
+    "is_free",
+    "price",
+    "price_original",
+    "source",
+    "created_at",
+    "updated_at",
+)
+
+
+class GameCard:
+    """轻量游戏记录（__slots__，不持有 ORM 会话状态）"""
+    
+    __slots__ = CARD_FIELDS
+    
+    def __init__(self, **values: Any):
+        for field in CARD_FIELDS:
+            setattr(self, field, values.get(field))
+    
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> "GameCard":
+        """从查询结果行（列名 -> 值）创建卡片"""
+        return cls(**{field: row[field] for field in CARD_FIELDS})
+    
+    def __repr__(self) -> str:
+        return f"GameCard(id={self.id}, title={self.title!r})"
+
+
+def card_columns_sql(alias: str = "g") -> str:
+    """原生 SQL 中卡片列的 SELECT 片段"""
+    return ", ".join(f"{alias}.{field} AS {field}" for field in CARD_FIELDS)
+
+
+def card_select():
+    """只选择卡片列的 games 查询（同步 / 异步会话通用）"""
+    return select(*[getattr(Game, field) for field in CARD_FIELDS])
+
+
+def to_cards(rows: Iterable) -> List[GameCard]:
+    """将 card_select 的结果转换为卡片列表"""
+    return [GameCard.from_row(row._mapping) for row in rows]
+
+
+async def fetch_game_cards(db: AsyncSession, game_ids: List[int]) -> Dict[int, GameCard]:
+    """
+    按 id 批量加载游戏卡片
+    
+    Args:
+        db: 数据库会话
+        game_ids: 游戏 ID 列表
+    
+    Returns:
+        game_id -> GameCard
+    """
+    if not game_ids:
+        return {}
+    result = await db.execute(card_select().where(Game.id.in_(game_ids)))
+    rows = result.all()
+    return {card.id: card for card in to_cards(rows)}
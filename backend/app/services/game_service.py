@@ -2,25 +2,27 @@
 游戏服务
 """
 from typing import List, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, or_, func
 from app.models.game import Game
 from app.schemas.game import GameCreate, GameUpdate
+from app.services.catalog_cache import catalog_cache
 
 class GameService:
     """游戏服务"""
     
-    def get_game(self, db: Session, game_id: int) -> Optional[Game]:
+    async def get_game(self, db: AsyncSession, game_id: int) -> Optional[Game]:
         """获取游戏详情"""
-        return db.query(Game).filter(Game.id == game_id).first()
+        return await db.get(Game, game_id)
     
-    def get_game_by_external_id(self, db: Session, external_id: int) -> Optional[Game]:
+    async def get_game_by_external_id(self, db: AsyncSession, external_id: int) -> Optional[Game]:
         """根据外部数据源ID获取游戏"""
-        return db.query(Game).filter(Game.external_id == external_id).first()
+        result = await db.execute(select(Game).where(Game.external_id == external_id))
+        return result.scalars().first()
     
-    def get_games(
+    async def get_games(
         self,
-        db: Session,
+        db: AsyncSession,
         skip: int = 0,
         limit: int = 20,
         search: Optional[str] = None,
@@ -28,11 +30,11 @@ class GameService:
         tag: Optional[str] = None
     ) -> tuple[List[Game], int]:
         """获取游戏列表"""
-        query = db.query(Game)
+        conditions = []
         
         # 搜索
         if search:
-            query = query.filter(
+            conditions.append(
                 or_(
                     Game.title.ilike(f"%{search}%"),
                     Game.title_english.ilike(f"%{search}%"),
@@ -42,35 +44,49 @@ class GameService:
         
         # 平台筛选
         if platform:
-            query = query.filter(Game.platforms.contains([platform]))
+            conditions.append(Game.platforms.contains([platform]))
         
         # 标签筛选
         if tag:
-            query = query.filter(Game.tags.contains([tag]))
+            conditions.append(Game.tags.contains([tag]))
         
         # 总数
-        total = query.count()
+        total = await db.scalar(select(func.count(Game.id)).where(*conditions))
         
         # 分页
-        games = query.order_by(Game.created_at.desc()).offset(skip).limit(limit).all()
+        result = await db.execute(
+            select(Game).where(*conditions).order_by(Game.created_at.desc()).offset(skip).limit(limit)
+        )
+        games = result.scalars().all()
         
         return games, total
     
-    def get_random_games(self, db: Session, limit: int = 10) -> List[Game]:
-        """获取随机游戏"""
-        return db.query(Game).order_by(func.random()).limit(limit).all()
+    async def get_random_games(self, db: AsyncSession, limit: int = 10) -> List[Game]:
+        """
+        获取随机游戏
+        
+        目录缓存已加载时从缓存抽样 id，再按主键加载完整记录（GameCard 不含 HTML 等详情字段），
+        避免 ORDER BY random() 全表扫描。
+        """
+        if catalog_cache.ready:
+            game_ids = [card.id for card in catalog_cache.random(limit)]
+            result = await db.execute(select(Game).where(Game.id.in_(game_ids)))
+            games = {game.id: game for game in result.scalars().all()}
+            return [games[game_id] for game_id in game_ids if game_id in games]
+        result = await db.execute(select(Game).order_by(func.random()).limit(limit))
+        return result.scalars().all()
     
-    def create_game(self, db: Session, game: GameCreate) -> Game:
+    async def create_game(self, db: AsyncSession, game: GameCreate) -> Game:
         """创建游戏"""
         db_game = Game(**game.dict())
         db.add(db_game)
-        db.commit()
-        db.refresh(db_game)
+        await db.commit()
+        await db.refresh(db_game)
         return db_game
     
-    def update_game(self, db: Session, game_id: int, game: GameUpdate) -> Optional[Game]:
+    async def update_game(self, db: AsyncSession, game_id: int, game: GameUpdate) -> Optional[Game]:
         """更新游戏"""
-        db_game = self.get_game(db, game_id)
+        db_game = await self.get_game(db, game_id)
         if not db_game:
             return None
         
@@ -78,7 +94,6 @@ class GameService:
         for key, value in update_data.items():
             setattr(db_game, key, value)
         
-        db.commit()
-        db.refresh(db_game)
+        await db.commit()
+        await db.refresh(db_game)
         return db_game
-
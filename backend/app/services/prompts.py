@@ -0,0 +1,82 @@
+"""
+推荐提示词
+
+系统提示词是模块级常量，每次请求逐字节相同且总是第一条消息；可变内容（候选游戏、用户需求）
+都在其后的 user 消息中。模型服务据此复用已计算的前缀 KV 缓存
+（Ollama / llama.cpp / vLLM 自动前缀复用，OpenAI cached_tokens，Anthropic cache_control），
+只需为可变部分做 prefill。修改常量会使已有前缀缓存失效。
+"""
+from typing import List, Dict
+
+# 推荐回复（/chat/stream、generate_recommendation）
+RECOMMENDATION_SYSTEM_PROMPT = """你是一个专业的游戏推荐助手。
+
+【重要规则】
+1. 你只能从「可推荐的游戏列表」中选择游戏进行推荐
+2. 不要推荐列表之外的任何游戏
+3. 即使你知道其他更合适的游戏，也只能从列表中选择
+4. 为每个推荐的游戏说明推荐理由，解释为什么它符合用户需求
+5. 用自然流畅的语言回复，不要使用编号列表格式"""
+
+# 带选择的推荐回复（/chat、generate_recommendation_with_selection）
+SELECTION_SYSTEM_PROMPT = """你是一个专业的游戏推荐助手。
+
+【核心规则】
+1. 从「候选游戏列表」中选择最符合用户需求的 3 款游戏进行推荐
+2. **重要**：如果用户在问题中提到了某款游戏（如"类似XXX的游戏"），则不要推荐那款游戏本身，要推荐其他类似的游戏
+3. 只能推荐列表中的游戏，不能推荐列表之外的游戏
+4. 用自然流畅的语言介绍每款推荐的游戏，说明推荐理由
+
+【输出格式】
+请按以下格式输出：
+
+---推荐内容开始---
+（在这里写你的推荐文字，自然地介绍 3 款游戏及推荐理由）
+---推荐内容结束---
+
+---游戏ID---
+ID1,ID2,ID3
+---游戏ID结束---
+
+---后续问题---
+问题1
+问题2
+问题3
+---后续问题结束---
+
+注意：
+- 游戏ID 必须是候选列表中的 [ID:数字] 格式里的数字
+- 后续问题要与用户兴趣相关，引导用户探索更多游戏"""
+
+# 候选游戏列表标题（与系统提示词中的引用一致）
+RECOMMENDATION_CONTEXT_HEADER = "【可推荐的游戏列表】"
+SELECTION_CONTEXT_HEADER = "【候选游戏列表】"
+
+
+def recommendation_messages(context: str, user_query: str) -> List[Dict[str, str]]:
+    """推荐回复的消息列表（静态系统提示词在前）"""
+    user_prompt = f"""{context}
+
+【用户需求】
+{user_query}
+
+请从上面的游戏列表中，为用户推荐最合适的游戏，并详细说明每个游戏的推荐理由。记住：只能推荐列表中的游戏！"""
+    return [
+        {"role": "system", "content": RECOMMENDATION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def selection_messages(context: str, user_query: str) -> List[Dict[str, str]]:
+    """带选择的推荐回复的消息列表（静态系统提示词在前）"""
+    user_prompt = f"""{context}
+
+【用户需求】
+{user_query}
+
+请根据用户需求，从候选列表中选择 3 款最合适的游戏进行推荐。
+记住：如果用户提到了"类似XX游戏"，不要推荐XX本身！"""
+    return [
+        {"role": "system", "content": SELECTION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
@@ -0,0 +1,202 @@
+"""
+查询约束提取
+
+从用户查询中识别平台 / 标签 / 免费 / 价格 / 评分约束，转换为 SearchFilters。
+平台和标签只匹配 games 表中实际存在的取值（词表由后台定期刷新）。
+"""
+import logging
+import re
+import unicodedata
+from typing import List, Optional, Dict, Set, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from app.retrievers.search_filters import SearchFilters
+
+logger = logging.getLogger(__name__)
+
+# 平台别名 -> 平台关键字（与词表中的平台名做包含匹配）
+PLATFORM_ALIASES: Dict[str, List[str]] = {
+    "ps5": ["ps5", "playstation 5", "playstation5"],
+    "ps4": ["ps4", "playstation 4", "playstation4"],
+    "switch": ["switch", "ns", "任天堂"],
+    "xbox": ["xbox", "xsx", "xss"],
+    "pc": ["pc", "steam", "电脑", "端游"],
+    "ios": ["ios", "iphone", "ipad", "苹果"],
+    "android": ["android", "安卓"],
+}
+
+# 标签别名 -> 标签（仅当词表中存在该标签时生效）
+TAG_ALIASES: Dict[str, List[str]] = {
+    "合作": ["co-op", "coop", "双人", "一起玩"],
+    "多人": ["多人游戏", "联机", "multiplayer"],
+    "单人": ["单机", "single player"],
+    "肉鸽": ["roguelike", "roguelite", "rogue"],
+    "开放世界": ["open world", "open-world"],
+    "角色扮演": ["rpg"],
+}
+
+# "好评" 类词语对应的默认最低评分
+DEFAULT_GOOD_SCORE = 8.0
+
+_GOOD_SCORE_PATTERN = re.compile(r"好评|高分|口碑好|评分高|神作")
+_MIN_SCORE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*分\s*(?:以上|及以上|往上|\+)")
+_FREE_PATTERN = re.compile(r"免费|free\s*to\s*play|\bf2p\b|\bfree\b")
+_MAX_PRICE_PATTERNS = [
+    # ¥100以内 / 100元以下
+    re.compile(r"(?:[¥￥]\s*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:元|块|rmb))\s*(?:以下|以内|之内|内)"),
+    # 100以内（数字前不能是字母，避免 "ps5以内"）
+    re.compile(r"(?<![a-z0-9.])(\d+(?:\.\d+)?)\s*(?:以下|以内)"),
+    # 低于100 / under ¥100
+    re.compile(r"(?:低于|不超过|不到|少于|under|below|<)\s*[¥￥]?\s*(\d+(?:\.\d+)?)"),
+]
+
+
+def _normalize(value: str) -> str:
+    return unicodedata.normalize("NFKC", value).lower()
+
+
+def _contains_term(query: str, term: str) -> bool:
+    """匹配词语；纯英文 / 数字词语要求单词边界，避免 "ns" 命中 "reasons" 之类"""
+    if re.fullmatch(r"[a-z0-9 .\-+]+", term):
+        return re.search(rf"(?<![a-z0-9]){re.escape(term)}(?![a-z0-9])", query) is not None
+    return term in query
+
+
+def _remove_term(query: str, term: str) -> str:
+    """去掉词语（匹配规则与 _contains_term 相同）"""
+    if re.fullmatch(r"[a-z0-9 .\-+]+", term):
+        return re.sub(rf"(?<![a-z0-9]){re.escape(term)}(?![a-z0-9])", " ", query)
+    return query.replace(term, " ")
+
+
+class QueryConstraintExtractor:
+    """查询约束提取器"""
+    
+    def __init__(self):
+        # 规范化后的取值 -> 原始取值
+        self._platforms: Dict[str, str] = {}
+        self._tags: Dict[str, str] = {}
+        self._fingerprint: Optional[Tuple] = None
+    
+    @property
+    def platform_vocabulary(self) -> List[str]:
+        return list(self._platforms.values())
+    
+    @property
+    def tag_vocabulary(self) -> List[str]:
+        return list(self._tags.values())
+    
+    def sync(self, db: Session) -> bool:
+        """
+        games 表变化时刷新平台 / 标签词表
+        
+        Returns:
+            是否刷新了词表
+        """
+        row = db.execute(text("SELECT COUNT(*), MAX(id), MAX(updated_at) FROM games")).fetchone()
+        fingerprint = tuple(row)
+        if fingerprint == self._fingerprint:
+            return False
+        
+        platforms = db.execute(text(
+            "SELECT DISTINCT platform FROM games, unnest(platforms) AS platform"
+        )).fetchall()
+        tags = db.execute(text(
+            "SELECT DISTINCT tag FROM games, unnest(tags) AS tag"
+        )).fetchall()
+        
+        self._platforms = {_normalize(r[0]): r[0] for r in platforms if r[0]}
+        self._tags = {_normalize(r[0]): r[0] for r in tags if r[0] and len(r[0]) >= 2}
+        self._fingerprint = fingerprint
+        logger.info(f"[Constraints] 词表刷新: {len(self._platforms)} 个平台, {len(self._tags)} 个标签")
+        return True
+    
+    def extract(self, query: str) -> SearchFilters:
+        """
+        提取查询约束
+        
+        Args:
+            query: 用户查询
+        
+        Returns:
+            SearchFilters（无约束时 is_empty 为 True）
+        """
+        normalized = _normalize(query)
+        return SearchFilters(
+            platforms=self._extract_platforms(normalized),
+            tags=self._extract_tags(normalized),
+            is_free=True if _FREE_PATTERN.search(normalized) else None,
+            max_price=self._extract_max_price(normalized),
+            min_score=self._extract_min_score(normalized)
+        )
+    
+    def strip_constraints(self, query: str) -> str:
+        """
+        去掉查询中被识别为约束的词语（平台 / 标签 / 免费 / 价格 / 评分）
+        
+        只去掉实际能产生约束的词语（如词表中没有 PS5 时保留 "ps5"），用于判断查询是否只包含过滤条件。
+        
+        Returns:
+            规范化后的剩余文本
+        """
+        text_left = _normalize(query)
+        for pattern in [_MIN_SCORE_PATTERN, _GOOD_SCORE_PATTERN, _FREE_PATTERN] + _MAX_PRICE_PATTERNS:
+            text_left = pattern.sub(" ", text_left)
+        
+        terms = list(self._platforms) + list(self._tags)
+        for key, aliases in PLATFORM_ALIASES.items():
+            if any(key in normalized for normalized in self._platforms):
+                terms.extend(aliases)
+        for tag, aliases in TAG_ALIASES.items():
+            if _normalize(tag) in self._tags:
+                terms.extend(aliases)
+        for term in sorted(set(terms), key=len, reverse=True):
+            text_left = _remove_term(text_left, term)
+        return text_left
+    
+    def _extract_platforms(self, query: str) -> List[str]:
+        matched: Set[str] = set()
+        for key, aliases in PLATFORM_ALIASES.items():
+            if any(_contains_term(query, alias) for alias in aliases):
+                matched.update(
+                    original for normalized, original in self._platforms.items() if key in normalized
+                )
+        # 词表中的平台名直接出现在查询中
+        matched.update(
+            original for normalized, original in self._platforms.items()
+            if _contains_term(query, normalized)
+        )
+        return sorted(matched)
+    
+    def _extract_tags(self, query: str) -> List[str]:
+        matched: List[str] = []
+        for normalized, original in self._tags.items():
+            if _contains_term(query, normalized):
+                matched.append(normalized)
+        for tag, aliases in TAG_ALIASES.items():
+            normalized_tag = _normalize(tag)
+            if normalized_tag in self._tags and any(_contains_term(query, alias) for alias in aliases):
+                matched.append(normalized_tag)
+        
+        # 去掉被更长标签包含的短标签（如同时命中 "开放" 与 "开放世界"）
+        unique = set(matched)
+        result = [
+            tag for tag in unique
+            if not any(tag != other and tag in other for other in unique)
+        ]
+        return sorted(self._tags[tag] for tag in result)
+    
+    def _extract_max_price(self, query: str) -> Optional[float]:
+        for pattern in _MAX_PRICE_PATTERNS:
+            match = pattern.search(query)
+            if match:
+                return float(next(group for group in match.groups() if group))
+        return None
+    
+    def _extract_min_score(self, query: str) -> Optional[float]:
+        match = _MIN_SCORE_PATTERN.search(query)
+        if match:
+            return float(match.group(1))
+        if _GOOD_SCORE_PATTERN.search(query):
+            return DEFAULT_GOOD_SCORE
+        return None
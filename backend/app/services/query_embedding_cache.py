@@ -0,0 +1,162 @@
+"""
+查询 Embedding 缓存
+
+以规范化后的查询文本为键的 LRU + TTL 内存缓存，可选持久化到 SQLite。
+命中时直接返回向量，跳过 embedding 服务调用。
+"""
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbeddingCache:
+    """查询 Embedding 缓存"""
+    
+    def __init__(self, max_size: int = 2048, ttl: float = 7 * 24 * 3600, path: Optional[str] = None):
+        """
+        Args:
+            max_size: 内存中最多缓存的查询数量
+            ttl: 过期时间（秒）
+            path: SQLite 持久化文件路径，为空则只使用内存缓存
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        
+        # key -> (embedding, expires_at)
+        self._entries: "OrderedDict[str, Tuple[List[float], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """规范化查询文本：全半角统一、去除首尾空白、合并空白、英文小写"""
+        text = unicodedata.normalize("NFKC", text)
+        text = re.sub(r"\s+", " ", text).strip()
+        return text.lower()
+    
+    def _key(self, model_name: str, text: str) -> str:
+        return f"{model_name}\x00{self.normalize(text)}"
+    
+    def _get_conn(self) -> Optional[sqlite3.Connection]:
+        """延迟打开 SQLite 连接（调用方需持有锁）"""
+        if not self.path:
+            return None
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+    
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        """查询缓存，未命中或已过期返回 None"""
+        key = self._key(model_name, text)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                embedding, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+            
+            try:
+                conn = self._get_conn()
+                if conn is not None:
+                    row = conn.execute(
+                        "SELECT embedding, expires_at FROM query_embeddings WHERE key = ?",
+                        (key,)
+                    ).fetchone()
+                    if row and row[1] > now:
+                        embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+                        self._put(key, embedding, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return embedding
+            except sqlite3.Error as e:
+                logger.warning(f"[EmbeddingCache] 读取持久化缓存失败: {str(e)}")
+            
+            self.misses += 1
+            return None
+    
+    def set(self, model_name: str, text: str, embedding: List[float]):
+        """写入缓存"""
+        key = self._key(model_name, text)
+        expires_at = time.time() + self.ttl
+        
+        with self._lock:
+            self._put(key, embedding, expires_at)
+            try:
+                conn = self._get_conn()
+                if conn is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (key, embedding, expires_at) VALUES (?, ?, ?)",
+                        (key, np.asarray(embedding, dtype=np.float32).tobytes(), expires_at)
+                    )
+                    conn.execute("DELETE FROM query_embeddings WHERE expires_at <= ?", (time.time(),))
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[EmbeddingCache] 写入持久化缓存失败: {str(e)}")
+    
+    async def aget(self, model_name: str, text: str) -> Optional[List[float]]:
+        """异步查询缓存（开启持久化时在线程中执行，SQLite 读取不阻塞事件循环）"""
+        if not self.path:
+            return self.get(model_name, text)
+        return await asyncio.to_thread(self.get, model_name, text)
+    
+    async def aset(self, model_name: str, text: str, embedding: List[float]):
+        """异步写入缓存（开启持久化时在线程中执行）"""
+        if not self.path:
+            self.set(model_name, text, embedding)
+            return
+        await asyncio.to_thread(self.set, model_name, text, embedding)
+    
+    def _put(self, key: str, embedding: List[float], expires_at: float):
+        """写入内存 LRU（调用方需持有锁）"""
+        self._entries[key] = (embedding, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+    
+    def close(self):
+        """关闭持久化连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,231 @@
+"""
+查询路由
+
+很多查询只是过滤 + 排序（"好评的免费 Switch 游戏"、"最新的 roguelike"），不需要语义检索和 LLM 生成。
+QueryRouter 用 QueryConstraintExtractor 的平台 / 标签词表识别约束，再识别排序意图（评分 / 发售时间 / 热度），
+去掉这些词语和常见虚词后没有剩余内容的查询走快速路径：直接按条件查询 games 表（走索引），
+用模板生成推荐文字和后续问题；其余查询仍走 RAG 流程。
+"""
+import logging
+import re
+import time
+from datetime import date
+from typing import List, Dict, Any, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.game import Game
+from app.retrievers.search_filters import SearchFilters
+from app.services.game_card import GameCard, card_select, to_cards
+from app.services.query_constraints import QueryConstraintExtractor
+
+logger = logging.getLogger(__name__)
+
+# 排序意图 -> 识别模式（按顺序匹配）
+SORT_PATTERNS = {
+    "recent": re.compile(r"最新|新出的?|新发售|新上线|近期|最近|新游|\blatest\b|\bnewest\b|\bnew\b"),
+    "popular": re.compile(r"热门|最火|最热|流行|人气|\bpopular\b"),
+    "score": re.compile(r"评分最高|最高分|排名最高|最好|口碑最好|\btop\b|\bbest\b"),
+}
+
+SORT_LABELS = {
+    "score": "评分",
+    "recent": "发售时间",
+    "popular": "热度",
+}
+
+# 不影响查询意图的常见词语（按长度从长到短去掉）
+FILLER_WORDS = [
+    "有没有", "有什么", "有哪些", "推荐一下", "推荐几款", "来几款", "给我推荐", "帮我找", "我想玩", "我想找",
+    "哪些", "什么", "推荐", "一下", "一些", "几款", "几个", "给我", "帮我", "我想", "想要", "想玩", "想找",
+    "来点", "可以玩", "能玩", "好玩", "游戏", "平台", "类型", "风格", "上的",
+    "games", "game", "recommend", "please", "some", "the",
+    "找", "求", "玩", "上", "的", "吗", "呢", "吧", "啊", "款", "个", "类", "和", "与", "或",
+]
+_FILLER_PATTERN = re.compile("|".join(re.escape(word) for word in sorted(FILLER_WORDS, key=len, reverse=True)))
+_LEFTOVER_PATTERN = re.compile(r"[\W_]+")
+
+# 没有排序意图时的默认排序
+DEFAULT_SORT = "score"
+
+
+class QueryRoute:
+    """路由结果"""
+    
+    def __init__(self, structured: bool, filters: SearchFilters, sort: Optional[str], leftover: str = ""):
+        self.structured = structured  # True: 快速路径（SQL + 模板回复），False: RAG
+        self.filters = filters
+        self.sort = sort or DEFAULT_SORT
+        self.leftover = leftover  # 去掉约束和虚词后剩余的文本（非空时走 RAG）
+    
+    def __repr__(self) -> str:
+        route = "structured" if self.structured else "rag"
+        return f"QueryRoute({route}, {self.filters}, sort={self.sort}, leftover={self.leftover!r})"
+
+
+class QueryRouter:
+    """结构化查询识别与快速路径"""
+    
+    def __init__(self, extractor: QueryConstraintExtractor):
+        self.extractor = extractor
+        
+        self.queries = 0
+        self.structured = 0
+        self.answered = 0
+        self.empty = 0  # 快速路径查询无结果，回退到 RAG
+        self.total_ms = 0.0
+    
+    def route(self, query: str) -> QueryRoute:
+        """判断查询是否只包含过滤 / 排序条件"""
+        self.queries += 1
+        filters = self.extractor.extract(query)
+        leftover = self.extractor.strip_constraints(query)
+        
+        sort = None
+        for name, pattern in SORT_PATTERNS.items():
+            if pattern.search(leftover):
+                sort = sort or name
+                leftover = pattern.sub(" ", leftover)
+        if sort is None and filters.min_score is not None:
+            sort = "score"
+        
+        leftover = _LEFTOVER_PATTERN.sub("", _FILLER_PATTERN.sub(" ", leftover))
+        structured = not leftover and (not filters.is_empty or sort is not None)
+        if structured:
+            self.structured += 1
+        return QueryRoute(structured, filters, sort, leftover)
+    
+    async def search(self, db: AsyncSession, route: QueryRoute, limit: int = 10) -> List[GameCard]:
+        """按过滤条件和排序查询游戏卡片"""
+        statement = card_select()
+        if not route.filters.is_empty:
+            where_sql, params = route.filters.to_sql(Game.__tablename__)
+            statement = statement.where(text(where_sql).bindparams(**params))
+        
+        if route.sort == "recent":
+            statement = statement.where(Game.publish_date <= date.today()).order_by(
+                Game.publish_date.desc().nulls_last(), Game.id.desc()
+            )
+        elif route.sort == "popular":
+            statement = statement.order_by(
+                Game.playeds_count.desc().nulls_last(), Game.user_score.desc().nulls_last()
+            )
+        else:
+            statement = statement.order_by(
+                Game.user_score.desc().nulls_last(), Game.score_users_count.desc().nulls_last()
+            )
+        result = await db.execute(statement.limit(limit))
+        return to_cards(result.all())
+    
+    async def answer(self, db: AsyncSession, query: str, limit: int = 10) -> Optional[Dict[str, Any]]:
+        """
+        快速路径回答
+        
+        Returns:
+            非结构化查询、查询无结果或查询失败时为 None（调用方走 RAG）；否则为 {
+                'response': str,  # 模板推荐文字
+                'games': List[GameCard],  # 满足条件的游戏（按排序）
+                'recommended_game_ids': List[int],  # 推荐的前 3 个游戏 ID
+                'suggested_questions': List[str]  # 模板后续问题
+            }
+        """
+        route = self.route(query)
+        if not route.structured:
+            return None
+        
+        start_time = time.perf_counter()
+        try:
+            games = await self.search(db, route, limit)
+        except Exception as e:
+            logger.warning(f"[Router] 快速路径查询失败，改走 RAG: {str(e)}")
+            await db.rollback()
+            return None
+        if not games:
+            self.empty += 1
+            logger.info(f"[Router] {route} 无结果，改走 RAG")
+            return None
+        
+        recommended = games[:3]
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        self.answered += 1
+        self.total_ms += elapsed_ms
+        logger.info(f"[Router] 快速路径: {route}，{len(games)} 个结果，耗时 {elapsed_ms:.1f}ms")
+        return {
+            'response': self._render_response(route, recommended),
+            'games': games,
+            'recommended_game_ids': [game.id for game in recommended],
+            'suggested_questions': self._follow_up_questions(route, games)
+        }
+    
+    @staticmethod
+    def _describe(filters: SearchFilters) -> str:
+        """过滤条件的中文描述，如 "Switch、肉鸽、免费、评分 8 分以上" """
+        parts = []
+        if filters.platforms:
+            parts.append("/".join(filters.platforms))
+        parts.extend(filters.tags)
+        if filters.is_free:
+            parts.append("免费")
+        if filters.max_price is not None:
+            parts.append(f"¥{filters.max_price:g} 以内")
+        if filters.min_score is not None:
+            parts.append(f"评分 {filters.min_score:g} 分以上")
+        return "、".join(parts)
+    
+    def _render_response(self, route: QueryRoute, games: List[GameCard]) -> str:
+        description = self._describe(route.filters)
+        subject = f"符合条件（{description}）的游戏" if description else "游戏"
+        lines = [f"为你找到以下{subject}，按{SORT_LABELS[route.sort]}排序："]
+        for i, game in enumerate(games):
+            fields = []
+            if game.user_score:
+                fields.append(f"评分 {game.user_score}")
+            if game.platforms:
+                fields.append("/".join(game.platforms[:3]))
+            if route.sort == "recent" and game.publish_date:
+                fields.append(f"{game.publish_date.isoformat()} 发售")
+            if game.is_free:
+                fields.append("免费")
+            if game.tags:
+                fields.append("、".join(game.tags[:3]))
+            line = f"{i + 1}. {game.title}"
+            if fields:
+                line += " — " + "｜".join(fields)
+            lines.append(line)
+        return "\n".join(lines)
+    
+    @staticmethod
+    def _follow_up_questions(route: QueryRoute, games: List[GameCard]) -> List[str]:
+        """换一种排序 / 加上免费条件 / 换一个结果中常见的标签"""
+        filters = route.filters
+        subject = " ".join(filters.platforms[:1] + filters.tags)
+        
+        questions = []
+        if route.sort == "recent":
+            questions.append(f"评分最高的{subject}游戏有哪些？")
+        else:
+            questions.append(f"最新的{subject}游戏有哪些？")
+        if not filters.is_free:
+            questions.append(f"有没有免费的{subject}游戏？")
+        
+        tag_counts: Dict[str, int] = {}
+        for game in games:
+            for tag in (game.tags or [])[:3]:
+                if tag not in filters.tags:
+                    tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        if tag_counts:
+            tag = max(tag_counts, key=tag_counts.get)
+            questions.append(f"有没有更多{tag}类型的游戏推荐？")
+        
+        questions.append("有什么适合周末放松玩的游戏吗？")
+        return questions[:3]
+    
+    def stats(self) -> Dict[str, Any]:
+        """路由统计"""
+        return {
+            "queries": self.queries,
+            "structured": self.structured,
+            "answered": self.answered,
+            "empty": self.empty,
+            "structured_rate": round(self.structured / self.queries, 4) if self.queries else 0.0,
+            "avg_ms": round(self.total_ms / self.answered, 1) if self.answered else 0.0
+        }
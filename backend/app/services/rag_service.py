@@ -1,19 +1,84 @@
 """
 RAG 服务
 """
+import asyncio
 import logging
 import re
 import json
-from typing import List, Dict, Optional, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+import time
+from collections import defaultdict
+from typing import List, Dict, Optional, Any, Tuple, AsyncIterator, Callable
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import SessionLocal
 from app.models.game import Game
 from app.services.embedding_service import EmbeddingService
-from app.model_providers import LocalModelProvider, OpenAIProvider, AnthropicProvider
+from app.model_providers import BaseModelProvider, PromptUsage, prompt_usage, provider_registry
+from app.retrievers import (
+    BaseRetriever, SearchFilters, PgvectorRetriever, PgvectorHalfvecRetriever, HNSWRetriever, MmapRetriever,
+    LexicalIndex
+)
+from app.services.corpus_state import CorpusState
+from app.services.query_constraints import QueryConstraintExtractor
+from app.services.query_router import QueryRouter
+from app.services.game_card import GameCard, card_select, to_cards
+from app.services.catalog_cache import catalog_cache
+from app.services.context_packer import ContextPacker, PackedContext, load_token_counter
+from app.services.recommendation_parser import RecommendationStreamParser
+from app.services.sse_coalescer import coalesce
+from app.services.prompts import (
+    RECOMMENDATION_CONTEXT_HEADER, SELECTION_CONTEXT_HEADER, recommendation_messages, selection_messages
+)
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 混合检索时每路召回的候选数 = limit * 倍数
+HYBRID_CANDIDATE_MULTIPLIER = 2
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Tuple[int, float]]], k: int = 60) -> List[int]:
+    """
+    RRF 融合多路检索结果
+    
+    Args:
+        result_lists: 各路检索的 (game_id, 分数) 列表，已按分数降序
+        k: RRF 平滑常数
+        
+    Returns:
+        融合后按得分降序的 game_id 列表
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    for results in result_lists:
+        for rank, (game_id, _) in enumerate(results, 1):
+            scores[game_id] += 1.0 / (k + rank)
+    return [game_id for game_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
+
+
+def create_retriever(backend: str) -> BaseRetriever:
+    """根据配置创建向量检索后端"""
+    if backend == "pgvector":
+        return PgvectorRetriever()
+    elif backend == "pgvector_halfvec":
+        return PgvectorHalfvecRetriever(
+            ef_search=settings.pgvector_ef_search,
+            candidate_multiplier=settings.pgvector_candidate_multiplier,
+            iterative_scan=settings.pgvector_iterative_scan
+        )
+    elif backend == "hnsw":
+        return HNSWRetriever(
+            dim=settings.embedding_dimension,
+            m=settings.hnsw_m,
+            ef_construction=settings.hnsw_ef_construction,
+            ef_search=settings.hnsw_ef_search
+        )
+    elif backend == "mmap":
+        return MmapRetriever(
+            snapshot_dir=settings.embedding_snapshot_dir,
+            dim=settings.embedding_dimension
+        )
+    else:
+        raise ValueError(f"不支持的向量检索后端: {backend}")
+
 
 class RAGService:
     """RAG 服务"""
@@ -21,130 +86,247 @@ class RAGService:
     def __init__(self):
         self.embedding_service = EmbeddingService()
         
-        # 创建聊天模型提供者
-        provider_type = settings.chat_model_provider
-        if provider_type == "local":
-            self.chat_provider = LocalModelProvider(
-                model_name=settings.chat_model_name,
-                base_url=settings.chat_base_url,
-                api_key=settings.chat_api_key
-            )
-        elif provider_type == "openai":
-            self.chat_provider = OpenAIProvider(
-                model_name=settings.chat_model_name,
-                base_url=settings.chat_base_url,
-                api_key=settings.chat_api_key
-            )
-        elif provider_type == "anthropic":
-            self.chat_provider = AnthropicProvider(
-                model_name=settings.chat_model_name,
-                base_url=settings.chat_base_url,
-                api_key=settings.chat_api_key
-            )
+        # 创建向量检索后端（pgvector 始终保留，作为进程内索引未就绪时的后备）
+        self.pgvector_retriever = PgvectorRetriever()
+        if settings.vector_search_backend == "pgvector":
+            self.retriever: BaseRetriever = self.pgvector_retriever
         else:
-            raise ValueError(f"不支持的聊天模型提供者: {provider_type}")
+            self.retriever = create_retriever(settings.vector_search_backend)
+        
+        # 词法倒排索引（混合检索）
+        self.lexical_index = LexicalIndex()
+        
+        # 查询约束提取（平台 / 标签 / 价格 / 评分过滤）
+        self.constraint_extractor = QueryConstraintExtractor()
+        # 过滤 / 排序类查询的快速路径（不做 embedding 和 LLM 生成）
+        self.query_router = QueryRouter(self.constraint_extractor)
+        
+        # 候选游戏上下文打包（token 预算 + 片段缓存）
+        self.context_packer = ContextPacker(
+            token_budget=settings.context_token_budget,
+            description_chars=settings.context_description_chars,
+            max_tags=settings.context_max_tags,
+            cache_size=settings.context_snippet_cache_size,
+            token_counter=load_token_counter(settings.context_tokenizer)
+        )
+        
+        # embedding 语料状态（后台刷新，热路径只读内存）
+        self.corpus_state = CorpusState()
+        self._maintenance_task: Optional[asyncio.Task] = None
+    
+    @property
+    def chat_provider(self) -> BaseModelProvider:
+        """聊天模型提供者（进程内共享，由 provider_registry 管理连接）"""
+        return provider_registry.chat
+    
+    async def start(self):
+        """启动后台维护任务（语料状态刷新、检索索引同步、目录缓存加载）"""
+        if self._maintenance_task:
+            return
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+    
+    async def stop(self):
+        """停止后台维护任务"""
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+    
+    async def _maintenance_loop(self):
+        """定期刷新语料状态，语料变化时增量同步检索索引（首次执行即为全量构建）"""
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh_corpus)
+            except Exception as e:
+                logger.warning(f"[RAG] 语料状态刷新 / {self.retriever.name} 索引同步失败: {str(e)}")
+            await asyncio.sleep(settings.corpus_refresh_interval)
+    
+    def refresh_corpus(self) -> bool:
+        """
+        在独立会话中刷新语料状态，并在语料变化时同步检索索引和词法索引；目录版本变化时重新加载目录缓存
+        
+        Returns:
+            语料是否发生变化
+        """
+        db = SessionLocal()
+        try:
+            changed = self.corpus_state.refresh(db)
+            if changed or not self.retriever.ready or self.retriever.is_stale():
+                self.retriever.sync(db)
+            self.corpus_state.index_ready = self.retriever.ready
+            if settings.hybrid_search_enabled:
+                self.lexical_index.sync(db)
+            # 约束提取和查询路由共用平台 / 标签词表
+            if settings.query_filter_enabled or settings.query_router_enabled:
+                self.constraint_extractor.sync(db)
+            if settings.catalog_cache_enabled:
+                catalog_cache.refresh(db)
+            return changed
+        finally:
+            db.close()
     
     async def search_similar_games(
         self,
-        db: Session,
+        db: AsyncSession,
         query: str,
         limit: int = 5
-    ) -> List[Game]:
-        """搜索相似游戏 (使用向量检索)"""
-        from app.models.game_embedding import GameEmbedding
+    ) -> List[GameCard]:
+        """
+        搜索相似游戏 (结构化过滤 + 向量检索 + 词法检索，RRF 融合)
+        
+        向量检索在同一条 SQL 中返回游戏卡片（只投影需要的列），只有词法检索独有的结果需要再补查。
+        """
+        logger.info("=" * 50)
         
+        filters = await self._extract_filters(db, query)
+        allowed_ids = await filters.matching_game_ids(db) if filters else None
+        
+        # 词法检索与向量检索并行执行，embedding 服务不可用时仍能返回词法结果
+        use_lexical = settings.hybrid_search_enabled and self.lexical_index.ready
+        candidates = limit * HYBRID_CANDIDATE_MULTIPLIER if use_lexical else limit
+        lexical_task = None
+        if use_lexical:
+            lexical_task = asyncio.create_task(
+                asyncio.to_thread(self.lexical_index.search, query, candidates, allowed_ids)
+            )
+        
+        try:
+            vector_cards = await self._vector_search(db, query, candidates, filters)
+        except Exception as e:
+            logger.warning(f"[RAG] 向量检索失败: {str(e)}")
+            # 回滚失败的事务，后续加载游戏卡片的查询才能继续执行
+            await db.rollback()
+            vector_cards = []
+        cards = {card.id: card for card, _ in vector_cards}
+        vector_rows = [(card.id, similarity) for card, similarity in vector_cards]
+        
+        if lexical_task:
+            try:
+                lexical_rows = await lexical_task
+            except Exception as e:
+                logger.warning(f"[RAG] 词法检索失败: {str(e)}")
+                lexical_rows = []
+            logger.info(f"[RAG] 词法检索结果 (找到 {len(lexical_rows)} 个游戏)")
+            for i, row in enumerate(lexical_rows[:limit]):
+                logger.info(f"  [{i+1}] game_id={row[0]}, BM25={row[1]:.4f}")
+            game_ids = reciprocal_rank_fusion([vector_rows, lexical_rows], k=settings.rrf_k)[:limit]
+        else:
+            game_ids = [row[0] for row in vector_rows][:limit]
+        
+        if not game_ids:
+            # 如果没有结果，降级到文本搜索
+            logger.warning("[RAG] 检索无结果，降级到文本搜索")
+            fallback_query = card_select().where(Game.description.ilike(f"%{query}%"))
+            if allowed_ids is not None:
+                fallback_query = fallback_query.where(Game.id.in_(allowed_ids))
+            result = await db.execute(fallback_query.limit(limit))
+            return to_cards(result.all())
+        
+        # 只补查词法检索独有的游戏
+        missing_ids = [gid for gid in game_ids if gid not in cards]
+        if missing_ids:
+            cards.update(await catalog_cache.get_cards(db, missing_ids))
+        ordered_games = [cards[gid] for gid in game_ids if gid in cards]
+        
+        logger.info("[RAG] 检索到的游戏:")
+        for i, game in enumerate(ordered_games):
+            logger.info(f"  [{i+1}] {game.title}")
         logger.info("=" * 50)
+        
+        return ordered_games
+    
+    async def _extract_filters(self, db: AsyncSession, query: str) -> Optional[SearchFilters]:
+        """
+        提取查询中的结构化约束
+        
+        Returns:
+            SearchFilters；未启用、无约束或没有任何游戏满足约束（放宽过滤）时为 None
+        """
+        if not settings.query_filter_enabled:
+            return None
+        
+        filters = self.constraint_extractor.extract(query)
+        if filters.is_empty:
+            return None
+        
+        try:
+            matched = len(await filters.matching_game_ids(db))
+        except Exception as e:
+            logger.warning(f"[RAG] 过滤条件查询失败，忽略过滤: {str(e)}")
+            await db.rollback()
+            return None
+        
+        logger.info(f"[RAG] 查询约束: {filters} (满足条件的游戏 {matched} 个)")
+        if matched == 0:
+            logger.info("[RAG] 没有游戏满足查询约束，放宽过滤")
+            return None
+        return filters
+    
+    async def _vector_search(
+        self,
+        db: AsyncSession,
+        query: str,
+        limit: int,
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[GameCard, float]]:
+        """
+        向量检索
+        
+        Returns:
+            (GameCard, 相似度) 列表；embedding 失败或语料不可用时为空列表
+        """
         logger.info("[RAG] Step 1: 生成查询 Embedding")
         logger.info(f"[RAG] 查询文本: {query[:100]}...")
         
-        # 生成查询 embedding
-        query_embeddings = await self.embedding_service.provider.embed_texts([query])
-        if not query_embeddings or not query_embeddings[0]:
-            # 如果 embedding 失败，降级到文本搜索
-            logger.warning("[RAG] Embedding 生成失败，降级到文本搜索")
-            games = db.query(Game).filter(
-                Game.description.ilike(f"%{query}%")
-            ).limit(limit).all()
-            return games
-        
-        query_embedding = query_embeddings[0]
+        # 生成查询 embedding（命中缓存时不请求 embedding 服务）
+        query_embedding = await self.embedding_service.embed_query(query)
+        if not query_embedding:
+            logger.warning("[RAG] Embedding 生成失败")
+            return []
+        
         logger.info(f"[RAG] 生成 Embedding 成功，维度: {len(query_embedding)}")
         
-        # 向量检索 (使用 pgvector)
-        try:
-            from app.models.game_embedding import GameEmbedding, VECTOR_AVAILABLE
-            
-            if not VECTOR_AVAILABLE:
-                raise ImportError("pgvector 未安装")
-            
-            # 检查是否有 embedding 数据
-            embedding_count = db.query(GameEmbedding).count()
-            logger.info(f"[RAG] Step 2: 向量检索 (数据库中有 {embedding_count} 条 embedding)")
-            
-            if embedding_count == 0:
-                logger.warning("[RAG] 没有找到 embedding 数据，降级到文本搜索")
-                games = db.query(Game).filter(
-                    Game.description.ilike(f"%{query}%")
-                ).limit(limit).all()
-                return games
-            
-            # 使用原生 SQL 查询进行向量相似度搜索
-            # <=> 是 pgvector 的余弦距离操作符
-            query_vec_str = "[" + ",".join(map(str, query_embedding)) + "]"
-            
-            logger.info("[RAG] 执行向量相似度查询...")
-            result = db.execute(
-                text("""
-                    SELECT game_id, 
-                        1 - (embedding_vector <=> CAST(:query_vec AS vector)) as similarity
-                    FROM game_embeddings
-                    ORDER BY embedding_vector <=> CAST(:query_vec AS vector)
-                    LIMIT :limit
-                """),
-                {
-                    "query_vec": query_vec_str,
-                    "limit": limit
-                }
+        from app.models.game_embedding import VECTOR_AVAILABLE
+        if not VECTOR_AVAILABLE:
+            raise ImportError("pgvector 未安装")
+        
+        # 检查是否有 embedding 数据（读取后台刷新的语料状态，不查询数据库）
+        corpus_state = self.corpus_state
+        logger.info(f"[RAG] Step 2: 向量检索 (语料中有 {corpus_state.embedding_count} 条 embedding)")
+        
+        if not corpus_state.has_embeddings:
+            logger.warning("[RAG] 没有找到 embedding 数据")
+            return []
+        
+        if not corpus_state.is_compatible(len(query_embedding)):
+            logger.warning(
+                f"[RAG] 查询向量维度 {len(query_embedding)} 与语料维度 {corpus_state.dimension} 不一致"
             )
-            
-            rows = result.fetchall()
-            if rows:
-                logger.info(f"[RAG] Step 3: 检索结果 (找到 {len(rows)} 个相似游戏)")
-                for i, row in enumerate(rows):
-                    logger.info(f"  [{i+1}] game_id={row[0]}, 相似度={row[1]:.4f}")
-                
-                game_ids = [row[0] for row in rows]
-                games = db.query(Game).filter(Game.id.in_(game_ids)).all()
-                # 保持顺序
-                game_dict = {g.id: g for g in games}
-                ordered_games = [game_dict[gid] for gid in game_ids if gid in game_dict]
-                
-                logger.info("[RAG] 检索到的游戏:")
-                for i, game in enumerate(ordered_games):
-                    logger.info(f"  [{i+1}] {game.title}")
-                logger.info("=" * 50)
-                
-                return ordered_games
-            else:
-                # 如果没有结果，降级到文本搜索
-                logger.warning("[RAG] 向量检索无结果，降级到文本搜索")
-                games = db.query(Game).filter(
-                    Game.description.ilike(f"%{query}%")
-                ).limit(limit).all()
-                return games
-        except Exception as e:
-            # 如果向量检索失败，降级到文本搜索
-            logger.warning(f"[RAG] 向量检索失败: {str(e)}，降级到文本搜索")
-            games = db.query(Game).filter(
-                Game.description.ilike(f"%{query}%")
-            ).limit(limit).all()
-            return games
+            return []
+        
+        # 进程内索引尚未构建完成时，使用 pgvector 检索
+        retriever = self.retriever if self.retriever.ready else self.pgvector_retriever
+        
+        logger.info(f"[RAG] 执行向量相似度查询 (后端: {retriever.name})...")
+        start_time = time.perf_counter()
+        rows = await retriever.search_cards(db, query_embedding, limit, filters)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        logger.info(f"[RAG] 向量检索耗时: {elapsed_ms:.2f}ms")
+        
+        logger.info(f"[RAG] Step 3: 检索结果 (找到 {len(rows)} 个相似游戏)")
+        for i, (card, similarity) in enumerate(rows):
+            logger.info(f"  [{i+1}] game_id={card.id}, 相似度={similarity:.4f}")
+        
+        return rows
     
     async def generate_recommendation(
         self,
-        db: Session,
+        db: AsyncSession,
         user_query: str,
-        context_games: Optional[List[Game]] = None
+        context_games: Optional[List[GameCard]] = None
     ) -> str:
         """生成游戏推荐"""
         logger.info("[RAG] Step 4: 生成推荐回复")
@@ -155,51 +337,22 @@ class RAGService:
         
         # 构建上下文 - 提供更详细的游戏信息
         games_to_recommend = context_games[:3]  # 只推荐前3个
-        context = "【可推荐的游戏列表】\n"
-        for i, game in enumerate(games_to_recommend, 1):
-            context += f"\n{i}. **{game.title}**"
-            if game.title_english:
-                context += f" ({game.title_english})"
-            context += "\n"
-            if game.description:
-                context += f"   简介: {game.description[:300]}...\n"
-            if game.tags:
-                context += f"   标签: {', '.join(game.tags[:8])}\n"
-            if game.platforms:
-                context += f"   平台: {', '.join(game.platforms)}\n"
-            if game.user_score:
-                context += f"   评分: {game.user_score}\n"
+        packed = self.context_packer.pack(games_to_recommend, RECOMMENDATION_CONTEXT_HEADER, style="numbered")
         
-        logger.info(f"[RAG] 构建上下文，包含 {len(games_to_recommend)} 个游戏")
-        logger.info(f"[RAG] 上下文长度: {len(context)} 字符")
+        logger.info(f"[RAG] 构建上下文，包含 {len(packed.games)} 个游戏")
+        logger.info(f"[RAG] 上下文长度: {len(packed.text)} 字符，约 {packed.tokens} tokens")
         
-        # 构建提示 - 强制 LLM 只从列表中推荐
-        system_prompt = """你是一个专业的游戏推荐助手。
-
-【重要规则】
-1. 你只能从「可推荐的游戏列表」中选择游戏进行推荐
-2. 不要推荐列表之外的任何游戏
-3. 即使你知道其他更合适的游戏，也只能从列表中选择
-4. 为每个推荐的游戏说明推荐理由，解释为什么它符合用户需求
-5. 用自然流畅的语言回复，不要使用编号列表格式"""
-
-        user_prompt = f"""{context}
-
-【用户需求】
-{user_query}
-
-请从上面的游戏列表中，为用户推荐最合适的游戏，并详细说明每个游戏的推荐理由。记住：只能推荐列表中的游戏！"""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        # 构建提示 - 强制 LLM 只从列表中推荐（静态系统提示词在前，可复用前缀缓存）
+        messages = recommendation_messages(packed.text, user_query)
         
         logger.info("[RAG] Step 5: 调用 LLM 生成回复...")
         
         # 生成回复
+        usage = PromptUsage()
+        prompt_usage.set(usage)
         response = await self.chat_provider.chat(messages, stream=False)
         result = response if isinstance(response, str) else ""
+        logger.info(f"[RAG] Prompt 统计: {usage.to_dict()}")
         
         logger.info(f"[RAG] 生成完成，回复长度: {len(result)} 字符")
         logger.info("=" * 50)
@@ -208,9 +361,9 @@ class RAGService:
     
     async def generate_recommendation_with_selection(
         self,
-        db: Session,
+        db: AsyncSession,
         user_query: str,
-        context_games: List[Game]
+        context_games: List[GameCard]
     ) -> Dict[str, Any]:
         """
         生成游戏推荐（带智能选择）
@@ -227,77 +380,21 @@ class RAGService:
         """
         logger.info("[RAG] Step 4: 生成推荐回复（带智能选择）")
         
-        # 构建游戏列表上下文
-        context = "【候选游戏列表】\n"
-        for i, game in enumerate(context_games, 1):
-            context += f"\n[ID:{game.id}] {game.title}"
-            if game.title_english:
-                context += f" ({game.title_english})"
-            context += "\n"
-            if game.description:
-                context += f"   简介: {game.description[:250]}...\n"
-            if game.tags:
-                context += f"   标签: {', '.join(game.tags[:6])}\n"
-            if game.platforms:
-                context += f"   平台: {', '.join(game.platforms)}\n"
-            if game.user_score:
-                context += f"   评分: {game.user_score}\n"
-        
-        logger.info(f"[RAG] 构建上下文，包含 {len(context_games)} 个候选游戏")
-        
-        # 构建提示 - 让 LLM 选择并排除用户提到的游戏
-        system_prompt = """你是一个专业的游戏推荐助手。
-
-【核心规则】
-1. 从「候选游戏列表」中选择最符合用户需求的 3 款游戏进行推荐
-2. **重要**：如果用户在问题中提到了某款游戏（如"类似XXX的游戏"），则不要推荐那款游戏本身，要推荐其他类似的游戏
-3. 只能推荐列表中的游戏，不能推荐列表之外的游戏
-4. 用自然流畅的语言介绍每款推荐的游戏，说明推荐理由
-
-【输出格式】
-请按以下格式输出：
-
----推荐内容开始---
-（在这里写你的推荐文字，自然地介绍 3 款游戏及推荐理由）
----推荐内容结束---
-
----游戏ID---
-ID1,ID2,ID3
----游戏ID结束---
-
----后续问题---
-问题1
-问题2
-问题3
----后续问题结束---
-
-注意：
-- 游戏ID 必须是候选列表中的 [ID:数字] 格式里的数字
-- 后续问题要与用户兴趣相关，引导用户探索更多游戏"""
-
-        user_prompt = f"""{context}
-
-【用户需求】
-{user_query}
-
-请根据用户需求，从候选列表中选择 3 款最合适的游戏进行推荐。
-记住：如果用户提到了"类似XX游戏"，不要推荐XX本身！"""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        packed, messages = self._selection_prompt(user_query, context_games)
         
         logger.info("[RAG] Step 5: 调用 LLM 生成回复...")
         
         # 生成回复
+        usage = PromptUsage()
+        prompt_usage.set(usage)
         raw_response = await self.chat_provider.chat(messages, stream=False)
         raw_response = raw_response if isinstance(raw_response, str) else ""
+        logger.info(f"[RAG] Prompt 统计: {usage.to_dict()}")
         
         logger.info(f"[RAG] LLM 原始回复长度: {len(raw_response)} 字符")
         
         # 解析响应（传入用户查询用于排除用户提到的游戏）
-        result = self._parse_recommendation_response(raw_response, context_games, user_query)
+        result = self._parse_recommendation_response(raw_response, packed.games, user_query)
         
         logger.info(f"[RAG] 解析完成，推荐游戏 IDs: {result['recommended_game_ids']}")
         logger.info(f"[RAG] 后续问题: {result['suggested_questions']}")
@@ -305,10 +402,120 @@ ID1,ID2,ID3
         
         return result
     
+    def retrieval_only_recommendation(self, user_query: str, context_games: List[GameCard]) -> Dict[str, Any]:
+        """
+        仅基于检索结果的推荐（不调用 LLM，聊天模型过载时的降级回复）
+        
+        按检索排名取前 3 个游戏（排除用户提到的游戏），返回格式与 generate_recommendation_with_selection 相同
+        """
+        excluded_titles = self._extract_game_titles_from_query(user_query)
+        games = [game for game in context_games if game.title not in excluded_titles][:3]
+        
+        if games:
+            lines = ["当前 AI 推荐服务繁忙，以下是与你的需求最相关的游戏："]
+            for i, game in enumerate(games):
+                line = f"{i + 1}. {game.title}"
+                if game.tags:
+                    line += f"（{'、'.join(game.tags[:3])}）"
+                lines.append(line)
+            response = "\n".join(lines)
+        else:
+            response = "当前 AI 推荐服务繁忙，暂时没有找到相关的游戏，请稍后重试。"
+        
+        return {
+            'response': response,
+            'recommended_game_ids': [game.id for game in games],
+            'suggested_questions': self._generate_default_questions(context_games)
+        }
+    
+    def _selection_prompt(
+        self,
+        user_query: str,
+        context_games: List[GameCard]
+    ) -> Tuple[PackedContext, List[Dict[str, str]]]:
+        """构建带选择的推荐提示（打包后的候选上下文 + 消息列表）"""
+        # 构建游戏列表上下文
+        packed = self.context_packer.pack(context_games, SELECTION_CONTEXT_HEADER, style="id")
+        
+        logger.info(
+            f"[RAG] 构建上下文，包含 {len(packed.games)}/{len(context_games)} 个候选游戏，"
+            f"约 {packed.tokens} tokens（{packed.compacted} 个省略简介）"
+        )
+        
+        # 构建提示 - 让 LLM 选择并排除用户提到的游戏（静态系统提示词在前，可复用前缀缓存）
+        return packed, selection_messages(packed.text, user_query)
+    
+    async def stream_recommendation_with_selection(
+        self,
+        user_query: str,
+        context_games: List[GameCard],
+        on_token: Optional[Callable[[], None]] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        流式生成游戏推荐（带智能选择）
+        
+        增量解析 LLM 的分段输出（相邻 token 按 SSE 合并配置合并后再解析），依次产生 (事件名, 数据)：
+        - token: {"text": 推荐文字片段}
+        - selected_ids: {"ids": 推荐的游戏 ID}（ID 段结束时；没有有效 ID 时在结束前从文字匹配）
+        - questions: {"questions": 后续问题}（问题段结束时；没有时在结束前生成默认问题）
+        - done: {"response": 完整推荐文字, "prompt_usage": prompt 统计}
+        
+        on_token: 每收到一个 LLM token 时调用
+        """
+        logger.info("[RAG] Step 4: 流式生成推荐回复（带智能选择）")
+        packed, messages = self._selection_prompt(user_query, context_games)
+        
+        usage = PromptUsage()
+        prompt_usage.set(usage)
+        parser = RecommendationStreamParser()
+        selected_ids: List[int] = []
+        questions: List[str] = []
+        
+        def convert(events: List[Tuple[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+            converted = []
+            for event, data in events:
+                if event == "token":
+                    converted.append(("token", {"text": data}))
+                elif event == "ids" and not selected_ids:
+                    selected_ids.extend(self._select_game_ids(data, packed.games, user_query))
+                    if selected_ids:
+                        converted.append(("selected_ids", {"ids": selected_ids}))
+                elif event == "questions" and not questions:
+                    questions.extend(self._parse_questions(data))
+                    if questions:
+                        converted.append(("questions", {"questions": questions}))
+            return converted
+        
+        stream = coalesce(
+            await self.chat_provider.chat(messages, stream=True),
+            settings.sse_coalesce_max_bytes,
+            settings.sse_coalesce_max_wait_ms,
+            on_chunk=on_token
+        )
+        try:
+            async for chunk in stream:
+                for item in convert(parser.feed(chunk)):
+                    yield item
+        finally:
+            # 调用方提前结束（客户端断开）时关闭到模型服务的流
+            await stream.aclose()
+        for item in convert(parser.close()):
+            yield item
+        
+        if not selected_ids:
+            self._match_games_in_text(parser.content, packed.games, user_query, selected_ids)
+            yield "selected_ids", {"ids": selected_ids}
+        if not questions:
+            questions = self._generate_default_questions(packed.games)
+            yield "questions", {"questions": questions}
+        
+        logger.info(f"[RAG] 流式生成完成，推荐游戏 IDs: {selected_ids}，Prompt 统计: {usage.to_dict()}")
+        yield "done", {"response": parser.content, "prompt_usage": usage.to_dict()}
+    
     def _parse_recommendation_response(
         self,
         raw_response: str,
-        context_games: List[Game],
+        context_games: List[GameCard],
         user_query: str = ""
     ) -> Dict[str, Any]:
         """解析 LLM 的推荐响应"""
@@ -347,33 +554,11 @@ ID1,ID2,ID3
             re.DOTALL
         )
         if id_match:
-            id_str = id_match.group(1).strip()
-            # 提取数字
-            ids = re.findall(r'\d+', id_str)
-            # 验证 ID 是否在候选游戏中，并排除用户提到的游戏
-            valid_game_ids = {game.id for game in context_games}
-            excluded_titles = self._extract_game_titles_from_query(user_query)
-            
-            for id_str in ids[:6]:  # 检查更多 ID 以防前面的被排除
-                game_id = int(id_str)
-                if game_id in valid_game_ids:
-                    # 检查这个游戏是否被用户提到
-                    game = next((g for g in context_games if g.id == game_id), None)
-                    if game and game.title not in excluded_titles:
-                        result['recommended_game_ids'].append(game_id)
-                        if len(result['recommended_game_ids']) >= 3:
-                            break
+            result['recommended_game_ids'] = self._select_game_ids(id_match.group(1), context_games, user_query)
         
         # 如果没有解析到足够的 ID，尝试从响应文字中提取提到的游戏
         if len(result['recommended_game_ids']) < 3:
-            excluded_titles = self._extract_game_titles_from_query(user_query)
-            for game in context_games:
-                if game.id not in result['recommended_game_ids']:
-                    if game.title in result['response'] and game.title not in excluded_titles:
-                        result['recommended_game_ids'].append(game.id)
-                        logger.info(f"[RAG] 从文字匹配到游戏: {game.title} (ID: {game.id})")
-                        if len(result['recommended_game_ids']) >= 3:
-                            break
+            self._match_games_in_text(result['response'], context_games, user_query, result['recommended_game_ids'])
         
         # 尝试解析后续问题
         questions_match = re.search(
@@ -382,12 +567,7 @@ ID1,ID2,ID3
             re.DOTALL
         )
         if questions_match:
-            questions_str = questions_match.group(1).strip()
-            # 按行分割
-            questions = [q.strip() for q in questions_str.split('\n') if q.strip()]
-            # 去掉可能的序号
-            questions = [re.sub(r'^[\d\.\)]+\s*', '', q) for q in questions]
-            result['suggested_questions'] = questions[:3]
+            result['suggested_questions'] = self._parse_questions(questions_match.group(1))
         
         # 如果没有解析到后续问题，生成默认问题
         if not result['suggested_questions']:
@@ -395,6 +575,51 @@ ID1,ID2,ID3
         
         return result
     
+    def _select_game_ids(self, id_text: str, context_games: List[GameCard], user_query: str) -> List[int]:
+        """从 ID 段文本中提取推荐的游戏 ID（只保留候选列表中的、排除用户提到的游戏，最多 3 个）"""
+        selected = []
+        # 提取数字
+        ids = re.findall(r'\d+', id_text.strip())
+        # 验证 ID 是否在候选游戏中，并排除用户提到的游戏
+        valid_game_ids = {game.id for game in context_games}
+        excluded_titles = self._extract_game_titles_from_query(user_query)
+        
+        for id_str in ids[:6]:  # 检查更多 ID 以防前面的被排除
+            game_id = int(id_str)
+            if game_id in valid_game_ids and game_id not in selected:
+                # 检查这个游戏是否被用户提到
+                game = next((g for g in context_games if g.id == game_id), None)
+                if game and game.title not in excluded_titles:
+                    selected.append(game_id)
+                    if len(selected) >= 3:
+                        break
+        return selected
+    
+    def _match_games_in_text(
+        self,
+        response_text: str,
+        context_games: List[GameCard],
+        user_query: str,
+        selected: List[int]
+    ):
+        """从推荐文字中匹配提到的候选游戏，补充到 selected（最多 3 个）"""
+        excluded_titles = self._extract_game_titles_from_query(user_query)
+        for game in context_games:
+            if game.id not in selected:
+                if game.title in response_text and game.title not in excluded_titles:
+                    selected.append(game.id)
+                    logger.info(f"[RAG] 从文字匹配到游戏: {game.title} (ID: {game.id})")
+                    if len(selected) >= 3:
+                        break
+    
+    @staticmethod
+    def _parse_questions(questions_text: str) -> List[str]:
+        """后续问题段文本按行分割，去掉序号"""
+        questions = [q.strip() for q in questions_text.strip().split('\n') if q.strip()]
+        # 去掉可能的序号
+        questions = [re.sub(r'^[\d\.\)]+\s*', '', q) for q in questions]
+        return questions[:3]
+    
     def _extract_game_titles_from_query(self, user_query: str) -> set:
         """
         从用户查询中提取可能提到的游戏名称
@@ -440,7 +665,7 @@ ID1,ID2,ID3
         logger.info(f"[RAG] 从用户查询中提取的排除游戏: {excluded}")
         return excluded
     
-    def _generate_default_questions(self, context_games: List[Game]) -> List[str]:
+    def _generate_default_questions(self, context_games: List[GameCard]) -> List[str]:
         """生成默认的后续问题"""
         questions = []
         
@@ -0,0 +1,134 @@
+"""
+推荐回复增量解析
+
+SELECTION_SYSTEM_PROMPT 要求 LLM 按分段格式输出：
+    
+    ---推荐内容开始--- 推荐文字 ---推荐内容结束---
+    ---游戏ID--- ID1,ID2,ID3 ---游戏ID结束---
+    ---后续问题--- 问题... ---后续问题结束---
+
+RecommendationStreamParser 是逐 token 驱动的状态机：推荐文字一到达就输出（去掉 [ID:数字] 标记），
+游戏 ID 段、后续问题段结束时各输出一次原始文本。分段标记和 ID 标记可能被拆在多个 token 中，
+可能构成标记前缀的尾部文本会暂存到下一个 token 到达后再判断。
+"""
+import re
+from typing import List, Tuple, Any
+
+# 分段标记名 -> 进入的状态
+SECTION_MARKERS = {
+    "推荐内容开始": "content",
+    "推荐内容结束": "between",
+    "游戏ID": "ids",
+    "游戏ID结束": "between",
+    "后续问题": "questions",
+    "后续问题结束": "between",
+}
+
+_MARKER_PATTERN = re.compile(r"---(" + "|".join(sorted(SECTION_MARKERS, key=len, reverse=True)) + r")---")
+_MARKER_STRINGS = [f"---{name}---" for name in SECTION_MARKERS]
+_MAX_MARKER_LENGTH = max(len(marker) for marker in _MARKER_STRINGS)
+
+# 推荐文字中的游戏 ID 标记（如 "**ID:76**"、"[ID:76]"）
+ID_MARK_PATTERN = re.compile(r"\*?\*?\[?ID:\d+\]?\*?\*?\s*")
+# 可能是未完整的 ID 标记的尾部
+_PARTIAL_ID_PATTERN = re.compile(r"\*{0,2}\[?(?:I|ID|ID:\d*)?\]?\*{0,2}")
+_PARTIAL_ID_LENGTH = 16
+
+# 没有出现「推荐内容开始」标记时，开头最多暂存的字符数，超过后按推荐文字输出
+PREAMBLE_LIMIT = 64
+
+
+class RecommendationStreamParser:
+    """推荐回复增量解析器"""
+    
+    def __init__(self):
+        # preamble -> content -> between -> ids / questions -> between ...
+        self.state = "preamble"
+        self._buffer = ""
+        self._section = ""
+        # 推荐文字末尾的空白，遇到后续文字时再输出（段落结束时丢弃）
+        self._pending_space = ""
+        self._content_started = False
+        self.content = ""
+    
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        输入一个 token，返回解析出的事件列表
+        
+        事件: ("token", 推荐文字片段) / ("ids", ID 段原始文本) / ("questions", 后续问题段原始文本)
+        """
+        self._buffer += chunk
+        return self._consume(final=False)
+    
+    def close(self) -> List[Tuple[str, Any]]:
+        """输入结束，输出暂存的文本和未闭合的分段"""
+        events = self._consume(final=True)
+        if self.state in ("ids", "questions"):
+            events.append((self.state, self._section))
+            self._section = ""
+        self.state = "between"
+        return events
+    
+    def _consume(self, final: bool) -> List[Tuple[str, Any]]:
+        events: List[Tuple[str, Any]] = []
+        while True:
+            match = _MARKER_PATTERN.search(self._buffer)
+            if match is None:
+                break
+            self._text(self._buffer[:match.start()], events)
+            self._switch(SECTION_MARKERS[match.group(1)], events)
+            self._buffer = self._buffer[match.end():]
+        
+        if self.state == "preamble" and not final and len(self._buffer) < PREAMBLE_LIMIT:
+            return events
+        if self.state == "preamble":
+            self.state = "content"
+        
+        hold = len(self._buffer) if final else self._hold_index(self._buffer)
+        self._text(self._buffer[:hold], events)
+        self._buffer = self._buffer[hold:]
+        return events
+    
+    def _hold_index(self, text: str) -> int:
+        """可能构成分段标记 / ID 标记前缀的尾部起始位置"""
+        for start in range(max(0, len(text) - _MAX_MARKER_LENGTH), len(text)):
+            if text[start] == "-" and any(marker.startswith(text[start:]) for marker in _MARKER_STRINGS):
+                return start
+        if self.state == "content":
+            for start in range(max(0, len(text) - _PARTIAL_ID_LENGTH), len(text)):
+                if text[start] in "*[I" and _PARTIAL_ID_PATTERN.fullmatch(text[start:]):
+                    return start
+        return len(text)
+    
+    def _switch(self, state: str, events: List[Tuple[str, Any]]):
+        if self.state in ("ids", "questions"):
+            events.append((self.state, self._section))
+        self._section = ""
+        if state != "content":
+            self._pending_space = ""
+        self.state = state
+    
+    def _text(self, text: str, events: List[Tuple[str, Any]]):
+        if not text:
+            return
+        if self.state in ("ids", "questions"):
+            self._section += text
+            return
+        if self.state != "content":
+            return
+        
+        text = ID_MARK_PATTERN.sub("", text)
+        if not self._content_started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._content_started = True
+        # 末尾空白暂存，后面还有推荐文字时再输出，段落结束时丢弃
+        stripped = text.rstrip()
+        if not stripped:
+            self._pending_space += text
+            return
+        out = self._pending_space + stripped
+        self._pending_space = text[len(stripped):]
+        self.content += out
+        events.append(("token", out))
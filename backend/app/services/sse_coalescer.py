@@ -0,0 +1,122 @@
+"""
+SSE token 合并
+
+LLM 流式接口通常每个 chunk 只有一个 token，逐个发送会产生大量很小的写操作和 TCP 报文。
+coalesce() 把 token 暂存起来，累计达到 max_bytes 字节或第一个暂存的 token 已等待 max_wait_ms 毫秒时
+（先到者为准）合并为一段文本输出，调用方每段发送一帧。max_wait_ms 远小于人眼可感知的延迟，
+对前端逐字显示没有可见影响。
+"""
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Any, Optional, List
+
+
+class CoalesceStats:
+    """合并统计"""
+    
+    def __init__(self):
+        self.chunks = 0
+        self.frames = 0
+        self.size_flushes = 0
+        self.time_flushes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chunks": self.chunks,
+            "frames": self.frames,
+            "chunks_per_frame": round(self.chunks / self.frames, 2) if self.frames else 0.0,
+            "size_flushes": self.size_flushes,
+            "time_flushes": self.time_flushes
+        }
+
+
+# 进程内汇总
+coalesce_stats = CoalesceStats()
+
+
+def format_sse_data(text: str, event: Optional[str] = None) -> str:
+    """
+    格式化一条 SSE 消息
+    
+    文本中的每一行各占一个 data: 字段（客户端按 \\n 拼回原文），避免 chunk 中的换行破坏帧边界。
+    """
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    frame = f"event: {event}\n" if event else ""
+    frame += "".join(f"data: {line}\n" for line in lines)
+    return frame + "\n"
+
+
+async def coalesce(
+    source: AsyncIterator[str],
+    max_bytes: int = 1024,
+    max_wait_ms: float = 40.0,
+    on_chunk: Optional[Callable[[], None]] = None
+) -> AsyncIterator[str]:
+    """
+    合并流式文本
+    
+    Args:
+        source: LLM 文本流
+        max_bytes: 暂存文本达到该字节数时立即输出，0 为不按大小输出
+        max_wait_ms: 第一个暂存的 chunk 最多等待的毫秒数，0 为不合并（逐个输出）
+        on_chunk: 每收到一个 source chunk 时调用（统计 token 数）
+    """
+    iterator = source.__aiter__()
+    loop = asyncio.get_running_loop()
+    max_wait = max(0.0, max_wait_ms) / 1000
+    buffer: List[str] = []
+    size = 0
+    deadline = 0.0
+    # 进行中的 __anext__ 任务；超时输出暂存文本后继续等待同一个任务，不打断 source
+    pending: Optional[asyncio.Future] = None
+    
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if buffer:
+                done, _ = await asyncio.wait({pending}, timeout=max(0.0, deadline - loop.time()))
+                if not done:
+                    coalesce_stats.time_flushes += 1
+                    coalesce_stats.frames += 1
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+                    continue
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+            
+            coalesce_stats.chunks += 1
+            if on_chunk is not None:
+                on_chunk()
+            if not chunk:
+                continue
+            if max_wait <= 0:
+                coalesce_stats.frames += 1
+                yield chunk
+                continue
+            if not buffer:
+                deadline = loop.time() + max_wait
+            buffer.append(chunk)
+            size += len(chunk.encode("utf-8"))
+            if max_bytes > 0 and size >= max_bytes:
+                coalesce_stats.size_flushes += 1
+                coalesce_stats.frames += 1
+                yield "".join(buffer)
+                buffer, size = [], 0
+        
+        if buffer:
+            coalesce_stats.frames += 1
+            yield "".join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,108 @@
+"""
+流式响应断开检测
+
+客户端（浏览器关闭标签页等）断开后，尽快停止拉取 LLM token 并关闭到模型服务的 HTTP 流，
+释放 Ollama / OpenAI / Anthropic 的生成容量：
+- Starlette 检测到 http.disconnect 时取消响应任务，取消沿生成器链传播；
+- 每发送一帧后按间隔调用 request.is_disconnected() 主动检查（服务器未及时通知断开时兜底）；
+- 无论哪种方式结束，都在屏蔽取消的作用域内关闭上游生成器，确保 httpx 流被关闭。
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict, Any
+
+import anyio
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+
+class StreamTracker:
+    """单个流式响应的进度（生成器中每收到一个 LLM token 调用 add_token）"""
+    
+    def __init__(self):
+        self.tokens = 0
+    
+    def add_token(self):
+        self.tokens += 1
+
+
+class StreamStats:
+    """流式响应统计"""
+    
+    def __init__(self):
+        self.streams = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.wasted_tokens = 0  # 客户端断开前已生成、未被完整读取的回复的 token 数
+        self.total_cancel_ms = 0.0  # 从开始到断开的总时长
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": self.streams,
+            "active": self.streams - self.completed - self.cancelled - self.failed,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "wasted_tokens": self.wasted_tokens,
+            "avg_tokens_before_cancel": round(self.wasted_tokens / self.cancelled, 1) if self.cancelled else 0.0,
+            "avg_ms_before_cancel": round(self.total_cancel_ms / self.cancelled, 1) if self.cancelled else 0.0
+        }
+
+
+# 进程内汇总
+stream_stats = StreamStats()
+
+
+async def guard_disconnect(
+    http_request: Request,
+    frames: AsyncIterator[str],
+    tracker: StreamTracker,
+    name: str,
+    poll_interval: float = 0.5
+) -> AsyncIterator[str]:
+    """
+    转发 SSE 帧，客户端断开时停止并关闭上游生成器
+    
+    Args:
+        http_request: 当前请求（检查连接状态）
+        frames: 产生 SSE 帧的生成器
+        tracker: frames 中记录 LLM token 数的进度对象
+        name: 日志名称
+        poll_interval: 主动检查断开的最小间隔（秒），0 为每帧都检查
+    """
+    stream_stats.streams += 1
+    start_time = time.perf_counter()
+    last_check = start_time
+    outcome = "failed"
+    try:
+        async for frame in frames:
+            yield frame
+            now = time.perf_counter()
+            if now - last_check >= poll_interval:
+                last_check = now
+                if await http_request.is_disconnected():
+                    outcome = "cancelled"
+                    return
+        outcome = "completed"
+    except (asyncio.CancelledError, GeneratorExit):
+        # 响应任务被取消（客户端断开）或发送失败后生成器被关闭
+        outcome = "cancelled"
+        raise
+    finally:
+        with anyio.CancelScope(shield=True):
+            await frames.aclose()
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        if outcome == "cancelled":
+            stream_stats.cancelled += 1
+            stream_stats.wasted_tokens += tracker.tokens
+            stream_stats.total_cancel_ms += elapsed_ms
+            logger.info(
+                f"[{name}] 客户端已断开，停止生成（已生成 {tracker.tokens} 个 token，{elapsed_ms:.0f}ms）"
+            )
+        elif outcome == "completed":
+            stream_stats.completed += 1
+        else:
+            stream_stats.failed += 1
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+评估向量检索后端的召回率和延迟
+
+以 game_embeddings 中随机抽样的向量作为查询，pgvector 全精度顺序扫描结果作为基准，
+计算各检索后端的 recall@k 以及查询延迟。
+"""
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.database import SessionLocal, AsyncSessionLocal
+from app.models.game_embedding import GameEmbedding
+from app.retrievers import PgvectorRetriever
+from app.services.rag_service import create_retriever
+from sqlalchemy import func
+
+
+def _percentile(values, percent: float) -> float:
+    """计算百分位数"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * percent))
+    return ordered[index]
+
+
+async def eval_retrieval(backends, queries: int = 50, k: int = 10):
+    """
+    评估检索后端
+    
+    Args:
+        backends: 待评估的后端名称列表
+        queries: 抽样查询数量
+        k: top-k
+    """
+    db = SessionLocal()
+    async_db = AsyncSessionLocal()
+    try:
+        rows = db.query(GameEmbedding.game_id, GameEmbedding.embedding_vector).filter(
+            GameEmbedding.embedding_vector.isnot(None)
+        ).order_by(func.random()).limit(queries).all()
+        
+        if not rows:
+            print("game_embeddings 中没有数据")
+            return
+        
+        query_vectors = []
+        for _, vector in rows:
+            if isinstance(vector, str):
+                vector = json.loads(vector)
+            query_vectors.append([float(x) for x in vector])
+        
+        print(f"抽样查询: {len(query_vectors)} 个, top-k: {k}")
+        print("=" * 60)
+        
+        # 基准：pgvector 全精度顺序扫描
+        exact = PgvectorRetriever()
+        ground_truth = []
+        exact_latencies = []
+        for vector in query_vectors:
+            start = time.perf_counter()
+            result = await exact.search(async_db, vector, k)
+            exact_latencies.append((time.perf_counter() - start) * 1000)
+            ground_truth.append({game_id for game_id, _ in result})
+        
+        print(f"{'后端':20s} {'recall@k':>10s} {'p50(ms)':>10s} {'p95(ms)':>10s}")
+        print(f"{'pgvector (exact)':20s} {1.0:>10.4f} "
+              f"{statistics.median(exact_latencies):>10.2f} {_percentile(exact_latencies, 0.95):>10.2f}")
+        
+        for backend in backends:
+            retriever = create_retriever(backend)
+            
+            # 进程内索引需要先构建（同步会话）
+            build_start = time.perf_counter()
+            retriever.sync(db)
+            build_ms = (time.perf_counter() - build_start) * 1000
+            
+            recalls = []
+            latencies = []
+            for vector, truth in zip(query_vectors, ground_truth):
+                start = time.perf_counter()
+                result = await retriever.search(async_db, vector, k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                found = {game_id for game_id, _ in result}
+                recalls.append(len(found & truth) / len(truth) if truth else 1.0)
+            
+            print(f"{backend:20s} {statistics.mean(recalls):>10.4f} "
+                  f"{statistics.median(latencies):>10.2f} {_percentile(latencies, 0.95):>10.2f}"
+                  f"  (索引构建/同步 {build_ms:.0f}ms)")
+        
+        print("=" * 60)
+    finally:
+        await async_db.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="评估向量检索后端的召回率和延迟")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["pgvector_halfvec", "hnsw"],
+        help="待评估的检索后端"
+    )
+    parser.add_argument("--queries", type=int, default=50, help="抽样查询数量")
+    parser.add_argument("-k", type=int, default=10, help="top-k")
+    
+    args = parser.parse_args()
+    
+    asyncio.run(eval_retrieval(args.backends, queries=args.queries, k=args.k))
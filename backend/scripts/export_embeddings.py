@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+导出 game_embeddings 快照（供 mmap 检索后端使用）
+
+输出到快照目录：
+- vectors.npy: L2 归一化后的连续向量矩阵 (float32 / float16)
+- ids.npy: 与向量行对应的 game_id 数组
+- manifest.json: 模型名、维度、数量、数据类型、导出时间
+"""
+import json
+import os
+import sys
+import logging
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from app.config import settings
+from app.database import SessionLocal
+from app.models.game_embedding import GameEmbedding
+from app.retrievers.mmap_retriever import VECTORS_FILE, IDS_FILE, MANIFEST_FILE
+from sqlalchemy import func
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def _to_array(vector) -> np.ndarray:
+    """将数据库返回的向量转换为 float32 数组（pgvector 未安装时为字符串）"""
+    if isinstance(vector, str):
+        vector = json.loads(vector)
+    return np.asarray(vector, dtype=np.float32)
+
+
+def export_embeddings(output_dir: str, dtype: str = "float32", batch_size: int = 1000):
+    """
+    导出 embedding 快照
+    
+    Args:
+        output_dir: 快照目录
+        dtype: 向量存储类型 float32 / float16
+        batch_size: 每次从数据库读取的行数
+    """
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    
+    db = SessionLocal()
+    try:
+        base_query = db.query(GameEmbedding).filter(
+            GameEmbedding.embedding_vector.isnot(None),
+            GameEmbedding.game_id.isnot(None)
+        )
+        total = base_query.count()
+        if total == 0:
+            print("game_embeddings 中没有数据")
+            return
+        
+        dimension = db.query(func.vector_dims(GameEmbedding.embedding_vector)).filter(
+            GameEmbedding.embedding_vector.isnot(None)
+        ).limit(1).scalar()
+        model_names = sorted(
+            row[0] for row in base_query.with_entities(GameEmbedding.model_name).distinct().all() if row[0]
+        )
+        
+        print(f"导出 {total} 条 embedding (维度 {dimension}, {dtype}, 模型 {model_names})")
+        
+        # 先写临时文件，完成后原子替换；已映射旧文件的进程不受影响
+        vectors_tmp = output / f"tmp.{VECTORS_FILE}"
+        ids_tmp = output / f"tmp.{IDS_FILE}"
+        vectors = np.lib.format.open_memmap(
+            vectors_tmp, mode="w+", dtype=np.dtype(dtype), shape=(total, dimension)
+        )
+        ids = np.empty(total, dtype=np.int64)
+        
+        count = 0
+        skipped = 0
+        rows = base_query.with_entities(
+            GameEmbedding.game_id, GameEmbedding.embedding_vector
+        ).order_by(GameEmbedding.game_id).yield_per(batch_size)
+        for game_id, vector in rows:
+            array = _to_array(vector)
+            if array.shape != (dimension,) or count >= total:
+                skipped += 1
+                continue
+            norm = np.linalg.norm(array)
+            vectors[count] = array / norm if norm > 0 else array
+            ids[count] = game_id
+            count += 1
+            if count % batch_size == 0:
+                print(f"  [{count}/{total}]")
+        
+        vectors.flush()
+        del vectors
+        
+        if count < total:
+            # 导出期间有行被删除或维度不一致，截断到实际行数
+            truncated_tmp = output / f"tmp.truncated.{VECTORS_FILE}"
+            source = np.load(vectors_tmp, mmap_mode="r")
+            truncated = np.lib.format.open_memmap(
+                truncated_tmp, mode="w+", dtype=source.dtype, shape=(count, dimension)
+            )
+            truncated[:] = source[:count]
+            truncated.flush()
+            del source, truncated
+            os.replace(truncated_tmp, vectors_tmp)
+        np.save(ids_tmp, ids[:count])
+        
+        os.replace(vectors_tmp, output / VECTORS_FILE)
+        os.replace(ids_tmp, output / IDS_FILE)
+        
+        manifest = {
+            "model_names": model_names,
+            "dimension": dimension,
+            "count": count,
+            "dtype": dtype,
+            "normalized": True,
+            "exported_at": datetime.now().isoformat()
+        }
+        # manifest 最后写入，检索后端以 manifest 变化作为重新加载的信号
+        manifest_tmp = output / f"{MANIFEST_FILE}.tmp"
+        with open(manifest_tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_tmp, output / MANIFEST_FILE)
+        
+        print("=" * 60)
+        print(f"导出完成: {count} 条, 跳过 {skipped} 条")
+        print(f"快照目录: {output.resolve()}")
+        print("=" * 60)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="导出 game_embeddings 快照 (mmap 检索后端)")
+    parser.add_argument("--output", default=settings.embedding_snapshot_dir, help="快照目录")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="向量存储类型")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每次从数据库读取的行数")
+    
+    args = parser.parse_args()
+    
+    export_embeddings(args.output, dtype=args.dtype, batch_size=args.batch_size)
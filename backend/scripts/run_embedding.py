@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """
 批量生成游戏 Embedding（包含价格、评论、媒体评分）
-支持逐个调用API避免OOM
+按事务批次批量调用 API，服务端 OOM / 超时时自动缩小批次
 """
 import asyncio
 import json
@@ -16,6 +16,7 @@ from app.database import SessionLocal
 from app.models.game import Game
 from app.models.game_embedding import GameEmbedding
 from app.services.embedding_service import EmbeddingService
+from app.model_providers import create_embedding_provider
 from sqlalchemy import text
 
 # 配置日志
@@ -26,17 +27,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def batch_embed_games(limit: int = None, batch_size: int = 10, skip_existing: bool = True):
+async def batch_embed_games(limit: int = None, batch_size: int = 32, skip_existing: bool = True):
     """
     批量生成游戏 embedding
     
     Args:
         limit: 限制处理的游戏数量
-        batch_size: 每批提交事务的游戏数量（不是API调用批次）
+        batch_size: 每批提交事务的游戏数量（API 请求批次由 EMBEDDING_MAX_BATCH_SIZE 控制）
         skip_existing: 是否跳过已有embedding的游戏
     """
     db = SessionLocal()
-    embedding_service = EmbeddingService()
+    # 离线批量任务直接使用未包装的 provider：不受在线查询的截止时间 / 熔断约束，
+    # 超时由 HTTP 客户端控制并触发批次缩小，批量请求的耗时也不计入对冲延迟统计
+    provider = create_embedding_provider()
+    embedding_service = EmbeddingService(provider=provider)
     
     try:
         # 获取所有游戏
@@ -70,134 +74,128 @@ async def batch_embed_games(limit: int = None, batch_size: int = 10, skip_existi
         
         processed = 0
         failed = 0
+        model_name = embedding_service.provider.model_name
         
-        # 逐个处理游戏（避免OOM），但按批次提交事务
-        for idx, game in enumerate(games, 1):
-            try:
-                # 生成 embedding（包含价格、评论、媒体评分）
-                logger.info(f"[{idx}/{total}] 开始处理游戏 {game.id} ({game.title[:30]})")
-                
-                embedding_vector, chunk_text = await embedding_service.embed_game(game, db)
-                
-                # 详细日志：检查 embedding_vector 的结构
-                logger.debug(f"  embedding_vector type: {type(embedding_vector)}")
-                logger.debug(f"  embedding_vector length: {len(embedding_vector) if embedding_vector else 'None'}")
-                if embedding_vector and len(embedding_vector) > 0:
-                    logger.debug(f"  first element type: {type(embedding_vector[0])}")
-                    logger.debug(f"  first 5 elements: {embedding_vector[:5]}")
-                    logger.debug(f"  last 5 elements: {embedding_vector[-5:]}")
-                
-                if not embedding_vector or len(embedding_vector) == 0:
-                    print(f"  [{idx}/{total}] ⚠️  游戏 {game.id} ({game.title[:30]}) embedding 为空，跳过")
-                    failed += 1
-                    continue
-                
-                # 验证向量维度
-                if len(embedding_vector) != 2560:
-                    logger.error(
-                        f"  [{idx}/{total}] 向量维度错误: {len(embedding_vector)} (期望: 2560)\n"
-                        f"  chunk_text 长度: {len(chunk_text) if chunk_text else 'None'}\n"
-                        f"  chunk_text 前200字符: {chunk_text[:200] if chunk_text else 'None'}"
-                    )
-                    print(f"  [{idx}/{total}] ⚠️  游戏 {game.id} 向量维度错误: {len(embedding_vector)} (期望: 2560)")
+        # 按事务批次处理：先构建整批文本，再交给 provider 批量生成 embedding
+        # （provider 按 EMBEDDING_MAX_BATCH_SIZE / TOKENS 切分请求，服务端 OOM 时自动缩小批次）
+        for batch_start in range(0, total, batch_size):
+            batch_games = games[batch_start:batch_start + batch_size]
+            
+            chunks = []
+            for idx, game in enumerate(batch_games, batch_start + 1):
+                try:
+                    chunks.append((idx, game, embedding_service.build_game_chunk(game, db)))
+                except Exception as e:
+                    logger.exception(f"  [{idx}/{total}] 构建文本失败: {game.id}")
+                    print(f"  [{idx}/{total}] ❌ {game.id} ({game.title[:30] if game.title else 'N/A'}) 失败: {str(e)}")
                     failed += 1
-                    continue
-                
-                # 转换 embedding 为字符串格式 (pgvector 需要)
-                embedding_str = "[" + ",".join(map(str, embedding_vector)) + "]"
-                
-                # 准备 metadata JSON 字符串（修复：dict 需要转换为 JSON 字符串）
-                metadata_dict = {
-                    "game_id": game.id,
-                    "external_id": game.external_id,
-                    "title": game.title
-                }
-                metadata_json_str = json.dumps(metadata_dict, ensure_ascii=False)
-                
-                # 检查是否已存在
-                existing = db.query(GameEmbedding).filter(
-                    GameEmbedding.game_id == game.id
-                ).first()
-                
-                if existing:
-                    # 更新
-                    db.execute(
-                        text("""
-                            UPDATE game_embeddings 
-                            SET embedding_vector = CAST(:vec AS vector),
-                                chunk_text = :text,
-                                model_name = :model,
-                                metadata_json = CAST(:metadata AS jsonb)
-                            WHERE game_id = :game_id
-                        """),
-                        {
-                            "vec": embedding_str,
-                            "text": chunk_text,
-                            "model": embedding_service.provider.model_name,
-                            "metadata": metadata_json_str,
-                            "game_id": game.id
-                        }
-                    )
-                    print(f"  [{idx}/{total}] ✓ 更新 {game.id} ({game.title[:30]})")
-                else:
-                    # 插入
-                    db.execute(
-                        text("""
-                            INSERT INTO game_embeddings 
-                            (game_id, embedding_vector, chunk_text, model_name, metadata_json)
-                            VALUES (:game_id, CAST(:vec AS vector), :text, :model, CAST(:metadata AS jsonb))
-                        """),
-                        {
-                            "game_id": game.id,
-                            "vec": embedding_str,
-                            "text": chunk_text,
-                            "model": embedding_service.provider.model_name,
-                            "metadata": metadata_json_str
-                        }
-                    )
-                    print(f"  [{idx}/{total}] ✓ 创建 {game.id} ({game.title[:30]})")
-                
-                processed += 1
-                
-                # 每处理 batch_size 个游戏提交一次事务
-                if processed % batch_size == 0:
-                    try:
-                        db.commit()
-                        print(f"  → 已提交 {processed} 个游戏")
-                    except Exception as e:
-                        logger.error(f"  提交失败: {str(e)}")
-                        print(f"  ❌ 提交失败: {str(e)}")
-                        db.rollback()
-                        # 提交失败不影响继续处理，但需要减少成功计数
-                        processed -= batch_size
-                        failed += batch_size
+            if not chunks:
+                continue
+            
+            try:
+                embeddings = await embedding_service.provider.embed_texts([chunk for _, _, chunk in chunks])
+            except Exception as e:
+                logger.exception(f"  批次 {batch_start + 1}-{batch_start + len(batch_games)} 生成 embedding 失败")
+                print(f"  ❌ 批次 {batch_start + 1}-{batch_start + len(batch_games)} 失败: {str(e)}")
+                failed += len(chunks)
+                continue
+            
+            written = 0
+            try:
+                for (idx, game, chunk_text), embedding_vector in zip(chunks, embeddings):
+                    if not embedding_vector:
+                        print(f"  [{idx}/{total}] ⚠️  游戏 {game.id} ({game.title[:30]}) embedding 为空，跳过")
+                        failed += 1
+                        continue
+                    
+                    # 验证向量维度
+                    if len(embedding_vector) != 2560:
+                        logger.error(
+                            f"  [{idx}/{total}] 向量维度错误: {len(embedding_vector)} (期望: 2560)\n"
+                            f"  chunk_text 长度: {len(chunk_text) if chunk_text else 'None'}\n"
+                            f"  chunk_text 前200字符: {chunk_text[:200] if chunk_text else 'None'}"
+                        )
+                        print(f"  [{idx}/{total}] ⚠️  游戏 {game.id} 向量维度错误: {len(embedding_vector)} (期望: 2560)")
+                        failed += 1
+                        continue
+                    
+                    # 转换 embedding 为字符串格式 (pgvector 需要)
+                    embedding_str = "[" + ",".join(map(str, embedding_vector)) + "]"
+                    
+                    # 准备 metadata JSON 字符串（修复：dict 需要转换为 JSON 字符串）
+                    metadata_dict = {
+                        "game_id": game.id,
+                        "external_id": game.external_id,
+                        "title": game.title
+                    }
+                    metadata_json_str = json.dumps(metadata_dict, ensure_ascii=False)
+                    
+                    # 检查是否已存在
+                    existing = db.query(GameEmbedding).filter(
+                        GameEmbedding.game_id == game.id
+                    ).first()
+                    
+                    if existing:
+                        # 更新
+                        db.execute(
+                            text("""
+                                UPDATE game_embeddings 
+                                SET embedding_vector = CAST(:vec AS vector),
+                                    chunk_text = :text,
+                                    model_name = :model,
+                                    metadata_json = CAST(:metadata AS jsonb),
+                                    updated_at = NOW()
+                                WHERE game_id = :game_id
+                            """),
+                            {
+                                "vec": embedding_str,
+                                "text": chunk_text,
+                                "model": model_name,
+                                "metadata": metadata_json_str,
+                                "game_id": game.id
+                            }
+                        )
+                        print(f"  [{idx}/{total}] ✓ 更新 {game.id} ({game.title[:30]})")
+                    else:
+                        # 插入
+                        db.execute(
+                            text("""
+                                INSERT INTO game_embeddings 
+                                (game_id, embedding_vector, chunk_text, model_name, metadata_json)
+                                VALUES (:game_id, CAST(:vec AS vector), :text, :model, CAST(:metadata AS jsonb))
+                            """),
+                            {
+                                "game_id": game.id,
+                                "vec": embedding_str,
+                                "text": chunk_text,
+                                "model": model_name,
+                                "metadata": metadata_json_str
+                            }
+                        )
+                        print(f"  [{idx}/{total}] ✓ 创建 {game.id} ({game.title[:30]})")
+                    written += 1
                 
+                # 每个批次提交一次事务
+                db.commit()
+                processed += written
+                print(f"  → 已提交 {processed} 个游戏")
             except Exception as e:
-                logger.exception(f"  [{idx}/{total}] 处理失败: {game.id} ({game.title[:30] if game.title else 'N/A'})")
-                print(f"  [{idx}/{total}] ❌ {game.id} ({game.title[:30] if game.title else 'N/A'}) 失败: {str(e)}")
-                failed += 1
-                # 单个游戏失败后 rollback，确保后续操作在干净的事务中
+                logger.exception(f"  批次 {batch_start + 1}-{batch_start + len(batch_games)} 写入失败")
+                print(f"  ❌ 提交失败: {str(e)}")
+                failed += written
+                # 批次失败后 rollback，确保后续操作在干净的事务中
                 try:
                     db.rollback()
                 except:
                     pass
-                continue
-        
-        # 提交剩余的游戏（如果有）
-        if processed > 0 and processed % batch_size != 0:
-            try:
-                db.commit()
-                print(f"  → 已提交剩余 {processed % batch_size} 个游戏")
-            except Exception as e:
-                logger.error(f"  最终提交失败: {str(e)}")
-                print(f"  ❌ 最终提交失败: {str(e)}")
-                db.rollback()
         
         print(f"\n{'='*60}")
         print(f"处理完成!")
         print(f"  总计: {total} 个游戏")
         print(f"  成功: {processed} 个")
         print(f"  失败: {failed} 个")
+        if hasattr(embedding_service.provider, "batch_stats"):
+            print(f"  批量统计: {embedding_service.provider.batch_stats()}")
         print(f"{'='*60}")
         
     except Exception as e:
@@ -206,6 +204,7 @@ async def batch_embed_games(limit: int = None, batch_size: int = 10, skip_existi
         db.rollback()
     finally:
         db.close()
+        await provider.aclose()
 
 
 if __name__ == "__main__":
@@ -213,7 +212,7 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="批量生成游戏 Embedding")
     parser.add_argument("--limit", type=int, help="限制处理的游戏数量")
-    parser.add_argument("--batch-size", type=int, default=10, help="每批提交事务的游戏数量")
+    parser.add_argument("--batch-size", type=int, default=32, help="每批提交事务的游戏数量")
     parser.add_argument("--force", action="store_true", help="强制重新生成已有embedding")
     parser.add_argument("--debug", action="store_true", help="启用调试模式")
     
@@ -17,6 +17,7 @@ CREATE INDEX IF NOT EXISTS idx_game_embeddings_model ON game_embeddings(model_na
 
 -- 向量索引 (使用 ivfflat 加速相似度搜索)
 -- 注意: 需要先有数据才能创建向量索引
+-- 注意: vector 类型的索引最多支持 2000 维，2560 维请使用 011_add_game_embeddings_halfvec.sql 的 halfvec 索引
 -- CREATE INDEX IF NOT EXISTS idx_game_embeddings_vector ON game_embeddings 
 -- USING ivfflat (embedding_vector vector_cosine_ops) WITH (lists = 100);
 
@@ -0,0 +1,14 @@
+-- 添加 updated_at 字段到 game_embeddings 表
+-- 用于进程内向量索引 (HNSW) 增量同步：识别新增 / 重新生成的 embedding
+
+-- 添加 updated_at 字段
+ALTER TABLE game_embeddings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+
+-- 回填已有数据
+UPDATE game_embeddings SET updated_at = created_at WHERE updated_at IS NULL;
+
+-- 创建索引用于按更新时间增量扫描
+CREATE INDEX IF NOT EXISTS idx_game_embeddings_updated_at ON game_embeddings(updated_at);
+
+-- 添加注释
+COMMENT ON COLUMN game_embeddings.updated_at IS 'embedding 最后一次写入时间（插入或重新生成）';
@@ -0,0 +1,18 @@
+-- 为 game_embeddings 添加可索引的半精度向量列 (halfvec)
+-- 原因: vector 类型的 ivfflat / hnsw 索引最多支持 2000 维，2560 维的 embedding_vector 无法建索引；
+--       halfvec 的索引上限为 4000 维，可以建立 HNSW 索引
+-- 检索方式: 先在 embedding_halfvec 上走 HNSW 索引取候选集，再用全精度 embedding_vector 精排
+-- 需要 pgvector >= 0.7.0
+
+-- 添加生成列（由 embedding_vector 自动计算，写入 embedding_vector 时自动维护，无需修改写入代码）
+-- 注意: 如需重新执行 008_alter_embedding_dimension.sql，请先删除此列
+ALTER TABLE game_embeddings
+    ADD COLUMN IF NOT EXISTS embedding_halfvec halfvec(2560)
+    GENERATED ALWAYS AS (embedding_vector::halfvec(2560)) STORED;
+
+-- HNSW 索引（余弦距离）
+CREATE INDEX IF NOT EXISTS idx_game_embeddings_halfvec_hnsw ON game_embeddings
+USING hnsw (embedding_halfvec halfvec_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- 添加注释
+COMMENT ON COLUMN game_embeddings.embedding_halfvec IS 'embedding_vector 的半精度副本，用于 HNSW 索引候选检索';
@@ -0,0 +1,15 @@
+-- 创建 catalog_version 表
+-- 游戏目录版本号：爬虫写入 games 后递增，服务端据此判断进程内目录缓存是否需要重新加载
+
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 初始化唯一的一行
+INSERT INTO catalog_version (id, version) VALUES (1, 1) ON CONFLICT (id) DO NOTHING;
+
+-- 添加注释
+COMMENT ON TABLE catalog_version IS '游戏目录版本（单行表）';
+COMMENT ON COLUMN catalog_version.version IS '目录版本号，CrawlerService.save_games_to_db 写入后递增';
@@ -22,6 +22,9 @@
 
 -- 迁移脚本：修改已有表结构
 \i database/init/007_alter_game_embeddings_metadata.sql
+\i database/init/010_add_game_embeddings_updated_at.sql
+\i database/init/011_add_game_embeddings_halfvec.sql
+\i database/init/012_create_catalog_version.sql
 
 -- 后续阶段表 (Phase 2 & 3)
 -- reviews 表 - 游戏评论数据 (Phase 3)
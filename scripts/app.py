@@ -1,9 +1,12 @@
-# 依赖：pip install mlx mlx-lm fastapi uvicorn pydantic langchain-core
+# 依赖：pip install mlx mlx-lm fastapi uvicorn pydantic langchain-core numpy
+import base64
+import io
 import mlx.core as mx
+import numpy as np
 from mlx_lm import load
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal
 from langchain_core.embeddings import Embeddings
 import logging
 
@@ -48,16 +51,14 @@ class QwenMLXEmbeddings(Embeddings):
         norm = mx.maximum(norm, 1e-8)
         return x / norm
 
-    def _get_embedding(self, text: str) -> List[float]:
-        full_text = self.instruct_prefix + text
-        
-        # 正确 tokenization：用 tokenizer.encode (返回 list[int])
-        input_ids = self.tokenizer.encode(full_text)
-        logger.debug(f"输入文本长度: {len(text)}, token 数量: {len(input_ids)}")
-        
-        input_ids_mx = mx.array([input_ids])  # shape (1, seq_len)
-        logger.debug(f"input_ids shape: {input_ids_mx.shape}")
+    def _pad_token_id(self) -> int:
+        pad_id = getattr(self.tokenizer, "pad_token_id", None)
+        if pad_id is None:
+            pad_id = getattr(self.tokenizer, "eos_token_id", None)
+        return pad_id or 0
 
+    def _forward(self, input_ids_mx: mx.array) -> mx.array:
+        """前向计算，返回 hidden states (batch_size, seq_len, hidden_dim)"""
         # 获取 hidden states 而非 logits
         # mlx_lm 的模型结构: model(input_ids) 返回 logits
         # 需要使用 model.model(input_ids) 获取 hidden states
@@ -66,38 +67,58 @@ class QwenMLXEmbeddings(Embeddings):
             hidden_states = self.inner_model(input_ids_mx)
             logger.debug(f"hidden_states type: {type(hidden_states)}")
             logger.debug(f"hidden_states shape: {hidden_states.shape}")
-        else:
-            # 如果没有内部模型，尝试其他方式
-            # 某些模型可能有 embed 或 get_input_embeddings 方法
-            if hasattr(self.model, 'embed_tokens'):
-                # 尝试使用 embed_tokens（这是 token embedding 层）
-                logger.info("使用 embed_tokens 方法")
-                hidden_states = self.model.embed_tokens(input_ids_mx)
-            else:
-                # 最后尝试：直接使用模型输出（可能是 logits）
-                logger.warning("无法获取 hidden states，使用模型输出")
-                outputs = self.model(input_ids_mx)
-                logger.debug(f"outputs shape: {outputs.shape}")
-                
-                # 检查输出维度，如果是 vocab_size，则无法使用
-                if outputs.shape[-1] > 10000:  # vocab_size 通常很大
-                    raise ValueError(
-                        f"模型输出是 logits (shape: {outputs.shape})，无法用于 embedding。"
-                        f"请检查模型结构或使用专门的 embedding 模型。"
-                    )
-                hidden_states = outputs
-        
+            return hidden_states
+
+        # 如果没有内部模型，尝试其他方式
+        # 某些模型可能有 embed 或 get_input_embeddings 方法
+        if hasattr(self.model, 'embed_tokens'):
+            # 尝试使用 embed_tokens（这是 token embedding 层）
+            logger.info("使用 embed_tokens 方法")
+            return self.model.embed_tokens(input_ids_mx)
+
+        # 最后尝试：直接使用模型输出（可能是 logits）
+        logger.warning("无法获取 hidden states，使用模型输出")
+        outputs = self.model(input_ids_mx)
+        logger.debug(f"outputs shape: {outputs.shape}")
+
+        # 检查输出维度，如果是 vocab_size，则无法使用
+        if outputs.shape[-1] > 10000:  # vocab_size 通常很大
+            raise ValueError(
+                f"模型输出是 logits (shape: {outputs.shape})，无法用于 embedding。"
+                f"请检查模型结构或使用专门的 embedding 模型。"
+            )
+        return outputs
+
+    def _get_embeddings_array(self, texts: List[str]) -> mx.array:
+        """
+        一次前向计算生成一批文本的 embedding，返回归一化后的 (batch_size, hidden_dim) 数组
+
+        右侧补齐 padding：因果注意力下真实 token 看不到其后的 padding，
+        取每条文本最后一个真实 token 的 hidden state 即可 (last token pooling)。
+        """
+        # 正确 tokenization：用 tokenizer.encode (返回 list[int])
+        token_lists = [self.tokenizer.encode(self.instruct_prefix + text) for text in texts]
+        lengths = [len(tokens) for tokens in token_lists]
+        max_len = max(lengths)
+        pad_id = self._pad_token_id()
+        logger.debug(f"批次 {len(texts)} 条，token 数量: {lengths}")
+
+        input_ids_mx = mx.array([tokens + [pad_id] * (max_len - len(tokens)) for tokens in token_lists])
+        logger.debug(f"input_ids shape: {input_ids_mx.shape}")
+
+        hidden_states = self._forward(input_ids_mx)
+
         # hidden_states shape: (batch_size, seq_len, hidden_dim)
-        # 取最后一个 token 的 hidden state (last token pooling)
+        # 取每条文本最后一个真实 token 的 hidden state (last token pooling)
         if hidden_states.ndim == 3:
-            last_hidden = hidden_states[:, -1, :]  # shape: (1, hidden_dim)
-        elif hidden_states.ndim == 2:
+            last_hidden = hidden_states[mx.arange(len(texts)), mx.array(lengths) - 1]  # shape: (batch_size, hidden_dim)
+        elif hidden_states.ndim == 2 and len(texts) == 1:
             last_hidden = hidden_states[-1:, :]  # shape: (1, hidden_dim)
         else:
             raise ValueError(f"Unexpected hidden_states ndim: {hidden_states.ndim}")
-        
+
         logger.debug(f"last_hidden shape: {last_hidden.shape}")
-        
+
         # 验证 hidden_dim
         if last_hidden.shape[-1] != self.dimension:
             logger.error(
@@ -108,37 +129,33 @@ class QwenMLXEmbeddings(Embeddings):
             actual_dim = last_hidden.shape[-1]
             logger.warning(f"将使用实际维度 {actual_dim} 替代预期维度 {self.dimension}")
             self.dimension = actual_dim
-        
+
         # 手动归一化
         normalized = self._normalize(last_hidden)
         logger.debug(f"normalized shape: {normalized.shape}")
-        
-        # 转换为 Python list
-        # normalized shape: (1, hidden_dim)
-        # tolist() 返回 [[...]]，需要取 [0]
-        embedding_nested = normalized.tolist()
-        
-        if isinstance(embedding_nested, list) and len(embedding_nested) > 0:
-            if isinstance(embedding_nested[0], list):
-                # 正常情况：[[...]]
-                embedding = embedding_nested[0]
-            else:
-                # 已经是 1D list
-                embedding = embedding_nested
-        else:
-            raise ValueError(f"Unexpected embedding format: {type(embedding_nested)}")
-        
-        logger.debug(f"成功生成 embedding，维度: {len(embedding)}")
-        return embedding
+        return normalized
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        embeddings = []
+    def _get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # 转换为 Python list，shape: (batch_size, hidden_dim)
+        embeddings = self._get_embeddings_array(texts).tolist()
+        logger.debug(f"成功生成 {len(embeddings)} 个 embedding，维度: {len(embeddings[0])}")
+        return embeddings
+
+    def _get_embedding(self, text: str) -> List[float]:
+        return self._get_embeddings([text])[0]
+
+    def embed_documents_array(self, texts: List[str], dtype: str = "float32") -> np.ndarray:
+        """批量生成 embedding，返回 (len(texts), hidden_dim) 的 NumPy 数组（二进制传输用）"""
+        batches = []
         for i in range(0, len(texts), self.batch_size):
             batch = texts[i:i + self.batch_size]
-            for j, text in enumerate(batch):
-                logger.info(f"处理文本 {i+j+1}/{len(texts)}，长度: {len(text)}")
-                embeddings.append(self._get_embedding(text))
-        return embeddings
+            logger.info(f"处理文本 {i+1}-{i+len(batch)}/{len(texts)}，长度: {[len(text) for text in batch]}")
+            array = self._get_embeddings_array(batch).astype(mx.float16 if dtype == "float16" else mx.float32)
+            batches.append(np.array(array))
+        return np.concatenate(batches, axis=0)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents_array(texts).tolist()
 
     def embed_query(self, text: str) -> List[float]:
         return self._get_embedding(text)
@@ -149,16 +166,43 @@ app = FastAPI(title="Qwen3 Embedding API", description="Local API for Qwen3-Embe
 # 全局初始化（加载一次模型）
 embeddings = QwenMLXEmbeddings()
 
+# 二进制响应格式（通过 Accept 头协商）：.npy 字节，小端序，带 shape / dtype 头
+NPY_MEDIA_TYPE = "application/x-npy"
+
 class EmbedRequest(BaseModel):
     texts: List[str]
+    # JSON 响应的编码：float 为浮点数列表，base64 为小端序原始字节
+    encoding_format: Literal["float", "base64"] = "float"
+    # 二进制 / base64 响应的数据类型
+    dtype: Literal["float32", "float16"] = "float32"
 
 @app.post("/embed")
-async def embed(request: EmbedRequest):
+async def embed(request: EmbedRequest, http_request: Request):
     logger.info(f"收到请求，文本数量: {len(request.texts)}")
     for i, text in enumerate(request.texts):
         logger.debug(f"  文本 {i+1} 长度: {len(text)}, 前100字符: {text[:100]}")
     
     try:
+        binary = NPY_MEDIA_TYPE in http_request.headers.get("accept", "")
+        if binary or request.encoding_format == "base64":
+            array = embeddings.embed_documents_array(request.texts, dtype=request.dtype)
+            array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+            if binary:
+                buffer = io.BytesIO()
+                np.save(buffer, array, allow_pickle=False)
+                return Response(
+                    content=buffer.getvalue(),
+                    media_type=NPY_MEDIA_TYPE,
+                    headers={"X-Embedding-Dimension": str(embeddings.dimension)}
+                )
+            return {
+                "embeddings": base64.b64encode(array.tobytes()).decode("ascii"),
+                "encoding_format": "base64",
+                "dtype": request.dtype,
+                "shape": list(array.shape),
+                "dimension": embeddings.dimension
+            }
+        
         embs = embeddings.embed_documents(request.texts)
         
         # 验证返回的 embeddings
@@ -169,6 +213,10 @@ async def embed(request: EmbedRequest):
         return {"embeddings": embs, "dimension": embeddings.dimension}
     except Exception as e:
         logger.exception(f"生成 embedding 失败")
+        message = str(e)
+        if any(marker in message.lower() for marker in ("out of memory", "unable to allocate", "metal::malloc")):
+            # 返回 507，客户端据此缩小批次重试
+            raise HTTPException(status_code=507, detail=f"out of memory: {message[:200]}")
         raise
 
 if __name__ == "__main__":